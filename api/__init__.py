@@ -1 +1,23 @@
-from . import server, twitter_api, config
+from . import (
+    server,
+    twitter_api,
+    config,
+    upstream,
+    cache,
+    singleflight,
+    throttle,
+    breaker,
+    budget,
+    errors,
+    hedging,
+    limiter,
+    codec,
+    compression,
+    deadline,
+    models,
+    metrics,
+    tracing,
+    workers,
+    store,
+    prefetch,
+)
@@ -1,5 +1,20 @@
-from aiohttp import web
-from . import server
+import argparse
+import logging
+
+from . import server, tracing, workers
 
 if __name__ == "__main__":
-    web.run_app(server.make_app())
+    parser = argparse.ArgumentParser(prog="python -m api")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=8080)
+    workers.add_arguments(parser)
+    args = parser.parse_args()
+
+    # Trace and worker entries are printed like the access log unless logging
+    # is set up
+    for logger in [tracing.logger, workers.logger]:
+        if not logger.hasHandlers():
+            logger.setLevel(logging.INFO)
+            logger.addHandler(logging.StreamHandler())
+
+    workers.serve(server.make_app(), "api", args)
@@ -0,0 +1,95 @@
+import math
+
+from collections import deque
+from time import monotonic
+from typing import Deque, Optional
+
+from . import config
+from .errors import ApiError
+
+# Upstream endpoints failing most of their recent calls are given a rest: calls
+# are rejected right away while the breaker is open, then a few calls probe the
+# endpoint and close the breaker again once they all succeed
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = [CLOSED, OPEN, HALF_OPEN]
+
+
+class CircuitOpen(ApiError):
+    def __init__(self, family: str, wait: float):
+        super().__init__(
+            f"Twitter API error: {family} is unavailable",
+            status=503,
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+class Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        # Outcomes of the last calls while closed, True for failures
+        self.outcomes: Deque[bool] = deque()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.successes = 0
+        self.opens = 0
+        self.rejections = 0
+
+    def current(self) -> str:
+        if (
+            self.state == OPEN
+            and monotonic() - self.opened_at >= config.BREAKER_OPEN_TIME
+        ):
+            self.state = HALF_OPEN
+            self.probes = self.successes = 0
+        return self.state
+
+    def allow(self) -> bool:
+        state = self.current()
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self.probes < config.BREAKER_HALF_OPEN_CALLS:
+            self.probes += 1
+            return True
+        self.rejections += 1
+        return False
+
+    def retry_after(self) -> float:
+        return max(0, self.opened_at + config.BREAKER_OPEN_TIME - monotonic())
+
+    def record(self, failed: Optional[bool]):
+        # Calls ending without an outcome, like cancelled ones, only give
+        # their probe back
+        if self.state == HALF_OPEN:
+            if failed is None:
+                self.probes = max(0, self.probes - 1)
+            elif failed:
+                self.open()
+            else:
+                self.successes += 1
+                if self.successes >= config.BREAKER_HALF_OPEN_CALLS:
+                    self.state = CLOSED
+            return
+
+        if self.state == OPEN or failed is None:
+            return
+        self.outcomes.append(failed)
+        self.failures += failed
+        if len(self.outcomes) > config.BREAKER_WINDOW:
+            self.failures -= self.outcomes.popleft()
+        calls = len(self.outcomes)
+        if (
+            calls >= config.BREAKER_MIN_CALLS
+            and self.failures >= config.BREAKER_FAILURE_RATE * calls
+        ):
+            self.open()
+
+    def open(self):
+        self.state = OPEN
+        self.opened_at = monotonic()
+        self.opens += 1
+        self.outcomes.clear()
+        self.failures = 0
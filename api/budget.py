@@ -0,0 +1,114 @@
+import asyncio
+import math
+
+from contextvars import ContextVar
+from time import time
+from typing import Mapping, Optional
+
+from . import config, cache, errors
+
+
+class Budget:
+    __slots__ = ("limit", "remaining", "reset_at", "next_at", "prefetched")
+
+    def __init__(self, limit: int, remaining: int, reset_at: float):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+        self.next_at = 0.0
+        # Calls made by prefetches in the current window
+        self.prefetched = 0
+
+
+# Set while prefetches run, their calls are counted apart from client calls
+prefetching: ContextVar[bool] = ContextVar("prefetching", default=False)
+
+
+def exhausted_error(family: str, wait: float) -> errors.ApiError:
+    return errors.ApiError(
+        f"Twitter API error: Rate limit exhausted for {family}",
+        status=429,
+        headers={"Retry-After": str(math.ceil(wait))},
+    )
+
+
+class BudgetTracker:
+    def __init__(
+        self,
+        max_wait: float = config.UPSTREAM_BUDGET_MAX_WAIT,
+        pacing_threshold: int = config.UPSTREAM_BUDGET_PACING_THRESHOLD,
+        max_tokens: int = config.UPSTREAM_BUDGET_MAX_TOKENS,
+    ):
+        self.max_wait = max_wait
+        self.pacing_threshold = pacing_threshold
+        self.budgets = cache.LRUCache(max_tokens)
+
+    def update(self, family: str, authorization: str, headers: Mapping):
+        try:
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset_at = float(headers["x-rate-limit-reset"])
+            limit = int(headers.get("x-rate-limit-limit", remaining))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        budget = self.budgets.get((family, authorization))
+        if budget is None:
+            self.budgets.put(
+                (family, authorization), Budget(limit, remaining, reset_at)
+            )
+        else:
+            if reset_at != budget.reset_at:
+                budget.prefetched = 0
+            budget.limit = limit
+            budget.remaining = remaining
+            budget.reset_at = reset_at
+
+    def get(self, family: str, authorization: str) -> Optional[Budget]:
+        budget = self.budgets.get((family, authorization))
+        if budget is None or time() >= budget.reset_at:
+            return None
+        return budget
+
+    def spare(self, family: str, authorization: str) -> float:
+        # Fraction of the rate limit window left, all of it when unknown
+        budget = self.get(family, authorization)
+        if budget is None:
+            return 1.0
+        return max(0, budget.remaining) / max(
+            budget.limit, budget.remaining, 1
+        )
+
+    def retry_after(self, family: str, authorization: str) -> float:
+        budget = self.get(family, authorization)
+        if budget is None:
+            return config.UPSTREAM_BACKOFF_MAX
+        return budget.reset_at - time()
+
+    async def acquire(self, family: str, authorization: str):
+        budget = self.get(family, authorization)
+        if budget is None:
+            return
+
+        now = time()
+        window = budget.reset_at - now
+
+        if budget.remaining <= 0:
+            if window > self.max_wait:
+                raise exhausted_error(family, window)
+            await asyncio.sleep(window)
+            return
+
+        delay = 0.0
+        if budget.remaining < self.pacing_threshold:
+            delay = max(0.0, budget.next_at - now)
+            if delay > self.max_wait:
+                raise exhausted_error(family, delay)
+            budget.next_at = now + delay + window / budget.remaining
+
+        # Reserved locally until the response headers tell the real count
+        budget.remaining -= 1
+        if prefetching.get():
+            budget.prefetched += 1
+
+        if delay:
+            await asyncio.sleep(delay)
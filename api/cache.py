@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+
+from collections import OrderedDict
+from time import monotonic
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+from aiohttp import web
+
+from . import config, deadline, store
+
+Fetch = Callable[[int], Awaitable[List[Any]]]
+
+
+def degraded(value: List[Any]) -> bool:
+    # Partial results are served to their request only, and never cached
+    return getattr(value, "degraded", False)
+
+
+def exhausted(value: List[Any], limit: int) -> bool:
+    # Results without the flag are complete when shorter than their limit
+    return getattr(value, "exhausted", len(value) < limit)
+
+
+def token_identity(authorization: str) -> str:
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[Optional[float], Any]]"
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at is not None and monotonic() >= expires_at:
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self.entries[key] = (
+            monotonic() + self.ttl if self.ttl is not None else None,
+            value,
+        )
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+class Rendered:
+    __slots__ = ("body", "etag", "variants")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        # Strong validator, equal only for the same bytes
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        # Compressed bodies by encoding
+        self.variants: Dict[str, bytes] = {}
+
+
+class CacheEntry:
+    __slots__ = (
+        "limit",
+        "value",
+        "size",
+        "fresh_until",
+        "stale_until",
+        "rendered",
+        "exhausted",
+    )
+
+    def __init__(
+        self, limit: int, value: List[Any], ttl: float, stale_ttl: float
+    ):
+        self.limit = limit
+        self.value = value
+        # Set when upstream has no more results than the value
+        self.exhausted = exhausted(value, limit)
+        # Estimated rather than serialized again, rendered bodies add to it
+        self.size = len(value) * config.RESPONSE_CACHE_ITEM_BYTES
+        self.fresh_until = monotonic() + ttl
+        self.stale_until = self.fresh_until + stale_ttl
+        # Response bodies by limit, so repeated requests skip serialization
+        self.rendered: Dict[int, Rendered] = {}
+
+    def max_age(self) -> int:
+        return max(0, round(self.fresh_until - monotonic()))
+
+    def covers(self, limit: int) -> bool:
+        # Exhausted results are complete for any larger limit
+        return self.limit >= limit or self.exhausted
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl: float = config.RESPONSE_CACHE_TTL,
+        stale_ttl: float = config.RESPONSE_CACHE_STALE_TTL,
+        max_entries: int = config.RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = config.RESPONSE_CACHE_MAX_BYTES,
+        store: Optional[store.Store] = None,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self.size = 0
+        self.refreshes: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    async def get(self, key: Hashable, limit: int, fetch: Fetch) -> List[Any]:
+        return (await self.get_entry(key, limit, fetch)).value[:limit]
+
+    async def get_entry(
+        self, key: Hashable, limit: int, fetch: Fetch
+    ) -> CacheEntry:
+        entry = self.entries.get(key)
+        now = monotonic()
+
+        if entry is not None and now >= entry.stale_until:
+            self.remove(key)
+            entry = None
+
+        if entry is None and self.store is not None:
+            entry = await self.load(key)
+
+        if entry is not None and entry.covers(limit):
+            self.entries.move_to_end(key)
+            if now < entry.fresh_until:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                self.revalidate(key, entry.limit, fetch)
+            return entry
+
+        self.misses += 1
+        value = await fetch(limit)
+        if degraded(value):
+            return CacheEntry(limit, value, 0, 0)
+        return self.put(key, limit, value)
+
+    async def load(self, key: Hashable) -> Optional[CacheEntry]:
+        # Responses cached by a previous or another process
+        assert self.store is not None
+        stored = await self.store.get_response(key)
+        if stored is None:
+            return None
+
+        limit, value, fresh_for, stale_for, exhausted = stored
+        entry = CacheEntry(limit, value, fresh_for, stale_for - fresh_for)
+        # Stored values are plain lists, their flag is stored next to them
+        entry.exhausted = exhausted
+        self.add(key, entry)
+        return entry
+
+    def put(self, key: Hashable, limit: int, value: List[Any]) -> CacheEntry:
+        entry = CacheEntry(limit, value, self.ttl, self.stale_ttl)
+        self.add(key, entry)
+        if self.store is not None:
+            self.store.put_response(
+                key, limit, value, self.ttl, self.stale_ttl, entry.exhausted
+            )
+        return entry
+
+    def add(self, key: Hashable, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+
+        self.remove(key)
+        self.entries[key] = entry
+        self.size += entry.size
+        self.evict()
+
+    def evict(self):
+        while (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def render(
+        self,
+        key: Hashable,
+        entry: CacheEntry,
+        limit: int,
+        serialize: Callable[[List[Any]], bytes],
+    ) -> Rendered:
+        rendered = entry.rendered.get(limit)
+        if rendered is None:
+            rendered = Rendered(serialize(entry.value[:limit]))
+            entry.rendered[limit] = rendered
+            self.grow(key, entry, len(rendered.body))
+        return rendered
+
+    def add_variant(
+        self,
+        key: Hashable,
+        entry: CacheEntry,
+        rendered: Rendered,
+        encoding: str,
+        body: bytes,
+    ):
+        rendered.variants[encoding] = body
+        self.grow(key, entry, len(body))
+
+    def grow(self, key: Hashable, entry: CacheEntry, size: int):
+        # Bodies count towards the size of the entry while it's cached
+        entry.size += size
+        if self.entries.get(key) is entry:
+            self.size += size
+            self.evict()
+
+    def remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def revalidate(self, key: Hashable, limit: int, fetch: Fetch):
+        if key in self.refreshes:
+            return
+
+        async def refresh():
+            # Refreshes outlive the request that found the entry stale, they
+            # are not bounded but their results may still be degraded
+            deadline.request_deadline.set(deadline.Deadline(None))
+            try:
+                value = await fetch(limit)
+                if not degraded(value):
+                    self.put(key, limit, value)
+            except Exception:
+                self.refresh_errors += 1
+            finally:
+                del self.refreshes[key]
+
+        self.refreshes[key] = asyncio.ensure_future(refresh())
+
+    async def close(self):
+        refreshes = list(self.refreshes.values())
+        for refresh in refreshes:
+            refresh.cancel()
+        await asyncio.gather(*refreshes, return_exceptions=True)
+
+
+async def response_cache_context(app: web.Application) -> AsyncIterator[None]:
+    app["response_cache"] = ResponseCache(store=app.get("store"))
+    yield
+    await app["response_cache"].close()
@@ -0,0 +1,92 @@
+import importlib
+import json
+
+from typing import Any, Callable, Dict, Optional, Union
+from aiohttp import web
+
+from . import config
+
+
+class Codec:
+    __slots__ = ("name", "dumps", "loads")
+
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[Union[bytes, str]], Any],
+    ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def as_dict(value: Any) -> Any:
+    try:
+        return value.as_dict()
+    except AttributeError:
+        raise TypeError(
+            f"Object of type {type(value).__name__} is not JSON serializable"
+        )
+
+
+def stdlib_dumps(value: Any) -> bytes:
+    # Compact like the native codecs, but non-ascii stays escaped because the
+    # ascii-only encoder is much faster
+    return json.dumps(value, separators=(",", ":"), default=as_dict).encode()
+
+
+STDLIB = Codec("json", stdlib_dumps, json.loads)
+
+
+def orjson_codec(module: Any) -> Codec:
+    # Models are serialized through as_dict too, it's faster than the orjson
+    # support for dataclasses with slots
+    option = module.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(value: Any) -> bytes:
+        return module.dumps(value, default=as_dict, option=option)
+
+    return Codec("orjson", dumps, module.loads)
+
+
+# Native codecs tried in order by "auto", they encode to and decode from bytes
+NATIVE_CODECS: Dict[str, Callable[[Any], Codec]] = {"orjson": orjson_codec}
+
+
+def load_codec(name: str = config.JSON_CODEC) -> Codec:
+    for candidate in NATIVE_CODECS if name == "auto" else [name]:
+        if candidate == STDLIB.name:
+            break
+        try:
+            module = importlib.import_module(candidate)
+        except ImportError:
+            if name != "auto":
+                raise
+            continue
+        return NATIVE_CODECS[candidate](module)
+
+    return STDLIB
+
+
+current = load_codec()
+
+
+def dumps(value: Any) -> bytes:
+    return current.dumps(value)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return current.loads(data)
+
+
+def json_response(
+    data: Any, status: int = 200, headers: Optional[Dict] = None
+) -> web.Response:
+    return web.Response(
+        body=current.dumps(data),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+        charset="utf-8",
+    )
@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import importlib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from aiohttp import web
+
+from . import config
+
+# Response bodies are compressed with the encoding the client prefers among
+# the installed ones. Compressors release the GIL, so bodies are compressed in
+# a thread pool without blocking the event loop nor each other.
+
+
+class Encoding:
+    __slots__ = ("name", "compress")
+
+    def __init__(self, name: str, compress: Callable[[bytes], bytes]):
+        self.name = name
+        self.compress = compress
+
+
+def gzip_encoding(module: Any) -> Encoding:
+    # No timestamp in the header, equal bodies compress to equal bytes
+    return Encoding(
+        "gzip",
+        functools.partial(
+            module.compress,
+            compresslevel=config.COMPRESSION_LEVELS["gzip"],
+            mtime=0,
+        ),
+    )
+
+
+def brotli_encoding(module: Any) -> Encoding:
+    return Encoding(
+        "br",
+        functools.partial(
+            module.compress, quality=config.COMPRESSION_LEVELS["br"]
+        ),
+    )
+
+
+def zstd_encoding(module: Any) -> Encoding:
+    return Encoding(
+        "zstd",
+        functools.partial(
+            module.compress, level=config.COMPRESSION_LEVELS["zstd"]
+        ),
+    )
+
+
+# Modules implementing each encoding, brotli and zstandard are optional
+ENCODINGS: Dict[str, Tuple[str, Callable[[Any], Encoding]]] = {
+    "br": ("brotli", brotli_encoding),
+    "zstd": ("zstandard", zstd_encoding),
+    "gzip": ("gzip", gzip_encoding),
+}
+
+
+def load_encodings(
+    names: List[str] = config.COMPRESSION_ENCODINGS,
+) -> Dict[str, Encoding]:
+    encodings = {}
+    for name in names:
+        module_name, make_encoding = ENCODINGS[name]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        encodings[name] = make_encoding(module)
+    return encodings
+
+
+def negotiate(accept_encoding: str, names: List[str]) -> Optional[str]:
+    # Highest weighted encoding, ties go to the first of names
+    weights: Dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, _, parameters = coding.partition(";")
+        weight = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    chosen, chosen_weight = None, 0.0
+    for name in names:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > chosen_weight:
+            chosen, chosen_weight = name, weight
+    return chosen
+
+
+class Compressor:
+    def __init__(
+        self,
+        encodings: Optional[Dict[str, Encoding]] = None,
+        threads: int = config.COMPRESSION_THREADS,
+    ):
+        self.encodings = load_encodings() if encodings is None else encodings
+        self.executor = ThreadPoolExecutor(
+            threads, thread_name_prefix="compression"
+        )
+        self.compressions = {name: 0 for name in self.encodings}
+
+    def choose(self, accept_encoding: str, size: int) -> Optional[str]:
+        # Small bodies take longer to compress than to send
+        if size < config.COMPRESSION_MIN_SIZE:
+            return None
+        return negotiate(accept_encoding, list(self.encodings))
+
+    async def compress(self, name: str, body: bytes) -> bytes:
+        self.compressions[name] += 1
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.encodings[name].compress, body
+        )
+
+    def close(self):
+        self.executor.shutdown()
+
+
+async def compression_context(app: web.Application) -> AsyncIterator[None]:
+    app["compressor"] = Compressor()
+    yield
+    app["compressor"].close()
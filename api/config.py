@@ -2,13 +2,23 @@
 TIMEZONE_TIMEDELTA_MINUTES = 9 * 60
 
 # The maximum number of returned results allowed for the hashtag search endpoint
-MAX_HASHTAG_SEARCH_RESULTS = 30
+MAX_HASHTAG_SEARCH_RESULTS = 1000
+
+# The number of returned results for the hashtag search endpoint without limit
+DEFAULT_HASHTAG_SEARCH_RESULTS = 30
 
 # The maximum number of returned results allowed for the user tweets endpoint
-MAX_USER_TWEET_RESULTS = 30
+MAX_USER_TWEET_RESULTS = 1000
+
+# The number of returned results for the user tweets endpoint without limit
+DEFAULT_USER_TWEET_RESULTS = 30
 
-# The minimum number of search results that Twitter allows
+# The minimum and maximum number of search results per page that Twitter allows
 TWITTER_MIN_SEARCH_RESULTS = 10
+TWITTER_MAX_SEARCH_RESULTS = 100
+
+# The maximum number of timeline results per page that Twitter allows
+TWITTER_MAX_TIMELINE_RESULTS = 200
 
 # Twitter search recent API endpoint
 TWITTER_API_V2_SEARCH_RECENT = "https://api.twitter.com/2/tweets/search/recent"
@@ -16,10 +26,220 @@ TWITTER_API_V2_SEARCH_RECENT = "https://api.twitter.com/2/tweets/search/recent"
 # Twitter tweets API endpoint
 TWITTER_API_V2_TWEETS = "https://api.twitter.com/2/tweets"
 
+# The maximum number of tweet ids that Twitter allows per tweets call
+TWITTER_MAX_TWEETS_IDS = 100
+
 # Twitter timeline API endpoint
 TWITTER_API_V1_USER_TIMELINE = (
     "https://api.twitter.com/1.1/statuses/user_timeline.json"
 )
 
-# Twitter v1 tweet API endpoint (due lack of proper full_text on the v2 tweet endpoint)
-TWITTER_API_V1_TWEET = "https://api.twitter.com/1.1/statuses/show.json?id={id}"
+# Twitter v1 tweets lookup API endpoint (hydrates many tweets in a single call)
+TWITTER_API_V1_TWEETS_LOOKUP = (
+    "https://api.twitter.com/1.1/statuses/lookup.json"
+)
+
+# The maximum number of tweet ids that Twitter allows per lookup call
+TWITTER_MAX_LOOKUP_IDS = 100
+
+# Maximum number of simultaneous connections kept by the upstream connection pool
+UPSTREAM_POOL_SIZE = 100
+
+# Maximum number of simultaneous connections to a single upstream host
+UPSTREAM_POOL_SIZE_PER_HOST = 50
+
+# Seconds resolved upstream host addresses are cached for
+UPSTREAM_DNS_CACHE_TTL = 300
+
+# Seconds idle keep-alive upstream connections are kept open for
+UPSTREAM_KEEPALIVE_TIMEOUT = 30
+
+# Seconds allowed for a whole upstream call, and for establishing its connection
+UPSTREAM_TIMEOUT = 10
+UPSTREAM_CONNECT_TIMEOUT = 3
+
+# Seconds a cached /hashtags or /users response is considered fresh
+RESPONSE_CACHE_TTL = 15
+
+# Seconds past its TTL a cached response is still served while it is refreshed
+RESPONSE_CACHE_STALE_TTL = 60
+
+# Bounds of the response cache, least recently used responses are evicted first
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Estimated bytes of each tweet of a cached response, before its bodies are
+# rendered
+RESPONSE_CACHE_ITEM_BYTES = 512
+
+# Maximum number of tweets whose text and hashtags are cached (they never change)
+TWEET_CONTENT_CACHE_MAX_ENTRIES = 100000
+
+# Seconds tweet metrics and author data are cached for, and how many are kept
+TWEET_METRICS_CACHE_TTL = 10
+TWEET_METRICS_CACHE_MAX_ENTRIES = 100000
+
+# Per client token bucket limits of each route: (requests per second, burst size)
+RATE_LIMITS = {
+    "/hashtags/{tag}": (5, 20),
+    "/users/{username}": (5, 20),
+    "/batch": (1, 5),
+}
+
+# Maximum number of clients tracked per route, and seconds idle ones are kept
+RATE_LIMIT_MAX_CLIENTS = 100000
+RATE_LIMIT_IDLE_TTL = 300
+
+# Longest seconds an upstream call waits on an exhausted rate limit before failing
+UPSTREAM_BUDGET_MAX_WAIT = 2
+
+# Upstream calls are spread evenly over the rest of the rate limit window once
+# fewer than this many calls remain in it
+UPSTREAM_BUDGET_PACING_THRESHOLD = 10
+
+# Maximum number of tokens whose upstream rate limits are tracked
+UPSTREAM_BUDGET_MAX_TOKENS = 10000
+
+# Attempts for upstream calls answered with 429 or 5xx, and backoff bounds in seconds
+UPSTREAM_MAX_ATTEMPTS = 3
+UPSTREAM_BACKOFF_BASE = 0.1
+UPSTREAM_BACKOFF_MAX = 2
+
+# Maximum number of upstream calls in flight for the whole process, and for the
+# fan-out of a single request
+UPSTREAM_MAX_CONCURRENCY = 64
+UPSTREAM_MAX_CONCURRENCY_PER_REQUEST = 4
+
+# Upstream calls of an endpoint are rejected for BREAKER_OPEN_TIME seconds once
+# at least BREAKER_FAILURE_RATE of its last BREAKER_WINDOW calls failed, out of
+# at least BREAKER_MIN_CALLS. Calls failing to connect, answered with 5xx or
+# slower than BREAKER_SLOW_CALL seconds are failures
+BREAKER_WINDOW = 50
+BREAKER_MIN_CALLS = 20
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_SLOW_CALL = 5
+BREAKER_OPEN_TIME = 10
+
+# Calls let through after the open time, all of them must succeed to close it
+BREAKER_HALF_OPEN_CALLS = 3
+
+# Seconds a request has to answer, clients may ask for another timeout in
+# seconds with an X-Request-Timeout header, up to the maximum. Past it, tweets
+# not hydrated yet are returned without their text nor hashtags
+REQUEST_TIMEOUT = 5
+REQUEST_MAX_TIMEOUT = 30
+
+# Queries accepted by a single /batch request, and how many of them run at once
+BATCH_MAX_QUERIES = 50
+BATCH_MAX_CONCURRENCY = 8
+
+# Besides its own token, a batch takes a token per query from the bucket of the
+# route of each query, up to this many. Must not exceed the burst of the routes
+BATCH_MAX_ROUTE_TOKENS = 10
+
+# Share of extra upstream calls that hedging may add, 0 disables it. Calls slower
+# than the UPSTREAM_HEDGE_QUANTILE of the recent latencies of their endpoint are
+# sent a second time and the first answer is used
+UPSTREAM_HEDGE_BUDGET = 0.05
+UPSTREAM_HEDGE_QUANTILE = 0.95
+
+# Recent latencies kept per endpoint, and how many are needed before hedging
+UPSTREAM_HEDGE_WINDOW = 200
+UPSTREAM_HEDGE_MIN_SAMPLES = 20
+
+# Shortest seconds a call waits before being hedged, and most hedges in a burst
+UPSTREAM_HEDGE_MIN_DELAY = 0.05
+UPSTREAM_HEDGE_MAX_TOKENS = 10
+
+# Hedges are only sent while this fraction of the rate limit window is left
+UPSTREAM_HEDGE_MIN_SPARE = 0.5
+
+# Number of tweets hydrated together when streaming results
+STREAM_BATCH_SIZE = 10
+
+# JSON codec, "auto" uses the fastest installed native codec (orjson) and falls
+# back to the standard library "json"
+JSON_CODEC = "auto"
+
+# Response encodings in order of preference for clients accepting several of
+# them, "br" and "zstd" are used when brotli and zstandard are installed
+COMPRESSION_ENCODINGS = ["br", "zstd", "gzip"]
+
+# Compression level of each encoding
+COMPRESSION_LEVELS = {"br": 5, "zstd": 3, "gzip": 6}
+
+# Response bodies smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+
+# Threads compressing response bodies off the event loop
+COMPRESSION_THREADS = 2
+
+# Number of formatted tweet dates (one per minute) kept for reuse
+DATE_FORMAT_CACHE_MAX_ENTRIES = 4096
+
+# Histogram buckets of request and upstream call latencies in seconds, and of
+# the number of upstream calls made by each request
+METRICS_LATENCY_BUCKETS = [
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+]
+METRICS_FAN_OUT_BUCKETS = [0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64]
+
+# Times the phases of each request, reported in a Server-Timing header and
+# logged for requests slower than the threshold in seconds, or sampled at a rate
+TRACING_ENABLED = True
+TRACE_SLOW_REQUEST_THRESHOLD = 1
+TRACE_SAMPLE_RATE = 0.001
+
+# Processes serving `python -m api`, more than one share the port and are
+# supervised by the main process, which checks their health every interval
+WORKERS = 1
+WORKER_HEALTH_CHECK_INTERVAL = 5
+WORKER_HEALTH_CHECK_TIMEOUT = 2
+WORKER_HEALTH_CHECK_FAILURES = 3
+
+# Seconds a new worker has to pass its first health check, polled every
+# interval, and seconds stopped workers have to finish their requests
+WORKER_START_TIMEOUT = 30
+WORKER_START_POLL_INTERVAL = 0.1
+WORKER_SHUTDOWN_TIMEOUT = 10
+WORKER_STOP_TIMEOUT = 15
+
+# Optional sqlite file keeping tweet contents and cached responses across
+# restarts, shared by the workers of a host, empty disables it. Entries over
+# the size cap are removed oldest first, down to the target fraction of it
+PERSISTENT_CACHE_PATH = ""
+PERSISTENT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PERSISTENT_CACHE_COMPACT_TARGET = 0.8
+
+# Seconds between writes of new entries, between compactions, and waiting for
+# another worker writing to the file
+PERSISTENT_CACHE_FLUSH_INTERVAL = 1
+PERSISTENT_CACHE_COMPACT_INTERVAL = 60
+PERSISTENT_CACHE_BUSY_TIMEOUT = 5
+
+# Requests of /hashtags and /users are counted by key in a count-min sketch of
+# depth rows of width counters, keeping the most requested keys. Counts are
+# halved every decay interval so they follow the recent traffic
+HOT_KEYS_TOP = 100
+HOT_KEYS_SKETCH_WIDTH = 4096
+HOT_KEYS_SKETCH_DEPTH = 4
+HOT_KEYS_DECAY_INTERVAL = 60
+
+# Cached responses of keys requested at least this many times are refreshed
+# this many seconds before they stop being fresh, checked every interval.
+# Prefetches use at most this fraction of the upstream concurrency and of the
+# calls in each rate limit window of a token
+PREFETCH_MIN_REQUESTS = 3
+PREFETCH_AHEAD = 3
+PREFETCH_INTERVAL = 1
+PREFETCH_UPSTREAM_FRACTION = 0.1
@@ -0,0 +1,110 @@
+import asyncio
+import math
+
+from contextvars import ContextVar
+from time import monotonic
+from typing import Awaitable, Callable, Optional, TypeVar
+from aiohttp import web
+
+from . import codec, config
+from .errors import ApiError
+
+T = TypeVar("T")
+
+# Each request gets a time budget, every upstream call made on its behalf is
+# bounded by what is left of it. Work cut short by the deadline gives partial
+# results, marked as degraded and never cached.
+
+
+class DeadlineExceeded(ApiError):
+    def __init__(self):
+        super().__init__("Request deadline exceeded", status=504)
+
+
+class Deadline:
+    __slots__ = ("expires_at", "degraded")
+
+    def __init__(self, expires_at: Optional[float]):
+        # Work without an expiry, like background refreshes, is not bounded
+        self.expires_at = expires_at
+        # Set once results of the request were cut short or left incomplete
+        self.degraded = False
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return self.expires_at - monotonic()
+
+
+# Deadline of the request being served, work shared between requests runs
+# without one
+request_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "request_deadline", default=None
+)
+
+
+def degrade():
+    deadline = request_deadline.get()
+    if deadline is not None:
+        deadline.degraded = True
+
+
+def degraded() -> bool:
+    deadline = request_deadline.get()
+    return deadline is not None and deadline.degraded
+
+
+async def within(awaitable: Awaitable[T]) -> T:
+    deadline = request_deadline.get()
+    if deadline is None or deadline.expires_at is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(0, deadline.remaining()))
+    except asyncio.TimeoutError:
+        # Timeouts of the awaited work itself are not the deadline's
+        if deadline.remaining() > 0:
+            raise
+        raise DeadlineExceeded()
+
+
+def request_timeout(req: web.Request) -> float:
+    value = req.headers.get("x-request-timeout")
+    if value is None:
+        return config.REQUEST_TIMEOUT
+    timeout = float(value)
+    if not 0 < timeout <= config.REQUEST_MAX_TIMEOUT:
+        raise ValueError("not in range")
+    return timeout
+
+
+@web.middleware
+async def deadline_middleware(
+    req: web.Request,
+    handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+) -> web.StreamResponse:
+    try:
+        timeout = request_timeout(req)
+    except ValueError:
+        return codec.json_response(
+            {
+                "error": "Invalid X-Request-Timeout header: must be a number"
+                f" of seconds up to {config.REQUEST_MAX_TIMEOUT}"
+            },
+            status=400,
+        )
+
+    deadline = Deadline(monotonic() + timeout)
+    req["deadline"] = deadline
+    token = request_deadline.set(deadline)
+    try:
+        return await handler(req)
+    finally:
+        request_deadline.reset(token)
+        if deadline.degraded:
+            req.app["metrics"].degraded += 1
+
+
+async def add_degraded_header(req: web.Request, res: web.StreamResponse):
+    deadline = req.get("deadline")
+    if deadline is not None and deadline.degraded:
+        res.headers["X-Degraded"] = "true"
@@ -0,0 +1,10 @@
+from typing import Dict, Optional
+
+
+class ApiError(Exception):
+    def __init__(
+        self, message, status: int = 500, headers: Optional[Dict] = None
+    ):
+        super(Exception, self).__init__(message)
+        self.status = status
+        self.headers = headers
@@ -0,0 +1,97 @@
+import asyncio
+
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from . import config
+
+T = TypeVar("T")
+
+# Upstream GETs that take longer than most calls of their endpoint are sent a
+# second time, and the first answer is used. Hedges are paid for with tokens
+# earned by every call, so they add at most a budgeted share of calls.
+
+
+class LatencyWindow:
+    def __init__(
+        self,
+        size: int = config.UPSTREAM_HEDGE_WINDOW,
+        quantile: float = config.UPSTREAM_HEDGE_QUANTILE,
+    ):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.quantile = quantile
+        # Sorted again once a tenth of the window changed
+        self.refresh = max(1, size // 10)
+        self.value: Optional[float] = None
+        self.observed = 0
+
+    def observe(self, latency: float):
+        self.samples.append(latency)
+        self.observed += 1
+        if self.observed % self.refresh == 0:
+            self.value = None
+
+    def delay(self) -> Optional[float]:
+        if len(self.samples) < config.UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        if self.value is None:
+            samples = sorted(self.samples)
+            self.value = samples[int(self.quantile * (len(samples) - 1))]
+        return max(config.UPSTREAM_HEDGE_MIN_DELAY, self.value)
+
+
+class Hedger:
+    def __init__(self, budget: float = config.UPSTREAM_HEDGE_BUDGET):
+        self.budget = budget
+        self.windows: Dict[str, LatencyWindow] = {}
+        self.tokens = 0.0
+        self.hedges = 0
+        self.wins = 0
+
+    def observe(self, family: str, latency: float):
+        window = self.windows.get(family)
+        if window is None:
+            window = self.windows[family] = LatencyWindow()
+        window.observe(latency)
+
+    def delay(self, family: str) -> Optional[float]:
+        window = self.windows.get(family)
+        return window.delay() if window is not None else None
+
+    async def run(
+        self,
+        family: str,
+        call: Callable[[], Awaitable[T]],
+        can_hedge: Callable[[], bool],
+    ) -> T:
+        self.tokens = min(
+            config.UPSTREAM_HEDGE_MAX_TOKENS, self.tokens + self.budget
+        )
+        delay = self.delay(family) if self.budget > 0 else None
+
+        tasks: List[asyncio.Future] = [asyncio.ensure_future(call())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.tokens >= 1 and can_hedge():
+                self.tokens -= 1
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(call()))
+
+            # The first call to answer wins, failures wait for the other one
+            pending = set(tasks)
+            failed: Optional[asyncio.Future] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.wins += 1
+                        return task.result()
+                    failed = failed or task
+            assert failed is not None
+            return failed.result()
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,44 @@
+import asyncio
+
+from time import monotonic
+from typing import Awaitable, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class Limiter:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.waited = 0
+        self.wait_time = 0.0
+
+    async def __aenter__(self):
+        if self.semaphore.locked():
+            self.waiting += 1
+            started_at = monotonic()
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+                self.waited += 1
+                self.wait_time += monotonic() - started_at
+        else:
+            await self.semaphore.acquire()
+        self.active += 1
+
+    async def __aexit__(self, *error_info):
+        self.active -= 1
+        self.semaphore.release()
+
+
+async def gather(limit: int, awaitables: Iterable[Awaitable[T]]) -> List[T]:
+    limiter = Limiter(limit)
+
+    async def run(awaitable: Awaitable[T]) -> T:
+        async with limiter:
+            return await awaitable
+
+    return await asyncio.gather(*(run(awaitable) for awaitable in awaitables))
@@ -0,0 +1,461 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from aiohttp import web
+
+from . import breaker, config
+
+# Recording only bumps plain numbers, which is safe without locks on the event
+# loop. Series are created the first time a label combination is seen and the
+# text exposition is only built when /metrics is scraped
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        # One more count for values above the last bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class HistogramFamily:
+    def __init__(self, labels: List[str], buckets: List[float]):
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Hashable, Dict[Hashable, Histogram]] = {}
+
+    def observe(self, first: Hashable, second: Hashable, value: float):
+        # Nested by label so recording never builds a label tuple
+        by_second = self.series.get(first)
+        if by_second is None:
+            by_second = self.series[first] = {}
+        histogram = by_second.get(second)
+        if histogram is None:
+            histogram = by_second[second] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def items(self):
+        for first, by_second in self.series.items():
+            for second, histogram in by_second.items():
+                yield {
+                    self.labels[0]: first,
+                    self.labels[1]: second,
+                }, histogram
+
+
+class FanOut:
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls = 0
+
+
+# Upstream calls made on behalf of the request being served
+request_fan_out: ContextVar[Optional[FanOut]] = ContextVar(
+    "request_fan_out", default=None
+)
+
+
+def count_upstream_call():
+    fan_out = request_fan_out.get()
+    if fan_out is not None:
+        fan_out.calls += 1
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.requests = HistogramFamily(
+            ["route", "status"], config.METRICS_LATENCY_BUCKETS
+        )
+        self.fan_out = Histogram(config.METRICS_FAN_OUT_BUCKETS)
+        self.in_flight = 0
+        self.degraded = 0
+
+
+class UpstreamMetrics:
+    def __init__(self):
+        self.requests = HistogramFamily(
+            ["endpoint", "status"], config.METRICS_LATENCY_BUCKETS
+        )
+
+
+def route_label(req: web.Request) -> str:
+    resource = req.match_info.route.resource
+    return resource.canonical if resource is not None else "unmatched"
+
+
+@web.middleware
+async def metrics_middleware(
+    req: web.Request,
+    handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+) -> web.StreamResponse:
+    metrics: ServerMetrics = req.app["metrics"]
+    fan_out = FanOut()
+    token = request_fan_out.set(fan_out)
+    status: Any = 500
+    started_at = perf_counter()
+    metrics.in_flight += 1
+    try:
+        res = await handler(req)
+        status = res.status
+        return res
+    except web.HTTPException as exception:
+        status = exception.status
+        raise
+    finally:
+        metrics.in_flight -= 1
+        metrics.requests.observe(
+            route_label(req), status, perf_counter() - started_at
+        )
+        metrics.fan_out.observe(fan_out.calls)
+        request_fan_out.reset(token)
+
+
+def escape(value: Any) -> str:
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{escape(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+class Exposition:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def header(self, name: str, kind: str, help: str):
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: Dict[str, Any] = {}):
+        self.lines.append(f"{name}{format_labels(labels)} {value}")
+
+    def metric(self, name: str, kind: str, help: str, samples: List[Any]):
+        self.header(name, kind, help)
+        for labels, value in samples:
+            self.sample(name, value, labels)
+
+    def histogram(self, name: str, help: str, series: List[Any]):
+        self.header(name, "histogram", help)
+        for labels, histogram in series:
+            cumulative = 0
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                self.sample(
+                    f"{name}_bucket", cumulative, {**labels, "le": bucket}
+                )
+            cumulative += histogram.counts[-1]
+            self.sample(f"{name}_bucket", cumulative, {**labels, "le": "+Inf"})
+            self.sample(f"{name}_sum", histogram.sum, labels)
+            self.sample(f"{name}_count", cumulative, labels)
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def add_label(line: str, name: str, value: str) -> str:
+    metric, sample = line.rsplit(" ", 1)
+    metric_name, _, labels = metric.partition("{")
+    return (
+        f'{metric_name}{{{name}="{escape(value)}"'
+        + (f",{labels}" if labels else "}")
+        + f" {sample}"
+    )
+
+
+def merge(texts: Dict[str, str], label: str) -> str:
+    # Joins the expositions of several processes, their samples are told apart
+    # by a label and kept under a single header of each metric
+    headers: Dict[str, Dict[str, None]] = {}
+    samples: Dict[str, List[str]] = {}
+    for value, text in texts.items():
+        for line in text.splitlines():
+            if line.startswith("#"):
+                name = line.split(" ", 3)[2]
+                headers.setdefault(name, {})[line] = None
+                samples.setdefault(name, [])
+            elif line:
+                samples[name].append(add_label(line, label, value))
+
+    return "".join(
+        "\n".join([*headers[name], *samples[name]]) + "\n" for name in headers
+    )
+
+
+def render(app: web.Application) -> str:
+    metrics: ServerMetrics = app["metrics"]
+    upstream = app["upstream"]
+    response_cache = app["response_cache"]
+    exposition = Exposition()
+
+    exposition.histogram(
+        "api_request_duration_seconds",
+        "Requests served by route and status",
+        list(metrics.requests.items()),
+    )
+    exposition.metric(
+        "api_requests_in_flight",
+        "gauge",
+        "Requests being served",
+        [({}, metrics.in_flight)],
+    )
+    exposition.histogram(
+        "api_request_upstream_calls",
+        "Upstream calls made by each request",
+        [({}, metrics.fan_out)],
+    )
+    exposition.metric(
+        "api_degraded_responses_total",
+        "counter",
+        "Responses with partial results because of their deadline",
+        [({}, metrics.degraded)],
+    )
+
+    exposition.histogram(
+        "api_upstream_request_duration_seconds",
+        "Twitter api calls by endpoint and status",
+        list(upstream.metrics.requests.items()),
+    )
+    exposition.metric(
+        "api_upstream_in_flight",
+        "gauge",
+        "Twitter api calls in flight",
+        [({}, upstream.limiter.active)],
+    )
+    exposition.metric(
+        "api_upstream_queued",
+        "gauge",
+        "Twitter api calls waiting for a concurrency slot",
+        [({}, upstream.limiter.waiting)],
+    )
+    exposition.metric(
+        "api_upstream_queue_waits_total",
+        "counter",
+        "Twitter api calls that waited for a concurrency slot",
+        [({}, upstream.limiter.waited)],
+    )
+    exposition.metric(
+        "api_upstream_queue_wait_seconds_total",
+        "counter",
+        "Time spent waiting for a concurrency slot",
+        [({}, upstream.limiter.wait_time)],
+    )
+    exposition.metric(
+        "api_upstream_coalesced_total",
+        "counter",
+        "Twitter api calls shared with an identical call in flight",
+        [({}, upstream.singleflight.coalesced)],
+    )
+    exposition.metric(
+        "api_upstream_hedges_total",
+        "counter",
+        "Slow Twitter api calls sent a second time",
+        [({}, upstream.hedger.hedges)],
+    )
+    exposition.metric(
+        "api_upstream_hedge_wins_total",
+        "counter",
+        "Hedged Twitter api calls answered first by the second call",
+        [({}, upstream.hedger.wins)],
+    )
+    exposition.metric(
+        "api_upstream_hedge_delay_seconds",
+        "gauge",
+        "Time Twitter api calls wait before being hedged by endpoint",
+        [
+            ({"endpoint": family}, delay)
+            for family, delay in (
+                (family, window.delay())
+                for family, window in upstream.hedger.windows.items()
+            )
+            if delay is not None
+        ],
+    )
+    exposition.metric(
+        "api_upstream_breaker_state",
+        "gauge",
+        "Circuit breaker state of each Twitter api endpoint",
+        [
+            ({"endpoint": family, "state": state}, int(current == state))
+            for family, current in (
+                (family, circuit.current())
+                for family, circuit in upstream.breakers.items()
+            )
+            for state in breaker.STATES
+        ],
+    )
+    exposition.metric(
+        "api_upstream_breaker_opens_total",
+        "counter",
+        "Times the circuit breaker of each Twitter api endpoint opened",
+        [
+            ({"endpoint": family}, circuit.opens)
+            for family, circuit in upstream.breakers.items()
+        ],
+    )
+    exposition.metric(
+        "api_upstream_breaker_rejections_total",
+        "counter",
+        "Twitter api calls rejected by an open circuit breaker",
+        [
+            ({"endpoint": family}, circuit.rejections)
+            for family, circuit in upstream.breakers.items()
+        ],
+    )
+    exposition.metric(
+        "api_upstream_budgets",
+        "gauge",
+        "Tokens whose Twitter rate limits are tracked",
+        [({}, len(upstream.budgets.budgets.entries))],
+    )
+
+    exposition.metric(
+        "api_response_cache_entries",
+        "gauge",
+        "Cached endpoint responses",
+        [({}, len(response_cache.entries))],
+    )
+    exposition.metric(
+        "api_response_cache_bytes",
+        "gauge",
+        "Size of the cached endpoint responses",
+        [({}, response_cache.size)],
+    )
+    exposition.metric(
+        "api_response_cache_lookups_total",
+        "counter",
+        "Response cache lookups by result",
+        [
+            ({"result": "hit"}, response_cache.hits),
+            ({"result": "stale"}, response_cache.stale_hits),
+            ({"result": "miss"}, response_cache.misses),
+        ],
+    )
+    exposition.metric(
+        "api_response_cache_evictions_total",
+        "counter",
+        "Responses evicted from the cache",
+        [({}, response_cache.evictions)],
+    )
+    exposition.metric(
+        "api_response_cache_refresh_errors_total",
+        "counter",
+        "Failed background refreshes of stale responses",
+        [({}, response_cache.refresh_errors)],
+    )
+
+    tweet_caches = {
+        "content": upstream.tweet_contents,
+        "metrics": upstream.tweet_metrics,
+    }
+    exposition.metric(
+        "api_tweet_cache_entries",
+        "gauge",
+        "Cached tweets",
+        [
+            ({"cache": name}, len(c.entries))
+            for name, c in tweet_caches.items()
+        ],
+    )
+    exposition.metric(
+        "api_tweet_cache_lookups_total",
+        "counter",
+        "Tweet cache lookups by result",
+        [
+            ({"cache": name, "result": result}, count)
+            for name, c in tweet_caches.items()
+            for result, count in [("hit", c.hits), ("miss", c.misses)]
+        ],
+    )
+    exposition.metric(
+        "api_tweet_cache_evictions_total",
+        "counter",
+        "Tweets evicted from the cache",
+        [({"cache": name}, c.evictions) for name, c in tweet_caches.items()],
+    )
+
+    prefetcher = app["prefetcher"]
+    exposition.metric(
+        "api_hot_keys",
+        "gauge",
+        "Most requested keys tracked for prefetching",
+        [({}, len(prefetcher.hot_keys.top))],
+    )
+    exposition.metric(
+        "api_prefetches_total",
+        "counter",
+        "Cached responses of hot keys refreshed before going stale",
+        [({}, prefetcher.prefetches)],
+    )
+    exposition.metric(
+        "api_prefetches_skipped_total",
+        "counter",
+        "Prefetches skipped to leave the rate limit of a token to clients",
+        [({}, prefetcher.skipped)],
+    )
+
+    exposition.metric(
+        "api_response_compressions_total",
+        "counter",
+        "Response bodies compressed by encoding, cached bodies are reused",
+        [
+            ({"encoding": name}, count)
+            for name, count in app["compressor"].compressions.items()
+        ],
+    )
+
+    store = app["store"]
+    if store is not None:
+        exposition.metric(
+            "api_store_lookups_total",
+            "counter",
+            "Persistent cache lookups by result",
+            [
+                ({"result": "hit"}, store.hits),
+                ({"result": "miss"}, store.misses),
+            ],
+        )
+        exposition.metric(
+            "api_store_writes_total",
+            "counter",
+            "Entries written to the persistent cache",
+            [({}, store.writes)],
+        )
+        exposition.metric(
+            "api_store_evictions_total",
+            "counter",
+            "Entries removed from the persistent cache by compactions",
+            [({}, store.evictions)],
+        )
+
+    exposition.metric(
+        "api_throttle_clients",
+        "gauge",
+        "Clients with a rate limit bucket by route",
+        [
+            ({"route": route}, len(store.buckets))
+            for route, store in app["bucket_stores"].items()
+        ],
+    )
+
+    return exposition.text()
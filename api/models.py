@@ -0,0 +1,168 @@
+import functools
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, cast
+
+from . import config
+
+# Tweets are built in a single pass from the v2 payload (account, date and
+# metrics) and the v1 payload (full text and hashtags), then merged into one
+# object, instead of spreading intermediate dicts for every field group
+
+TIMEZONE = timezone(
+    timedelta(minutes=config.TIMEZONE_TIMEDELTA_MINUTES)
+    * (-1 if config.TIMEZONE_TIMEDELTA_MINUTES < 0 else 1)
+)
+
+
+@functools.lru_cache(maxsize=config.DATE_FORMAT_CACHE_MAX_ENTRIES)
+def format_minute(minute: str) -> str:
+    return "{0:%I:%M %p - %d %b %Y}".format(
+        datetime.fromisoformat(minute + "+00:00").astimezone(TIMEZONE)
+    )
+
+
+def format_date(created_at: Optional[str]) -> Optional[str]:
+    if not created_at:
+        return None
+    # Dates are shown with minute precision, tweets from the same minute (most
+    # of a busy search page) share one formatted string
+    return format_minute(created_at[:16])
+
+
+def format_v1_date(created_at: Optional[str]) -> Optional[str]:
+    if not created_at:
+        return None
+    return format_minute(
+        datetime.strptime(created_at, "%a %b %d %H:%M:%S %z %Y").strftime(
+            "%Y-%m-%dT%H:%M"
+        )
+    )
+
+
+def included_users(includes: Dict) -> Dict[str, Dict]:
+    return {user["id"]: user for user in includes.get("users", [])}
+
+
+@dataclass
+class Account:
+    __slots__ = ("id", "fullname", "href")
+
+    id: Optional[str]
+    fullname: Optional[str]
+    href: Optional[str]
+
+    @classmethod
+    def from_v2(cls, user: Dict) -> "Account":
+        username = user.get("username")
+        return cls(
+            user.get("id"),
+            user.get("name"),
+            f"/{username}" if username else None,
+        )
+
+    def as_dict(self) -> Dict:
+        return {"id": self.id, "fullname": self.fullname, "href": self.href}
+
+
+@dataclass
+class Content:
+    __slots__ = ("hashtags", "text")
+
+    hashtags: List[str]
+    text: Optional[str]
+
+    @classmethod
+    def from_v1(cls, tweet: Dict) -> "Content":
+        # Retweets carry the full text and hashtags in the original tweet
+        tweet = tweet.get("retweeted_status", tweet)
+        return cls(
+            [
+                f'#{hashtag.get("text")}'
+                for hashtag in tweet.get("entities", {}).get("hashtags", [])
+            ],
+            tweet.get("full_text"),
+        )
+
+    def as_dict(self) -> Dict:
+        return {"hashtags": self.hashtags, "text": self.text}
+
+
+EMPTY_CONTENT = Content([], None)
+
+
+@dataclass
+class Tweet:
+    __slots__ = (
+        "account",
+        "date",
+        "likes",
+        "replies",
+        "retweets",
+        "hashtags",
+        "text",
+        "_dict",
+    )
+
+    account: Account
+    date: Optional[str]
+    likes: Optional[int]
+    replies: Optional[int]
+    retweets: Optional[int]
+    hashtags: List[str]
+    text: Optional[str]
+
+    @classmethod
+    def from_v2(cls, tweet: Dict, users: Dict[str, Dict]) -> "Tweet":
+        public_metrics = tweet.get("public_metrics", {})
+        return cls(
+            Account.from_v2(users.get(cast(str, tweet.get("author_id")), {})),
+            format_date(tweet.get("created_at")),
+            public_metrics.get("like_count"),
+            public_metrics.get("reply_count"),
+            public_metrics.get("retweet_count"),
+            EMPTY_CONTENT.hashtags,
+            EMPTY_CONTENT.text,
+        )
+
+    @classmethod
+    def from_v1(cls, tweet: Dict, account: Account) -> "Tweet":
+        # Without v2 data only the date is known, metrics are left out
+        return cls(
+            account,
+            format_v1_date(tweet.get("created_at")),
+            None,
+            None,
+            None,
+            EMPTY_CONTENT.hashtags,
+            EMPTY_CONTENT.text,
+        )
+
+    def with_content(self, content: Content) -> "Tweet":
+        return Tweet(
+            self.account,
+            self.date,
+            self.likes,
+            self.replies,
+            self.retweets,
+            content.hashtags,
+            content.text,
+        )
+
+    def as_dict(self) -> Dict:
+        # Tweets aren't changed once built and cached ones are serialized for
+        # every response, so the dict is only built on the first one
+        try:
+            return self._dict
+        except AttributeError:
+            self._dict: Dict = {
+                "account": self.account.as_dict(),
+                "date": self.date,
+                "likes": self.likes,
+                "replies": self.replies,
+                "retweets": self.retweets,
+                "hashtags": self.hashtags,
+                "text": self.text,
+            }
+            return self._dict
@@ -0,0 +1,203 @@
+import asyncio
+import contextlib
+
+from time import monotonic
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Sequence
+from aiohttp import web
+
+from . import budget, config, cache, upstream
+
+# Requests of /hashtags and /users are heavily skewed towards a few keys. Their
+# counts are estimated in a count-min sketch of fixed size, and the keys with
+# the highest counts are kept along with what is needed to fetch them again,
+# so their cached responses are refreshed before they stop being fresh instead
+# of when a client request finds them stale
+
+# Twitter endpoints called to build the responses of each route
+ROUTE_FAMILIES = {
+    "hashtags": [upstream.SEARCH_RECENT, upstream.V1_LOOKUP],
+    "users": [upstream.V1_TIMELINE, upstream.V2_TWEETS],
+}
+
+
+class CountMinSketch:
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key: Hashable) -> int:
+        # Overestimates a count only when every row collides with other keys
+        first = hash(key)
+        second = hash((first, len(self.rows))) | 1
+        counts = []
+        for index, row in enumerate(self.rows):
+            column = (first + index * second) % self.width
+            row[column] += 1
+            counts.append(row[column])
+        return min(counts)
+
+    def decay(self):
+        for row in self.rows:
+            for column, count in enumerate(row):
+                row[column] = count >> 1
+
+
+class HotKey:
+    __slots__ = ("count", "fetch", "authorization", "families")
+
+    def __init__(
+        self,
+        count: int,
+        fetch: cache.Fetch,
+        authorization: str,
+        families: Sequence[str],
+    ):
+        self.count = count
+        self.fetch = fetch
+        self.authorization = authorization
+        self.families = families
+
+
+class HotKeys:
+    def __init__(
+        self,
+        size: int = config.HOT_KEYS_TOP,
+        width: int = config.HOT_KEYS_SKETCH_WIDTH,
+        depth: int = config.HOT_KEYS_SKETCH_DEPTH,
+    ):
+        self.size = size
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[Hashable, HotKey] = {}
+        # No kept key has a lower count, checked before looking for the lowest
+        self.floor = 0
+
+    def record(
+        self,
+        key: Hashable,
+        fetch: cache.Fetch,
+        authorization: str,
+        families: Sequence[str],
+    ):
+        count = self.sketch.add(key)
+        hot_key = self.top.get(key)
+        if hot_key is not None:
+            hot_key.count = count
+            return
+
+        if len(self.top) >= self.size:
+            if count <= self.floor:
+                return
+            coldest = min(self.top, key=lambda key: self.top[key].count)
+            self.floor = self.top[coldest].count
+            if count <= self.floor:
+                return
+            del self.top[coldest]
+
+        self.top[key] = HotKey(count, fetch, authorization, families)
+
+    def decay(self):
+        self.sketch.decay()
+        for hot_key in self.top.values():
+            hot_key.count >>= 1
+        self.floor >>= 1
+
+    def hottest(self) -> List[Hashable]:
+        return sorted(self.top, key=lambda key: -self.top[key].count)
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        hot_keys: HotKeys,
+        response_cache: cache.ResponseCache,
+        client: upstream.Client,
+    ):
+        self.hot_keys = hot_keys
+        self.response_cache = response_cache
+        self.client = client
+        # Prefetches leave most of the upstream concurrency to clients
+        self.max_active = max(
+            1,
+            int(
+                config.PREFETCH_UPSTREAM_FRACTION
+                * config.UPSTREAM_MAX_CONCURRENCY
+            ),
+        )
+        self.active: Dict[Hashable, asyncio.Future] = {}
+        self.prefetches = 0
+        self.skipped = 0
+        self.decayed_at = monotonic()
+        self.task: Optional[asyncio.Future] = None
+
+    def has_budget(self, hot_key: HotKey) -> bool:
+        # Prefetches spend at most a fraction of each rate limit window of the
+        # endpoints their route calls
+        for family in hot_key.families:
+            window = self.client.budgets.get(family, hot_key.authorization)
+            if (
+                window is not None
+                and window.prefetched
+                >= config.PREFETCH_UPSTREAM_FRACTION * window.limit
+            ):
+                return False
+        return True
+
+    def prefetch(self):
+        now = monotonic()
+        if now - self.decayed_at >= config.HOT_KEYS_DECAY_INTERVAL:
+            self.decayed_at = now
+            self.hot_keys.decay()
+
+        for key, future in list(self.active.items()):
+            if future.done():
+                del self.active[key]
+
+        for key in self.hot_keys.hottest():
+            if len(self.active) >= self.max_active:
+                return
+            hot_key = self.hot_keys.top[key]
+            entry = self.response_cache.entries.get(key)
+            if (
+                hot_key.count < config.PREFETCH_MIN_REQUESTS
+                or entry is None
+                or key in self.active
+                or key in self.response_cache.refreshes
+                or now < entry.fresh_until - config.PREFETCH_AHEAD
+                or now >= entry.stale_until
+            ):
+                continue
+            if not self.has_budget(hot_key):
+                self.skipped += 1
+                continue
+
+            # The refresh task keeps the context its calls are counted in
+            token = budget.prefetching.set(True)
+            try:
+                self.response_cache.revalidate(key, entry.limit, hot_key.fetch)
+            finally:
+                budget.prefetching.reset(token)
+            self.active[key] = self.response_cache.refreshes[key]
+            self.prefetches += 1
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(config.PREFETCH_INTERVAL)
+            self.prefetch()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+
+
+async def prefetch_context(app: web.Application) -> AsyncIterator[None]:
+    app["prefetcher"] = Prefetcher(
+        HotKeys(), app["response_cache"], app["upstream"]
+    )
+    app["prefetcher"].start()
+    yield
+    await app["prefetcher"].close()
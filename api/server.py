@@ -1,6 +1,37 @@
-from typing import Dict, Callable, Awaitable, cast
+import asyncio
+import functools
+import math
+
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Callable,
+    Awaitable,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
 from aiohttp import web
-from . import twitter_api, config
+from . import (
+    twitter_api,
+    config,
+    upstream,
+    cache,
+    codec,
+    compression,
+    deadline,
+    limiter,
+    metrics,
+    models,
+    prefetch,
+    store,
+    throttle,
+    tracing,
+    workers,
+)
 
 routes = web.RouteTableDef()
 
@@ -13,17 +44,24 @@ def int_parameter_in_range(
         if value < min or value > max:
             raise ValueError("not in range")
     except (TypeError, ValueError):
-        raise ServerError(
-            f"Invalid {parameter} parameter: must be a number between {min} and {max}",
-            status=400,
-        )
+        raise invalid_parameter(parameter, max, min)
     return value
 
 
+def invalid_parameter(parameter: str, max: int, min: int = 1):
+    return ServerError(
+        f"Invalid {parameter} parameter: must be a number between {min} and {max}",
+        status=400,
+    )
+
+
 class ServerError(Exception):
-    def __init__(self, message, status: int = 500):
+    def __init__(
+        self, message, status: int = 500, headers: Optional[Dict] = None
+    ):
         super(Exception, self).__init__(message)
         self.status = status
+        self.headers = headers
 
 
 @web.middleware
@@ -34,56 +72,425 @@ async def error_middleware(
     try:
         return await handler(req)
     except (ServerError, twitter_api.ApiError) as exception:
-        return web.json_response(
-            {"error": str(exception)}, status=exception.status
+        return codec.json_response(
+            {"error": str(exception)},
+            status=exception.status,
+            headers=exception.headers,
         )
 
 
+def wants_stream(req: web.Request) -> bool:
+    return req.query.get("stream") == "1" or "application/x-ndjson" in (
+        req.headers.get("accept", "")
+    )
+
+
+def next_cursor_headers(
+    entries: List[Tuple[str, models.Tweet]], limit: int, exhausted: bool
+) -> Dict[str, str]:
+    # Only results upstream has no more of end without a cursor, shorter ones
+    # were cut short by the deadline or left out tweets missing from v2
+    if not entries or (len(entries) < limit and exhausted):
+        return {}
+    return {"X-Next-Cursor": twitter_api.encode_cursor(entries[-1][0])}
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak validators and those of any encoding match the same body
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value.startswith("W/"):
+            value = value[2:]
+        if value == "*" or value.strip('"').partition("-")[0] == etag:
+            return True
+    return False
+
+
+async def entries_response(
+    req: web.Request,
+    key: Hashable,
+    entry: cache.CacheEntry,
+    limit: int,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> web.StreamResponse:
+    def serialize(entries: List[Tuple[str, models.Tweet]]) -> bytes:
+        with trace.phase("serialize"):
+            return codec.dumps([tweet for _, tweet in entries])
+
+    response_cache = req.app["response_cache"]
+    compressor = req.app["compressor"]
+    rendered = response_cache.render(key, entry, limit, serialize)
+    encoding = compressor.choose(
+        req.headers.get("accept-encoding", ""), len(rendered.body)
+    )
+
+    degraded = cache.degraded(entry.value)
+    if degraded:
+        deadline.degrade()
+    headers = next_cursor_headers(entry.value[:limit], limit, entry.exhausted)
+    # Each encoding is a different representation with its own validator
+    etag = rendered.etag if encoding is None else f"{rendered.etag}-{encoding}"
+    headers["ETag"] = f'"{etag}"'
+    # Clients poll again once the cached response stops being fresh, partial
+    # responses are not kept
+    headers["Cache-Control"] = (
+        "no-store" if degraded else f"private, max-age={entry.max_age()}"
+    )
+    headers["Vary"] = "Accept-Encoding"
+
+    if etag_matches(req.headers.get("if-none-match", ""), rendered.etag):
+        return web.Response(status=304, headers=headers)
+
+    body = rendered.body
+    if encoding is not None:
+        body = rendered.variants.get(encoding)
+        if body is None:
+            with trace.phase("compress"):
+                body = await compressor.compress(encoding, rendered.body)
+            response_cache.add_variant(key, entry, rendered, encoding, body)
+        headers["Content-Encoding"] = encoding
+    return web.Response(
+        body=body,
+        headers=headers,
+        content_type="application/json",
+        charset="utf-8",
+    )
+
+
+async def stream_response(
+    req: web.Request,
+    entries: AsyncIterator[Tuple[str, models.Tweet]],
+    limit: int,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> web.StreamResponse:
+    res = web.StreamResponse()
+    res.content_type = "application/x-ndjson"
+    res.charset = "utf-8"
+
+    count = 0
+    try:
+        async for id, tweet in entries:
+            if not res.prepared:
+                await res.prepare(req)
+            with trace.phase("serialize"):
+                line = codec.dumps(tweet) + b"\n"
+            await res.write(line)
+            count += 1
+    except (ServerError, twitter_api.ApiError) as exception:
+        # Errors before the first tweet still get a regular error response
+        if not res.prepared:
+            raise
+        if not isinstance(exception, deadline.DeadlineExceeded):
+            await res.write(codec.dumps({"error": str(exception)}) + b"\n")
+            await res.write_eof()
+            return res
+        # Tweets sent before the deadline are followed by their cursor
+        deadline.degrade()
+
+    if not res.prepared:
+        await res.prepare(req)
+    if count and (count == limit or deadline.degraded()):
+        await res.write(
+            codec.dumps({"cursor": twitter_api.encode_cursor(id)}) + b"\n"
+        )
+    # Headers are already sent, the last line marks partial streams
+    if deadline.degraded():
+        await res.write(codec.dumps({"degraded": True}) + b"\n")
+    await res.write_eof()
+    return res
+
+
+async def cached_entry(
+    req: web.Request,
+    route: str,
+    function: Callable[..., Awaitable[List[Tuple[str, models.Tweet]]]],
+    name: str,
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[Hashable, cache.CacheEntry]:
+    authorization = req.headers.get("authorization", "")
+    trace = req.get("trace", tracing.NO_TRACE)
+    key = (route, name, cursor, cache.token_identity(authorization))
+    fetch = functools.partial(
+        function, req.app["upstream"], authorization, name, cursor=cursor
+    )
+    req.app["prefetcher"].hot_keys.record(
+        key, fetch, authorization, prefetch.ROUTE_FAMILIES[route]
+    )
+    entry = await req.app["response_cache"].get_entry(
+        key, limit, lambda limit: fetch(limit, trace=trace)
+    )
+    return key, entry
+
+
 @routes.get("/hashtags/{tag}")
 async def hashtags(req: web.Request) -> web.StreamResponse:
-    tag = req.match_info.get("tag")
+    tag = req.match_info["tag"]
+    cursor = req.query.get("cursor")
+    client = req.app["upstream"]
+    authorization = req.headers.get("authorization", "")
+    trace = req.get("trace", tracing.NO_TRACE)
 
-    if req.query.get("limit") is None:
-        return web.json_response(
-            await twitter_api.search_hashtag(
-                req.headers.get("authorization", ""), tag
-            )
+    limit = (
+        int_parameter_in_range(
+            req.query, "limit", max=config.MAX_HASHTAG_SEARCH_RESULTS
         )
-
-    limit = int_parameter_in_range(
-        req.query, "limit", max=config.MAX_HASHTAG_SEARCH_RESULTS
+        if req.query.get("limit") is not None
+        else config.DEFAULT_HASHTAG_SEARCH_RESULTS
     )
 
-    return web.json_response(
-        await twitter_api.search_hashtag(
-            req.headers.get("authorization", ""), tag, limit=limit
+    if wants_stream(req):
+        return await stream_response(
+            req,
+            twitter_api.iter_hashtag(
+                client,
+                authorization,
+                tag,
+                limit=limit,
+                cursor=cursor,
+                trace=trace,
+            ),
+            limit,
+            trace,
         )
+
+    key, entry = await cached_entry(
+        req, "hashtags", twitter_api.search_hashtag_entries, tag, cursor, limit
     )
+    return await entries_response(req, key, entry, limit, trace)
 
 
 @routes.get("/users/{username}")
 async def users(req: web.Request) -> web.StreamResponse:
-    username = req.match_info.get("username")
+    username = req.match_info["username"]
+    cursor = req.query.get("cursor")
+    client = req.app["upstream"]
+    authorization = req.headers.get("authorization", "")
+    trace = req.get("trace", tracing.NO_TRACE)
+
+    limit = (
+        int_parameter_in_range(
+            req.query, "limit", max=config.MAX_USER_TWEET_RESULTS
+        )
+        if req.query.get("limit") is not None
+        else config.DEFAULT_USER_TWEET_RESULTS
+    )
+
+    if wants_stream(req):
+        return await stream_response(
+            req,
+            twitter_api.iter_user_tweets(
+                client,
+                authorization,
+                username,
+                limit=limit,
+                cursor=cursor,
+                trace=trace,
+            ),
+            limit,
+            trace,
+        )
+
+    key, entry = await cached_entry(
+        req,
+        "users",
+        twitter_api.get_user_tweet_entries,
+        username,
+        cursor,
+        limit,
+    )
+    return await entries_response(req, key, entry, limit, trace)
+
+
+def batch_queries(data: Any) -> List[Dict]:
+    queries = data.get("queries") if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not queries:
+        raise ServerError(
+            "Invalid batch: expected a list of queries", status=400
+        )
+    if len(queries) > config.BATCH_MAX_QUERIES:
+        raise ServerError(
+            f"Invalid batch: at most {config.BATCH_MAX_QUERIES} queries",
+            status=400,
+        )
+    if not all(isinstance(query, dict) for query in queries):
+        raise ServerError("Invalid batch: queries must be objects", status=400)
+    return queries
+
+
+# Rate limited route of each kind of batch query
+BATCH_ROUTES = {"hashtag": "/hashtags/{tag}", "user": "/users/{username}"}
+
+
+def batch_kind(query: Dict) -> Optional[str]:
+    kind = next((kind for kind in BATCH_ROUTES if kind in query), None)
+    if kind is None or not isinstance(query[kind], str):
+        return None
+    return kind
+
 
-    if req.query.get("limit") is None:
-        return web.json_response(
-            await twitter_api.get_user_tweets(
-                req.headers.get("authorization", ""), username
+def batch_costs(queries: List[Dict]) -> Dict[str, int]:
+    # A batch pays a token per query to the route of each query, up to a cap
+    # so that full batches fit in the burst of any route
+    costs: Dict[str, int] = {}
+    for query in queries:
+        kind = batch_kind(query)
+        if kind is not None:
+            route = BATCH_ROUTES[kind]
+            costs[route] = min(
+                costs.get(route, 0) + 1, config.BATCH_MAX_ROUTE_TOKENS
             )
+    return costs
+
+
+async def batch_result(req: web.Request, query: Dict) -> Dict:
+    # Queries get the results and errors of their single endpoint
+    kinds = {
+        "hashtag": (
+            "hashtags",
+            twitter_api.search_hashtag_entries,
+            config.MAX_HASHTAG_SEARCH_RESULTS,
+            config.DEFAULT_HASHTAG_SEARCH_RESULTS,
+        ),
+        "user": (
+            "users",
+            twitter_api.get_user_tweet_entries,
+            config.MAX_USER_TWEET_RESULTS,
+            config.DEFAULT_USER_TWEET_RESULTS,
+        ),
+    }
+    try:
+        kind = batch_kind(query)
+        if kind is None:
+            raise ServerError(
+                "Invalid query: expected a hashtag or user", status=400
+            )
+        route, function, max_limit, default_limit = kinds[kind]
+        limit = query.get("limit")
+        if limit is None:
+            limit = default_limit
+        elif isinstance(limit, int) and not isinstance(limit, bool):
+            limit = int_parameter_in_range(query, "limit", max=max_limit)
+        else:
+            # Json limits are integers, not floats, bools or strings
+            raise invalid_parameter("limit", max_limit)
+        cursor = query.get("cursor")
+        if cursor is not None and not isinstance(cursor, str):
+            raise ServerError("Invalid cursor", status=400)
+
+        _, entry = await cached_entry(
+            req, route, function, query[kind], cursor, limit
         )
+    except (ServerError, twitter_api.ApiError) as exception:
+        return {"error": str(exception), "status": exception.status}
 
-    limit = int_parameter_in_range(
-        req.query, "limit", max=config.MAX_USER_TWEET_RESULTS
+    entries = entry.value[:limit]
+    degraded = cache.degraded(entry.value)
+    result: Dict[str, Any] = {"tweets": [tweet for _, tweet in entries]}
+    cursor = next_cursor_headers(entries, limit, entry.exhausted).get(
+        "X-Next-Cursor"
     )
+    if cursor is not None:
+        result["cursor"] = cursor
+    if degraded:
+        result["degraded"] = True
+    return result
+
+
+@routes.post("/batch")
+async def batch(req: web.Request) -> web.StreamResponse:
+    trace = req.get("trace", tracing.NO_TRACE)
+    try:
+        data = codec.loads(await req.read())
+    except ValueError:
+        raise ServerError("Invalid batch: malformed json", status=400)
+    queries = batch_queries(data)
+    wait = throttle.take_all(req, batch_costs(queries))
+    if wait:
+        raise ServerError(
+            "Too many requests",
+            status=429,
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+    # Queries share a concurrency limit, and tweets in several of them are
+    # hydrated once through the per tweet single-flight of the client
+    concurrency = limiter.Limiter(config.BATCH_MAX_CONCURRENCY)
+
+    async def run(index: int, query: Dict) -> Tuple[int, Dict]:
+        async with concurrency:
+            result = await batch_result(req, query)
+        # Queries share the deadline of the batch, but are degraded on their own
+        if result.get("degraded"):
+            deadline.degrade()
+        return index, result
+
+    runs = [
+        asyncio.ensure_future(run(index, query))
+        for index, query in enumerate(queries)
+    ]
+    try:
+        if not wants_stream(req):
+            results = [result for _, result in await asyncio.gather(*runs)]
+            with trace.phase("serialize"):
+                return codec.json_response({"results": results})
 
-    return web.json_response(
-        await twitter_api.get_user_tweets(
-            req.headers.get("authorization", ""), username, limit=limit
+        # Results are sent as they complete, tagged with their query index
+        res = web.StreamResponse()
+        res.content_type = "application/x-ndjson"
+        res.charset = "utf-8"
+        await res.prepare(req)
+        for completed in asyncio.as_completed(runs):
+            index, result = await completed
+            with trace.phase("serialize"):
+                line = codec.dumps({"index": index, **result}) + b"\n"
+            await res.write(line)
+        await res.write_eof()
+        return res
+    finally:
+        for pending in runs:
+            pending.cancel()
+
+
+@routes.get("/health")
+async def health(req: web.Request) -> web.StreamResponse:
+    return codec.json_response({"status": "ok"})
+
+
+@routes.get("/metrics")
+async def metrics_view(req: web.Request) -> web.StreamResponse:
+    text = metrics.render(req.app)
+    # Workers answer with the metrics of all of them, by worker
+    worker_socket = req.app.get("worker_socket")
+    if worker_socket is not None and req.query.get("scope") != "worker":
+        text = metrics.merge(
+            await workers.collect_metrics(worker_socket, text), "worker"
         )
+    return web.Response(
+        body=text.encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
     )
 
 
 def make_app():
-    app = web.Application(middlewares=[error_middleware])
+    app = web.Application(
+        middlewares=[
+            metrics.metrics_middleware,
+            tracing.tracing_middleware,
+            error_middleware,
+            throttle.throttle_middleware,
+            deadline.deadline_middleware,
+        ]
+    )
+    app["metrics"] = metrics.ServerMetrics()
+    app["bucket_stores"] = throttle.make_bucket_stores()
+    app.on_response_prepare.append(throttle.add_rate_limit_headers)
+    app.on_response_prepare.append(tracing.add_server_timing)
+    app.on_response_prepare.append(deadline.add_degraded_header)
+    app.cleanup_ctx.append(store.store_context)
+    app.cleanup_ctx.append(upstream.client_context)
+    app.cleanup_ctx.append(cache.response_cache_context)
+    app.cleanup_ctx.append(prefetch.prefetch_context)
+    app.cleanup_ctx.append(compression.compression_context)
     app.add_routes(routes)
     return app
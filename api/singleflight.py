@@ -0,0 +1,94 @@
+import asyncio
+
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    TypeVar,
+)
+
+from . import deadline
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def fly(
+        self, keys: List[Hashable], work: Callable[[], Awaitable[T]]
+    ) -> asyncio.Future:
+        async def detached() -> T:
+            # Flights are shared, so they are not bounded by the deadline of
+            # the request starting them, callers bound their own wait
+            deadline.request_deadline.set(deadline.Deadline(None))
+            return await work()
+
+        flight = asyncio.ensure_future(detached())
+        for key in keys:
+            self.flights[key] = flight
+
+        def land(flight: asyncio.Future):
+            for key in keys:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            # Retrieve the exception in case every caller was cancelled
+            if not flight.cancelled():
+                flight.exception()
+
+        flight.add_done_callback(land)
+        return flight
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        flight = self.flights.get(key)
+
+        if flight is None:
+            flight = self.fly([key], work)
+        else:
+            self.coalesced += 1
+
+        # Shielded so a cancelled caller doesn't cancel the shared flight
+        return await asyncio.shield(flight)
+
+    async def do_many(
+        self,
+        namespace: Hashable,
+        keys: List[str],
+        work: Callable[[List[str]], Awaitable[Dict[str, T]]],
+    ) -> Dict[str, T]:
+        # Keys already in flight are awaited, the rest are worked on together
+        # and made available to later callers while in flight. Results may
+        # miss some keys.
+        flights: Dict[asyncio.Future, List[str]] = {}
+        missing = []
+        for key in keys:
+            flight: Optional[asyncio.Future] = self.flights.get(
+                (namespace, key)
+            )
+            if flight is None:
+                missing.append(key)
+                continue
+            if flight not in flights:
+                self.coalesced += 1
+                flights[flight] = []
+            flights[flight].append(key)
+
+        if missing:
+            flight = self.fly(
+                [(namespace, key) for key in missing],
+                lambda: work(missing),
+            )
+            flights[flight] = missing
+
+        results: Dict[str, T] = {}
+        for flight, flight_keys in flights.items():
+            values = await asyncio.shield(flight)
+            results.update(
+                (key, values[key]) for key in flight_keys if key in values
+            )
+        return results
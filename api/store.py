@@ -0,0 +1,252 @@
+import asyncio
+import contextlib
+import math
+import sqlite3
+
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Tuple
+from aiohttp import web
+
+from . import config, codec, models
+
+# Optional sqlite file that keeps hydrated tweet contents and cached responses
+# across restarts, shared by the workers serving on the same host. Nothing is
+# loaded at startup, entries are read when the in-memory caches miss them.
+#
+# The file is only touched from one thread per process, so the event loop
+# never waits on the disk. New entries are written in batches, and compactions
+# remove expired entries and then the oldest ones over the size cap.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires_at REAL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at);
+"""
+
+# Rows for a single statement, below the sqlite variables limit
+MAX_VARIABLES = 500
+
+Row = Tuple[str, bytes, Optional[float], float]
+
+
+class Store:
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = config.PERSISTENT_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="store")
+        self.connection: Optional[sqlite3.Connection] = None
+        self.pending: Dict[str, Row] = {}
+        self.maintenance: Optional[asyncio.Future] = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    async def run(self, function, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, function, *args
+        )
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=config.PERSISTENT_CACHE_BUSY_TIMEOUT,
+            isolation_level=None,
+        )
+        # Readers don't block the writer of another worker, and freed pages go
+        # back to the filesystem on compaction
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.executescript(SCHEMA)
+        self.connection = connection
+
+    def read(self, keys: List[str]) -> Dict[str, bytes]:
+        assert self.connection is not None
+        now = time()
+        values: Dict[str, bytes] = {}
+        for index in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[index : index + MAX_VARIABLES]
+            values.update(
+                self.connection.execute(
+                    "SELECT key, value FROM entries WHERE key IN ("
+                    + ",".join("?" * len(chunk))
+                    + ") AND (expires_at IS NULL OR expires_at > ?)",
+                    [*chunk, now],
+                ).fetchall()
+            )
+        return values
+
+    def write(self, rows: List[Row]):
+        assert self.connection is not None
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows
+            )
+
+    def compact(self) -> int:
+        assert self.connection is not None
+        with self.connection:
+            self.connection.execute("BEGIN")
+            evicted = self.connection.execute(
+                "DELETE FROM entries WHERE expires_at <= ?", [time()]
+            ).rowcount
+            count, size = self.connection.execute(
+                "SELECT count(*), coalesce(sum(length(key) + length(value)), 0)"
+                " FROM entries"
+            ).fetchone()
+            if size > self.max_bytes:
+                # Entries are about the same size, removing the oldest share
+                # of them brings the file below the target
+                oldest = math.ceil(
+                    count
+                    * (
+                        1
+                        - config.PERSISTENT_CACHE_COMPACT_TARGET
+                        * self.max_bytes
+                        / size
+                    )
+                )
+                evicted += self.connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries"
+                    " ORDER BY stored_at LIMIT ?)",
+                    [oldest],
+                ).rowcount
+        self.connection.execute("PRAGMA incremental_vacuum")
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return evicted
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    async def open(self):
+        await self.run(self.connect)
+        self.maintenance = asyncio.ensure_future(self.maintain())
+
+    async def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        # Entries not written yet are read from memory
+        values = {
+            key: self.pending[key][1] for key in keys if key in self.pending
+        }
+        missing = [key for key in keys if key not in values]
+        if missing:
+            # A busy or broken file reads as missing entries
+            with contextlib.suppress(sqlite3.Error):
+                values.update(await self.run(self.read, missing))
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def put(self, key: str, value: bytes, expires_at: Optional[float] = None):
+        self.pending[key] = (key, value, expires_at, time())
+
+    async def flush(self):
+        if self.pending:
+            rows = list(self.pending.values())
+            self.pending = {}
+            await self.run(self.write, rows)
+            self.writes += len(rows)
+
+    async def maintain(self):
+        compacted_at = time()
+        while True:
+            await asyncio.sleep(config.PERSISTENT_CACHE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time() - compacted_at >= (
+                    config.PERSISTENT_CACHE_COMPACT_INTERVAL
+                ):
+                    compacted_at = time()
+                    self.evictions += await self.run(self.compact)
+            except sqlite3.Error:
+                # Entries are lost, the caches work without them
+                pass
+
+    async def close(self):
+        if self.maintenance is not None:
+            self.maintenance.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.maintenance
+        with contextlib.suppress(sqlite3.Error):
+            await self.flush()
+        await self.run(self.disconnect)
+        self.executor.shutdown()
+
+    async def get_contents(self, ids: List[str]) -> Dict[str, models.Content]:
+        values = await self.get_many([f"content:{id}" for id in ids])
+        return {
+            key[len("content:") :]: models.Content(**codec.loads(value))
+            for key, value in values.items()
+        }
+
+    def put_content(self, id: str, content: models.Content):
+        self.put(f"content:{id}", codec.dumps(content))
+
+    async def get_response(
+        self, key: Hashable
+    ) -> Optional[Tuple[int, List[Any], float, float, bool]]:
+        # Responses are entries of (id, tweet) pairs, read back with the
+        # tweets as dicts, the seconds they are still fresh and usable, and
+        # whether upstream had no more of them
+        response_key = f"response:{codec.dumps(key).decode()}"
+        value = (await self.get_many([response_key])).get(response_key)
+        if value is None:
+            return None
+        response = codec.loads(value)
+        now = time()
+        return (
+            response["limit"],
+            [tuple(entry) for entry in response["value"]],
+            response["fresh_until"] - now,
+            response["stale_until"] - now,
+            response.get("exhausted", False),
+        )
+
+    def put_response(
+        self,
+        key: Hashable,
+        limit: int,
+        value: List[Any],
+        ttl: float,
+        stale_ttl: float,
+        exhausted: bool = False,
+    ):
+        now = time()
+        self.put(
+            f"response:{codec.dumps(key).decode()}",
+            codec.dumps(
+                {
+                    "limit": limit,
+                    "value": value,
+                    "fresh_until": now + ttl,
+                    "stale_until": now + ttl + stale_ttl,
+                    "exhausted": exhausted,
+                }
+            ),
+            now + ttl + stale_ttl,
+        )
+
+
+async def store_context(app: web.Application) -> AsyncIterator[None]:
+    if not config.PERSISTENT_CACHE_PATH:
+        app["store"] = None
+        yield
+        return
+
+    app["store"] = Store(config.PERSISTENT_CACHE_PATH)
+    await app["store"].open()
+    yield
+    await app["store"].close()
@@ -0,0 +1,141 @@
+import math
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Mapping, Tuple
+from aiohttp import web
+
+from . import config, cache, codec
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class BucketStore:
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_clients: int = config.RATE_LIMIT_MAX_CLIENTS,
+        idle_ttl: float = config.RATE_LIMIT_IDLE_TTL,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # Idle buckets refill completely, forgetting them loses nothing
+        self.idle_ttl = max(idle_ttl, burst / rate)
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def refill(self, key: str) -> TokenBucket:
+        now = monotonic()
+        bucket = self.buckets.pop(key, None)
+
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(
+                self.burst,
+                bucket.tokens + (now - bucket.updated_at) * self.rate,
+            )
+            bucket.updated_at = now
+
+        # Most recently used buckets are kept at the end of the store
+        self.buckets[key] = bucket
+        while self.buckets and (
+            len(self.buckets) > self.max_clients
+            or now - next(iter(self.buckets.values())).updated_at
+            > self.idle_ttl
+        ):
+            self.buckets.popitem(last=False)
+        return bucket
+
+    def take(self, key: str, tokens: float = 1) -> Tuple[bool, TokenBucket]:
+        bucket = self.refill(key)
+        if bucket.tokens < tokens:
+            return False, bucket
+
+        bucket.tokens -= tokens
+        return True, bucket
+
+    def wait(self, bucket: TokenBucket, tokens: float = 1) -> float:
+        return max(0, tokens - bucket.tokens) / self.rate
+
+    def headers(self, bucket: TokenBucket) -> Dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(self.burst),
+            "X-RateLimit-Remaining": str(math.floor(bucket.tokens)),
+            "X-RateLimit-Reset": str(
+                math.ceil((self.burst - bucket.tokens) / self.rate)
+            ),
+        }
+
+
+def client_key(req: web.Request) -> str:
+    authorization = req.headers.get("authorization")
+    if authorization:
+        return f"token:{cache.token_identity(authorization)}"
+    return f"ip:{req.remote}"
+
+
+def make_bucket_stores(
+    rate_limits: Mapping[str, Tuple[float, int]] = config.RATE_LIMITS,
+) -> Dict[str, BucketStore]:
+    return {
+        route: BucketStore(rate, burst)
+        for route, (rate, burst) in rate_limits.items()
+    }
+
+
+def take_all(req: web.Request, costs: Mapping[str, float]) -> float:
+    # Requests doing the work of other routes, like batches, pay their tokens
+    # all at once or not at all. Returns the seconds to wait when they can't
+    key = client_key(req)
+    charges = []
+    for route, tokens in costs.items():
+        store = req.app["bucket_stores"].get(route)
+        if store is not None:
+            charges.append((store, store.refill(key), tokens))
+    wait = max(
+        (store.wait(bucket, tokens) for store, bucket, tokens in charges),
+        default=0,
+    )
+    if not wait:
+        for _, bucket, tokens in charges:
+            bucket.tokens -= tokens
+    return wait
+
+
+@web.middleware
+async def throttle_middleware(
+    req: web.Request,
+    handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+) -> web.StreamResponse:
+    resource = req.match_info.route.resource
+    store = req.app["bucket_stores"].get(
+        resource.canonical if resource is not None else None
+    )
+    if store is None:
+        return await handler(req)
+
+    allowed, bucket = store.take(client_key(req))
+    headers = store.headers(bucket)
+
+    if not allowed:
+        headers["Retry-After"] = str(math.ceil(store.wait(bucket)))
+        return codec.json_response(
+            {"error": "Too many requests"}, status=429, headers=headers
+        )
+
+    req["rate_limit_headers"] = headers
+    return await handler(req)
+
+
+async def add_rate_limit_headers(req: web.Request, res: web.StreamResponse):
+    headers = req.get("rate_limit_headers")
+    if headers is not None:
+        res.headers.update(headers)
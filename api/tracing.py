@@ -0,0 +1,127 @@
+import logging
+import random
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List
+from aiohttp import web
+
+from . import codec, config
+
+# Structured entries of slow and sampled requests, one json object per line
+logger = logging.getLogger(__name__)
+
+
+class Phase:
+    __slots__ = ("phases", "name", "started_at")
+
+    def __init__(self, phases: Dict[str, List[float]], name: str):
+        self.phases = phases
+        self.name = name
+        self.started_at = 0.0
+
+    def __enter__(self):
+        self.started_at = perf_counter()
+
+    def __exit__(self, *error_info):
+        duration = perf_counter() - self.started_at
+        totals = self.phases.get(self.name)
+        if totals is None:
+            self.phases[self.name] = [duration, 1]
+        else:
+            totals[0] += duration
+            totals[1] += 1
+
+
+class Trace:
+    __slots__ = ("phases", "started_at")
+
+    def __init__(self):
+        # Total seconds and number of times each phase ran, phases running
+        # concurrently (like v1 hydrations of a stream) add up their durations
+        self.phases: Dict[str, List[float]] = {}
+        self.started_at = perf_counter()
+
+    def phase(self, name: str) -> Phase:
+        return Phase(self.phases, name)
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            [
+                f"{name};dur={duration * 1000:.1f}"
+                + (f';desc="{count} calls"' if count > 1 else "")
+                for name, (duration, count) in self.phases.items()
+            ]
+            + [f"total;dur={(perf_counter() - self.started_at) * 1000:.1f}"]
+        )
+
+    def entry(self) -> Dict[str, Any]:
+        return {
+            "duration_ms": round((perf_counter() - self.started_at) * 1000, 1),
+            "phases": {
+                name: {"ms": round(duration * 1000, 1), "count": count}
+                for name, (duration, count) in self.phases.items()
+            },
+        }
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *error_info):
+        pass
+
+
+class NullTrace(Trace):
+    # Shared by untraced calls, it records nothing
+    __slots__ = ()
+
+    def phase(self, name: str) -> Phase:
+        return NULL_PHASE  # type: ignore
+
+
+NULL_PHASE = NullPhase()
+NO_TRACE = NullTrace()
+
+
+@web.middleware
+async def tracing_middleware(
+    req: web.Request,
+    handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+) -> web.StreamResponse:
+    if not config.TRACING_ENABLED:
+        return await handler(req)
+
+    trace = Trace()
+    req["trace"] = trace
+    status: Any = 500
+    try:
+        res = await handler(req)
+        status = res.status
+        return res
+    except web.HTTPException as exception:
+        status = exception.status
+        raise
+    finally:
+        duration = perf_counter() - trace.started_at
+        slow = duration >= config.TRACE_SLOW_REQUEST_THRESHOLD
+        if slow or random.random() < config.TRACE_SAMPLE_RATE:
+            logger.info(
+                codec.dumps(
+                    {
+                        "method": req.method,
+                        "path": req.path,
+                        "status": status,
+                        "slow": slow,
+                        **trace.entry(),
+                    }
+                ).decode()
+            )
+
+
+async def add_server_timing(req: web.Request, res: web.StreamResponse):
+    trace = req.get("trace")
+    if trace is not None:
+        res.headers["Server-Timing"] = trace.server_timing()
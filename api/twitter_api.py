@@ -1,86 +1,49 @@
-import aiohttp
 import asyncio
+import base64
+import functools
 import json
+import aiohttp
 
-from typing import cast, Dict, List, Union, Optional
-from datetime import datetime, timedelta, timezone
-
-from . import config
-
-
-def transform_v1_hashtags(entities: Dict):
-    return {
-        "hashtags": [
-            f'#{hashtag.get("text")}'
-            for hashtag in entities.get("hashtags", [])
-        ]
-    }
-
-
-def transform_v1_text(tweet: Dict):
-    return {"text": tweet.get("full_text")}
-
-
-def transform_v1_tweet(tweet: Dict):
-    return {
-        **transform_v1_hashtags(
-            tweet.get("retweeted_status", tweet).get("entities", {})
-        ),
-        **transform_v1_text(tweet.get("retweeted_status", tweet)),
-    }
-
-
-def transform_v2_public_metrics(public_metrics: Dict):
-    return {
-        "likes": public_metrics.get("like_count"),
-        "replies": public_metrics.get("reply_count"),
-        "retweets": public_metrics.get("retweet_count"),
-    }
-
-
-def transform_v2_created_at(created_at: Optional[str]):
-    return {
-        "date": "{0:%I:%M %p - %d %b %Y}".format(
-            datetime.fromisoformat(created_at[:-1] + "+00:00").astimezone(
-                timezone(
-                    timedelta(minutes=config.TIMEZONE_TIMEDELTA_MINUTES)
-                    * (-1 if config.TIMEZONE_TIMEDELTA_MINUTES < 0 else 1)
-                )
-            )
-        )
-        if created_at
-        else None
-    }
-
-
-def transform_v2_included_users(includes: Dict):
-    return {user["id"]: user for user in includes.get("users", [])}
-
-
-def transform_v2_user(user: Dict):
-    return {
-        "account": {
-            "id": user.get("id"),
-            "fullname": user.get("name"),
-            "href": f'/{cast(str, user.get("username"))}'
-            if user.get("username")
-            else None,
-        }
-    }
-
-
-def transform_v2_tweet(tweet: Dict, included_users: Dict):
-    return {
-        **transform_v2_user(included_users.get(tweet.get("author_id"), {})),
-        **transform_v2_created_at(tweet.get("created_at")),
-        **transform_v2_public_metrics(tweet.get("public_metrics", {})),
-    }
-
-
-class ApiError(Exception):
-    def __init__(self, message, status: int = 500):
-        super(Exception, self).__init__(message)
-        self.status = status
+from collections import deque
+from typing import (
+    cast,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Union,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from . import (
+    config,
+    breaker,
+    deadline,
+    limiter,
+    models,
+    tracing,
+    upstream,
+)
+from .errors import ApiError
+
+T = TypeVar("T")
+
+
+class Partial(List[T]):
+    # Degraded results were cut short by the deadline of the request, or miss
+    # the contents of some of their tweets
+    degraded = False
+    # Exhausted results got fewer tweets from upstream than their limit, there
+    # are no more behind them even when some tweets were left out
+    exhausted = False
+
+
+Entries = Partial[Tuple[str, models.Tweet]]
 
 
 def check_v1_error(data: Union[Dict, List[Dict]]):
@@ -115,115 +78,604 @@ def check_v2_error(data: Dict):
         )
 
 
-async def get_v1_tweet(authorization: str, id: str) -> Dict:
-    async with aiohttp.ClientSession(
-        headers={"Authorization": authorization}
-    ) as session:
-        async with session.get(
-            config.TWITTER_API_V1_TWEET.format(id=id),
-            params={"tweet_mode": "extended"},
-        ) as res:
-            tweet = await res.json()
+def encode_cursor(id: str) -> str:
+    return base64.urlsafe_b64encode(id.encode()).decode().rstrip("=")
 
-        check_v1_error(tweet)
 
-        return transform_v1_tweet(tweet)
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if cursor is None:
+        return None
 
+    try:
+        id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (TypeError, ValueError):
+        id = b""
+    if not id.isdigit():
+        raise ApiError("Invalid cursor", status=400)
 
-async def get_v2_tweets(authorization: str, ids: List[str]) -> List[Dict]:
-    async with aiohttp.ClientSession(
-        headers={"Authorization": authorization}
-    ) as session:
-        async with session.get(
-            config.TWITTER_API_V2_TWEETS,
-            params={
-                "ids": ",".join(ids),
-                "tweet.fields": "created_at,public_metrics,entities",
-                "expansions": "author_id",
-            },
-        ) as res:
-            tweets_result = await res.json()
+    return id.decode()
 
-        check_v2_error(tweets_result)
 
-        included_users = transform_v2_included_users(
-            tweets_result.get("includes", {})
+def coalesced(function: Callable[..., Awaitable[Any]]):
+    @functools.wraps(function)
+    async def coalesced_function(
+        client: upstream.Client, authorization: str, *args, **kwargs
+    ):
+        # The trace of the first caller records the shared work, each caller
+        # waits for it until its own deadline
+        key = (
+            function.__name__,
+            authorization,
+            *(tuple(arg) if isinstance(arg, list) else arg for arg in args),
+            *sorted(item for item in kwargs.items() if item[0] != "trace"),
         )
+        return await deadline.within(
+            client.singleflight.do(
+                key, lambda: function(client, authorization, *args, **kwargs)
+            )
+        )
+
+    return coalesced_function
 
-        async def merge_v1_tweet(tweet):
-            return {
-                **transform_v2_tweet(tweet, included_users),
-                **(await get_v1_tweet(authorization, tweet.get("id"))),
-            }
 
-        tweets = await asyncio.gather(
-            *(merge_v1_tweet(tweet) for tweet in tweets_result.get("data", []))
+async def get_v1_tweets(
+    client: upstream.Client,
+    authorization: str,
+    ids: List[str],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Dict[str, models.Content]:
+    with trace.phase("v1"):
+        lookup_results = await limiter.gather(
+            config.UPSTREAM_MAX_CONCURRENCY_PER_REQUEST,
+            (
+                client.get_json(
+                    upstream.V1_LOOKUP,
+                    config.TWITTER_API_V1_TWEETS_LOOKUP,
+                    authorization,
+                    params={
+                        "id": ",".join(
+                            ids[index : index + config.TWITTER_MAX_LOOKUP_IDS]
+                        ),
+                        "tweet_mode": "extended",
+                        "trim_user": "true",
+                    },
+                )
+                for index in range(0, len(ids), config.TWITTER_MAX_LOOKUP_IDS)
+            ),
         )
 
-        return tweets
+    tweets = {}
+    with trace.phase("transform"):
+        for lookup_result in lookup_results:
+            check_v1_error(lookup_result)
+            for tweet in lookup_result:
+                id = tweet.get("id_str", str(tweet.get("id")))
+                tweets[id] = models.Content.from_v1(tweet)
+
+    return tweets
+
+
+def cache_v2_tweets(
+    client: upstream.Client,
+    tweets: List[Dict],
+    result: Dict,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Dict[str, models.Tweet]:
+    with trace.phase("transform"):
+        users = models.included_users(result.get("includes", {}))
+
+        v2_tweets = {}
+        for tweet in tweets:
+            v2_tweet = models.Tweet.from_v2(tweet, users)
+            client.tweet_metrics.put(tweet["id"], v2_tweet)
+            v2_tweets[tweet["id"]] = v2_tweet
+
+    return v2_tweets
 
 
-async def search_hashtag(
+async def merge_v1_tweets(
+    client: upstream.Client,
     authorization: str,
-    hashtag: str,
-    limit: int = config.MAX_HASHTAG_SEARCH_RESULTS,
-) -> List[Dict]:
-    async with aiohttp.ClientSession(
-        headers={"Authorization": authorization}
-    ) as session:
-        async with session.get(
-            config.TWITTER_API_V2_SEARCH_RECENT,
-            params={
-                "query": f"#{hashtag}",
-                "tweet.fields": "created_at,public_metrics,entities",
-                "expansions": "author_id",
-                "max_results": max(config.TWITTER_MIN_SEARCH_RESULTS, limit),
-            },
-        ) as res:
-            search_result = await res.json()
-
-        check_v2_error(search_result)
-
-        included_users = transform_v2_included_users(
-            search_result.get("includes", {})
+    ids: List[str],
+    v2_tweets: Dict[str, models.Tweet],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Partial[models.Tweet]:
+    v1_tweets = {}
+    for id in ids:
+        v1_tweet = client.tweet_contents.get(id)
+        if v1_tweet is not None:
+            v1_tweets[id] = v1_tweet
+
+    uncached_ids = [id for id in ids if id not in v1_tweets]
+    if uncached_ids and client.store is not None:
+        for id, v1_tweet in (
+            await client.store.get_contents(uncached_ids)
+        ).items():
+            client.tweet_contents.put(id, v1_tweet)
+            v1_tweets[id] = v1_tweet
+        uncached_ids = [id for id in uncached_ids if id not in v1_tweets]
+
+    async def lookup(ids: List[str]) -> Dict[str, models.Content]:
+        # Cached as soon as they arrive, even for callers past their deadline
+        looked_up = await get_v1_tweets(
+            client, authorization, ids, trace=trace
+        )
+        for id, v1_tweet in looked_up.items():
+            client.tweet_contents.put(id, v1_tweet)
+            if client.store is not None:
+                client.store.put_content(id, v1_tweet)
+        return looked_up
+
+    degraded = False
+    if uncached_ids:
+        # Tweets being hydrated for other requests are not looked up again
+        try:
+            v1_tweets.update(
+                await deadline.within(
+                    client.singleflight.do_many(
+                        ("get_v1_tweets", authorization), uncached_ids, lookup
+                    )
+                )
+            )
+        except (ApiError, aiohttp.ClientError, asyncio.TimeoutError) as error:
+            # Past the deadline, or while v1 lookups are failing, tweets not
+            # looked up yet only get their v2 data
+            if isinstance(error, ApiError) and error.status < 500:
+                raise
+            degraded = True
+            deadline.degrade()
+            for id in uncached_ids:
+                v1_tweet = client.tweet_contents.get(id)
+                if v1_tweet is not None:
+                    v1_tweets[id] = v1_tweet
+
+    # Deleted or protected tweets are missing from the lookup result
+    with trace.phase("transform"):
+        merged = Partial(
+            v2_tweets[id].with_content(v1_tweets.get(id, models.EMPTY_CONTENT))
+            for id in ids
+        )
+    merged.degraded = degraded
+    return merged
+
+
+async def iter_merged_tweets(
+    client: upstream.Client,
+    authorization: str,
+    ids: List[str],
+    v2_tweets: Dict[str, models.Tweet],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> AsyncIterator[Tuple[str, models.Tweet]]:
+    # Batches are merged concurrently but yielded in order, buffering at most
+    # a per request concurrency worth of them
+    batches: Deque[Tuple[List[str], asyncio.Future]] = deque()
+    try:
+        for index in range(0, len(ids), config.STREAM_BATCH_SIZE):
+            batch_ids = ids[index : index + config.STREAM_BATCH_SIZE]
+            batches.append(
+                (
+                    batch_ids,
+                    asyncio.ensure_future(
+                        merge_v1_tweets(
+                            client,
+                            authorization,
+                            batch_ids,
+                            v2_tweets,
+                            trace=trace,
+                        )
+                    ),
+                )
+            )
+            if len(batches) >= config.UPSTREAM_MAX_CONCURRENCY_PER_REQUEST:
+                batch_ids, batch = batches.popleft()
+                for entry in zip(batch_ids, await batch):
+                    yield entry
+
+        while batches:
+            batch_ids, batch = batches.popleft()
+            for entry in zip(batch_ids, await batch):
+                yield entry
+    finally:
+        for _, batch in batches:
+            batch.cancel()
+
+
+async def fetch_v2_tweets(
+    client: upstream.Client,
+    authorization: str,
+    ids: List[str],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Dict[str, models.Tweet]:
+    # User timeline pages hold more tweets than a single call allows
+    with trace.phase("v2"):
+        tweets_results = await limiter.gather(
+            config.UPSTREAM_MAX_CONCURRENCY_PER_REQUEST,
+            (
+                client.get_json(
+                    upstream.V2_TWEETS,
+                    config.TWITTER_API_V2_TWEETS,
+                    authorization,
+                    params={
+                        "ids": ",".join(
+                            ids[index : index + config.TWITTER_MAX_TWEETS_IDS]
+                        ),
+                        "tweet.fields": "created_at,public_metrics",
+                        "expansions": "author_id",
+                    },
+                )
+                for index in range(0, len(ids), config.TWITTER_MAX_TWEETS_IDS)
+            ),
+        )
+
+    v2_tweets = {}
+    for tweets_result in tweets_results:
+        check_v2_error(tweets_result)
+        v2_tweets.update(
+            cache_v2_tweets(
+                client, tweets_result.get("data", []), tweets_result, trace
+            )
         )
 
-        async def merge_v1_tweet(tweet):
-            return {
-                **transform_v2_tweet(tweet, included_users),
-                **(await get_v1_tweet(authorization, tweet.get("id"))),
-            }
+    return v2_tweets
+
 
-        tweets = await asyncio.gather(
-            *(merge_v1_tweet(tweet) for tweet in search_result.get("data", []))
+async def get_v2_tweets_by_id(
+    client: upstream.Client,
+    authorization: str,
+    ids: List[str],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Dict[str, models.Tweet]:
+    v2_tweets = {}
+    for id in ids:
+        v2_tweet = client.tweet_metrics.get(id)
+        if v2_tweet is not None:
+            v2_tweets[id] = v2_tweet
+
+    uncached_ids = [id for id in ids if id not in v2_tweets]
+    if uncached_ids:
+        # Tweets being fetched for other requests are not fetched again
+        v2_tweets.update(
+            await deadline.within(
+                client.singleflight.do_many(
+                    ("get_v2_tweets", authorization),
+                    uncached_ids,
+                    lambda ids: fetch_v2_tweets(
+                        client, authorization, ids, trace=trace
+                    ),
+                )
+            )
         )
 
-        return tweets[:limit]
+    return v2_tweets
+
+
+@coalesced
+async def get_search_recent(
+    client: upstream.Client,
+    authorization: str,
+    hashtag: str,
+    limit: int,
+    until_id: Optional[str] = None,
+    next_token: Optional[str] = None,
+) -> Dict:
+    params = {
+        "query": f"#{hashtag}",
+        "tweet.fields": "created_at,public_metrics,entities",
+        "expansions": "author_id",
+        "max_results": min(
+            config.TWITTER_MAX_SEARCH_RESULTS,
+            max(config.TWITTER_MIN_SEARCH_RESULTS, limit),
+        ),
+    }
+    if until_id is not None:
+        params["until_id"] = until_id
+    if next_token is not None:
+        params["next_token"] = next_token
+
+    search_result = await client.get_json(
+        upstream.SEARCH_RECENT,
+        config.TWITTER_API_V2_SEARCH_RECENT,
+        authorization,
+        params=params,
+    )
+
+    check_v2_error(search_result)
+
+    return search_result
+
+
+async def iter_search_pages(
+    client: upstream.Client,
+    authorization: str,
+    hashtag: str,
+    limit: int,
+    until_id: Optional[str],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> AsyncIterator[Dict]:
+    # The next page is fetched while the caller works on the current one
+    remaining = limit
+    next_page: Optional[asyncio.Future] = asyncio.ensure_future(
+        get_search_recent(client, authorization, hashtag, limit, until_id)
+    )
+    try:
+        while next_page is not None:
+            with trace.phase("search"):
+                search_result = await next_page
+            next_page = None
+
+            tweets = search_result.get("data", [])[:remaining]
+            remaining -= len(tweets)
+
+            next_token = search_result.get("meta", {}).get("next_token")
+            if remaining > 0 and tweets and next_token:
+                next_page = asyncio.ensure_future(
+                    get_search_recent(
+                        client,
+                        authorization,
+                        hashtag,
+                        remaining,
+                        until_id,
+                        next_token,
+                    )
+                )
+
+            yield {**search_result, "data": tweets}
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+async def search_hashtag_entries(
+    client: upstream.Client,
+    authorization: str,
+    hashtag: str,
+    limit: int = config.DEFAULT_HASHTAG_SEARCH_RESULTS,
+    cursor: Optional[str] = None,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Entries:
+    # Pages and hydrations are shared with concurrent requests, each request
+    # merges them under its own deadline
+    entries = Entries()
+    try:
+        async for search_result in iter_search_pages(
+            client,
+            authorization,
+            hashtag,
+            limit,
+            decode_cursor(cursor),
+            trace,
+        ):
+            tweets = search_result["data"]
+            ids = [tweet.get("id") for tweet in tweets]
+            merged = await merge_v1_tweets(
+                client,
+                authorization,
+                ids,
+                cache_v2_tweets(client, tweets, search_result, trace),
+                trace=trace,
+            )
+            entries.extend(zip(ids, merged))
+            entries.degraded = entries.degraded or merged.degraded
+        entries.exhausted = len(entries) < limit
+    except deadline.DeadlineExceeded:
+        # Pages found before the deadline are returned
+        if not entries:
+            raise
+        entries.degraded = True
+
+    return entries
 
 
-async def get_user_tweets(
+async def iter_hashtag(
+    client: upstream.Client,
+    authorization: str,
+    hashtag: str,
+    limit: int = config.DEFAULT_HASHTAG_SEARCH_RESULTS,
+    cursor: Optional[str] = None,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> AsyncIterator[Tuple[str, models.Tweet]]:
+    async for search_result in iter_search_pages(
+        client, authorization, hashtag, limit, decode_cursor(cursor), trace
+    ):
+        tweets = search_result["data"]
+
+        async for entry in iter_merged_tweets(
+            client,
+            authorization,
+            [tweet.get("id") for tweet in tweets],
+            cache_v2_tweets(client, tweets, search_result, trace),
+            trace=trace,
+        ):
+            yield entry
+
+
+@coalesced
+async def get_user_timeline(
+    client: upstream.Client,
     authorization: str,
     username: str,
-    limit: int = config.MAX_USER_TWEET_RESULTS,
+    limit: int,
+    max_id: Optional[str] = None,
 ) -> List[Dict]:
-    async with aiohttp.ClientSession(
-        headers={"Authorization": authorization}
-    ) as session:
-        async with session.get(
-            config.TWITTER_API_V1_USER_TIMELINE,
-            params={
-                "screen_name": username,
-                "trim_user": "true",
-                "count": limit,
-            },
-        ) as res:
-            user_results = await res.json()
-
-        check_v1_error(user_results)
-
-        tweets = await get_v2_tweets(
+    params = {
+        "screen_name": username,
+        "trim_user": "true",
+        "tweet_mode": "extended",
+        "count": min(config.TWITTER_MAX_TIMELINE_RESULTS, limit),
+    }
+    if max_id is not None:
+        params["max_id"] = max_id
+
+    user_results = await client.get_json(
+        upstream.V1_TIMELINE,
+        config.TWITTER_API_V1_USER_TIMELINE,
+        authorization,
+        params=params,
+    )
+
+    check_v1_error(user_results)
+
+    return user_results
+
+
+async def iter_timeline_pages(
+    client: upstream.Client,
+    authorization: str,
+    username: str,
+    limit: int,
+    until_id: Optional[str],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> AsyncIterator[List[Dict]]:
+    # The next page is fetched while the caller works on the current one
+    remaining = limit
+    next_page: Optional[asyncio.Future] = asyncio.ensure_future(
+        get_user_timeline(
+            client,
             authorization,
-            [str(user_result.get("id")) for user_result in user_results],
+            username,
+            limit,
+            str(int(until_id) - 1) if until_id is not None else None,
+        )
+    )
+    try:
+        while next_page is not None:
+            with trace.phase("timeline"):
+                user_results = (await next_page)[:remaining]
+            next_page = None
+
+            remaining -= len(user_results)
+            if remaining > 0 and user_results:
+                next_page = asyncio.ensure_future(
+                    get_user_timeline(
+                        client,
+                        authorization,
+                        username,
+                        remaining,
+                        str(int(user_results[-1].get("id")) - 1),
+                    )
+                )
+
+            yield user_results
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+def cache_timeline_contents(
+    client: upstream.Client,
+    user_results: List[Dict],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> List[Tuple[str, models.Content]]:
+    # Extended timeline tweets carry the same full text and hashtags as a v1
+    # lookup, only their metrics and authors are fetched from v2
+    with trace.phase("transform"):
+        contents = []
+        for user_result in user_results:
+            id = str(user_result.get("id"))
+            content = models.Content.from_v1(user_result)
+            client.tweet_contents.put(id, content)
+            if client.store is not None:
+                client.store.put_content(id, content)
+            contents.append((id, content))
+
+    return contents
+
+
+async def merge_timeline_tweets(
+    client: upstream.Client,
+    authorization: str,
+    username: str,
+    user_results: List[Dict],
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Entries:
+    contents = cache_timeline_contents(client, user_results, trace)
+    try:
+        v2_tweets = await get_v2_tweets_by_id(
+            client, authorization, [id for id, _ in contents], trace=trace
+        )
+    except deadline.DeadlineExceeded:
+        # The timeline already has the text and date of its tweets, those not
+        # fetched from v2 yet are kept without their metrics
+        deadline.degrade()
+        with trace.phase("transform"):
+            merged = Entries(
+                (
+                    id,
+                    (
+                        client.tweet_metrics.get(id)
+                        or models.Tweet.from_v1(
+                            user_result,
+                            models.Account(
+                                user_result.get("user", {}).get("id_str"),
+                                None,
+                                f"/{username}",
+                            ),
+                        )
+                    ).with_content(content),
+                )
+                for user_result, (id, content) in zip(user_results, contents)
+            )
+        merged.degraded = True
+        return merged
+
+    # Deleted or protected tweets are missing from the v2 result
+    with trace.phase("transform"):
+        return Entries(
+            (id, v2_tweets[id].with_content(content))
+            for id, content in contents
+            if id in v2_tweets
         )
 
-        return tweets[:limit]
+
+async def get_user_tweet_entries(
+    client: upstream.Client,
+    authorization: str,
+    username: str,
+    limit: int = config.DEFAULT_USER_TWEET_RESULTS,
+    cursor: Optional[str] = None,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> Entries:
+    entries = Entries()
+    fetched = 0
+    try:
+        async for user_results in iter_timeline_pages(
+            client,
+            authorization,
+            username,
+            limit,
+            decode_cursor(cursor),
+            trace,
+        ):
+            merged = await merge_timeline_tweets(
+                client, authorization, username, user_results, trace=trace
+            )
+            entries.extend(merged)
+            entries.degraded = entries.degraded or merged.degraded
+            fetched += len(user_results)
+        # Tweets missing from v2 are left out, the timeline count tells
+        # whether it has more
+        entries.exhausted = fetched < limit
+    except deadline.DeadlineExceeded:
+        # Pages merged before the deadline are returned
+        if not entries:
+            raise
+        entries.degraded = True
+
+    return entries
+
+
+async def iter_user_tweets(
+    client: upstream.Client,
+    authorization: str,
+    username: str,
+    limit: int = config.DEFAULT_USER_TWEET_RESULTS,
+    cursor: Optional[str] = None,
+    trace: tracing.Trace = tracing.NO_TRACE,
+) -> AsyncIterator[Tuple[str, models.Tweet]]:
+    async for user_results in iter_timeline_pages(
+        client, authorization, username, limit, decode_cursor(cursor), trace
+    ):
+        for entry in await merge_timeline_tweets(
+            client, authorization, username, user_results, trace=trace
+        ):
+            yield entry
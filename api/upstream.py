@@ -0,0 +1,187 @@
+import aiohttp
+import asyncio
+import random
+
+from time import perf_counter
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from aiohttp import web
+
+from . import (
+    config,
+    breaker,
+    budget,
+    cache,
+    codec,
+    deadline,
+    errors,
+    hedging,
+    limiter,
+    metrics,
+    singleflight,
+    store,
+)
+
+# Endpoint families, each one has its own Twitter rate limit
+SEARCH_RECENT = "search_recent"
+V2_TWEETS = "v2_tweets"
+V1_TIMELINE = "v1_timeline"
+V1_LOOKUP = "v1_lookup"
+FAMILIES = [SEARCH_RECENT, V2_TWEETS, V1_TIMELINE, V1_LOOKUP]
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0.5, 1) * min(
+        config.UPSTREAM_BACKOFF_MAX,
+        config.UPSTREAM_BACKOFF_BASE * 2 ** (attempt - 1),
+    )
+
+
+def make_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=config.UPSTREAM_POOL_SIZE,
+            limit_per_host=config.UPSTREAM_POOL_SIZE_PER_HOST,
+            ttl_dns_cache=config.UPSTREAM_DNS_CACHE_TTL,
+            keepalive_timeout=config.UPSTREAM_KEEPALIVE_TIMEOUT,
+        ),
+        timeout=aiohttp.ClientTimeout(
+            total=config.UPSTREAM_TIMEOUT,
+            connect=config.UPSTREAM_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+class Client:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        store: Optional[store.Store] = None,
+    ):
+        self.session = session
+        self.store = store
+        self.singleflight = singleflight.SingleFlight()
+        self.budgets = budget.BudgetTracker()
+        self.limiter = limiter.Limiter(config.UPSTREAM_MAX_CONCURRENCY)
+        self.tweet_contents = cache.LRUCache(
+            config.TWEET_CONTENT_CACHE_MAX_ENTRIES
+        )
+        self.tweet_metrics = cache.LRUCache(
+            config.TWEET_METRICS_CACHE_MAX_ENTRIES,
+            ttl=config.TWEET_METRICS_CACHE_TTL,
+        )
+        self.metrics = metrics.UpstreamMetrics()
+        self.hedger = hedging.Hedger()
+        self.breakers = {family: breaker.Breaker() for family in FAMILIES}
+
+    def can_hedge(self, family: str, authorization: str) -> bool:
+        # Hedges never queue for a slot nor spend a scarce rate limit
+        return (
+            self.limiter.waiting == 0
+            and self.budgets.spare(family, authorization)
+            >= config.UPSTREAM_HEDGE_MIN_SPARE
+        )
+
+    async def request(
+        self,
+        family: str,
+        url: str,
+        authorization: str,
+        params: Optional[Dict] = None,
+    ) -> Tuple[int, Any]:
+        circuit = self.breakers[family]
+        if not circuit.allow():
+            raise breaker.CircuitOpen(family, circuit.retry_after())
+
+        failed: Optional[bool] = None
+        try:
+            await self.budgets.acquire(family, authorization)
+            async with self.limiter:
+                metrics.count_upstream_call()
+                # Failed calls are recorded with an "error" status
+                status: Any = "error"
+                started_at = perf_counter()
+                try:
+                    async with self.session.get(
+                        url,
+                        params=params,
+                        headers={"Authorization": authorization},
+                    ) as res:
+                        status = res.status
+                        self.budgets.update(family, authorization, res.headers)
+                        if res.status != 429 and res.status < 500:
+                            return status, codec.loads(await res.read())
+                        return status, None
+                except asyncio.CancelledError:
+                    status = "cancelled"
+                    raise
+                finally:
+                    latency = perf_counter() - started_at
+                    self.metrics.requests.observe(family, status, latency)
+                    if isinstance(status, int):
+                        self.hedger.observe(family, latency)
+                    if status != "cancelled":
+                        failed = (
+                            not isinstance(status, int)
+                            or status >= 500
+                            or latency >= config.BREAKER_SLOW_CALL
+                        )
+        finally:
+            circuit.record(failed)
+
+    async def get_json(
+        self,
+        family: str,
+        url: str,
+        authorization: str,
+        params: Optional[Dict] = None,
+    ) -> Any:
+        # Attempts, their backoffs and waits for a budget or a slot all end
+        # with the deadline of the request
+        return await deadline.within(
+            self.attempts(family, url, authorization, params)
+        )
+
+    async def attempts(
+        self,
+        family: str,
+        url: str,
+        authorization: str,
+        params: Optional[Dict] = None,
+    ) -> Any:
+        # Status of the last attempt, or the name of its transport error
+        status: Any = None
+        for attempt in range(config.UPSTREAM_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(backoff(attempt))
+
+            try:
+                status, data = await self.hedger.run(
+                    family,
+                    lambda: self.request(family, url, authorization, params),
+                    lambda: self.can_hedge(family, authorization),
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                # Failed connections and timeouts are retried like 5xx
+                status = type(error).__name__
+                continue
+            if status != 429 and status < 500:
+                return data
+
+        if status == 429:
+            raise budget.exhausted_error(
+                family, self.budgets.retry_after(family, authorization)
+            )
+
+        raise errors.ApiError(
+            f"Twitter API error: Service unavailable (status: {status})",
+            status=503,
+        )
+
+    async def close(self):
+        await self.session.close()
+
+
+async def client_context(app: web.Application) -> AsyncIterator[None]:
+    app["upstream"] = Client(make_session(), app.get("store"))
+    yield
+    await app["upstream"].close()
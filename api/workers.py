@@ -0,0 +1,304 @@
+import aiohttp
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+
+from time import monotonic
+from typing import Dict, List, Optional
+from aiohttp import web
+
+from . import config
+
+# Multi-process serving: the main process starts worker processes that share
+# the listening port with SO_REUSEPORT, so the kernel spreads connections over
+# them and every core runs json and tweet building work:
+#
+#     python -m api --workers 4
+#
+# Each worker also listens on a private unix socket, used by the main process
+# to check its health and by the other workers to collect its metrics. SIGHUP
+# restarts the workers one at a time, each replacement answers its health
+# check before the worker it replaces stops. SIGTERM and SIGINT stop them all.
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker:
+    __slots__ = ("index", "socket", "process", "failures")
+
+    def __init__(
+        self, index: int, socket: str, process: asyncio.subprocess.Process
+    ):
+        self.index = index
+        self.socket = socket
+        self.process = process
+        self.failures = 0
+
+
+def socket_name(index: int, generation: int) -> str:
+    return f"{index}.{generation}.sock"
+
+
+def latest_sockets(socket_dir: str) -> Dict[int, str]:
+    # A replaced worker keeps its socket until it stops, the replacement has a
+    # later generation
+    sockets: Dict[int, str] = {}
+    generations: Dict[int, int] = {}
+    for name in os.listdir(socket_dir):
+        index, generation, extension = name.split(".")
+        if int(generation) > generations.get(int(index), -1):
+            generations[int(index)] = int(generation)
+            sockets[int(index)] = os.path.join(socket_dir, name)
+    return dict(sorted(sockets.items()))
+
+
+def unix_session(path: str, timeout: float) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.UnixConnector(path),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+
+
+async def get_text(path: str, url: str, timeout: float) -> Optional[str]:
+    try:
+        async with unix_session(path, timeout) as session:
+            async with session.get(f"http://worker{url}") as res:
+                if res.status == 200:
+                    return await res.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    return None
+
+
+async def collect_metrics(own_socket: str, own_text: str) -> Dict[str, str]:
+    # Workers going away while collecting are left out
+    sockets = latest_sockets(os.path.dirname(own_socket))
+    texts = await asyncio.gather(
+        *(
+            (
+                asyncio.sleep(0, own_text)
+                if path == own_socket
+                else get_text(
+                    path,
+                    "/metrics?scope=worker",
+                    config.WORKER_HEALTH_CHECK_TIMEOUT,
+                )
+            )
+            for path in sockets.values()
+        )
+    )
+    return {
+        str(index): text
+        for index, text in zip(sockets, texts)
+        if text is not None
+    }
+
+
+class Supervisor:
+    def __init__(self, command: List[str], count: int, socket_dir: str):
+        self.command = command
+        self.count = count
+        self.socket_dir = socket_dir
+        self.generation = 0
+        self.workers: Dict[int, Worker] = {}
+        self.stopping = False
+        self.restart_requested = False
+        self.wake: Optional[asyncio.Event] = None
+
+    async def spawn(self, index: int) -> Worker:
+        self.generation += 1
+        path = os.path.join(
+            self.socket_dir, socket_name(index, self.generation)
+        )
+        process = await asyncio.create_subprocess_exec(
+            *self.command, "--worker-socket", path
+        )
+        return Worker(index, path, process)
+
+    async def check(self, worker: Worker) -> bool:
+        return (
+            await get_text(
+                worker.socket, "/health", config.WORKER_HEALTH_CHECK_TIMEOUT
+            )
+            is not None
+        )
+
+    async def start(self, index: int) -> Worker:
+        worker = await self.spawn(index)
+        deadline = monotonic() + config.WORKER_START_TIMEOUT
+        while worker.process.returncode is None and monotonic() < deadline:
+            if await self.check(worker):
+                return worker
+            await asyncio.sleep(config.WORKER_START_POLL_INTERVAL)
+
+        await self.stop(worker)
+        raise WorkerError(f"Worker {index} didn't start")
+
+    async def stop(self, worker: Worker):
+        # Workers finish the requests in flight before exiting
+        if worker.process.returncode is None:
+            worker.process.terminate()
+            try:
+                await asyncio.wait_for(
+                    worker.process.wait(), config.WORKER_STOP_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                worker.process.kill()
+                await worker.process.wait()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(worker.socket)
+
+    async def replace(self, worker: Worker):
+        # The replacement takes connections before the old worker stops
+        self.workers[worker.index] = await self.start(worker.index)
+        await self.stop(worker)
+
+    async def rolling_restart(self):
+        for worker in list(self.workers.values()):
+            try:
+                await self.replace(worker)
+            except WorkerError as error:
+                logger.error(f"Rolling restart aborted: {error}")
+                return
+        logger.info("Restarted all workers")
+
+    async def check_workers(self):
+        for worker in list(self.workers.values()):
+            alive = worker.process.returncode is None
+            if alive and await self.check(worker):
+                worker.failures = 0
+                continue
+
+            worker.failures += 1
+            if alive and worker.failures < config.WORKER_HEALTH_CHECK_FAILURES:
+                continue
+
+            logger.warning(
+                f"Worker {worker.index} "
+                + (
+                    "failed its health checks"
+                    if alive
+                    else f"exited with {worker.process.returncode}"
+                )
+                + ", restarting it"
+            )
+            try:
+                await self.replace(worker)
+            except WorkerError as error:
+                # Retried at the next check
+                logger.error(str(error))
+
+    def request_stop(self):
+        self.stopping = True
+        if self.wake is not None:
+            self.wake.set()
+
+    def request_restart(self):
+        self.restart_requested = True
+        if self.wake is not None:
+            self.wake.set()
+
+    async def supervise(self):
+        self.wake = asyncio.Event()
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                await self.rolling_restart()
+            else:
+                await self.check_workers()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self.wake.wait(), config.WORKER_HEALTH_CHECK_INTERVAL
+                )
+            self.wake.clear()
+
+    async def run(self) -> int:
+        loop = asyncio.get_event_loop()
+        handlers = {
+            signal.SIGTERM: self.request_stop,
+            signal.SIGINT: self.request_stop,
+            signal.SIGHUP: self.request_restart,
+        }
+        for signal_number, handler in handlers.items():
+            loop.add_signal_handler(signal_number, handler)
+
+        try:
+            started = await asyncio.gather(
+                *(self.start(index) for index in range(self.count)),
+                return_exceptions=True,
+            )
+            self.workers = {
+                worker.index: worker
+                for worker in started
+                if isinstance(worker, Worker)
+            }
+            if len(self.workers) < self.count:
+                logger.error("Workers didn't start")
+                return 1
+
+            logger.info(f"Started {self.count} workers")
+            await self.supervise()
+            return 0
+        finally:
+            await asyncio.gather(
+                *(self.stop(worker) for worker in self.workers.values())
+            )
+            for signal_number in handlers:
+                loop.remove_signal_handler(signal_number)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.WORKERS,
+        help="processes sharing the port, 1 serves from the main process",
+    )
+    # Set by the main process on the workers it starts
+    parser.add_argument("--worker-socket", help=argparse.SUPPRESS)
+
+
+def serve(
+    app: web.Application, module: str, args: argparse.Namespace, **kwargs
+):
+    if args.worker_socket is not None:
+        app["worker_socket"] = args.worker_socket
+        web.run_app(
+            app,
+            host=args.host,
+            port=args.port,
+            path=args.worker_socket,
+            reuse_port=True,
+            shutdown_timeout=config.WORKER_SHUTDOWN_TIMEOUT,
+            **kwargs,
+        )
+    elif args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise SystemExit("Multiple workers need SO_REUSEPORT support")
+        # Workers run the same command line with their own socket
+        socket_dir = tempfile.mkdtemp(prefix="api-workers-")
+        supervisor = Supervisor(
+            [sys.executable, "-m", module, *sys.argv[1:]],
+            args.workers,
+            socket_dir,
+        )
+        loop = asyncio.new_event_loop()
+        try:
+            status = loop.run_until_complete(supervisor.run())
+        finally:
+            loop.close()
+            shutil.rmtree(socket_dir, ignore_errors=True)
+        raise SystemExit(status)
+    else:
+        web.run_app(app, host=args.host, port=args.port, **kwargs)
@@ -0,0 +1,85 @@
+import argparse
+import json
+import timeit
+
+from typing import Any, Callable, Dict, List, Tuple
+
+from api import codec
+from . import payloads
+
+# Compares the JSON codecs on upstream bodies (decode) and responses (encode):
+#
+#     python -m benchmarks.codec
+
+PAYLOADS = {
+    "search recent (100)": lambda: payloads.search_recent_payload(100),
+    "v1 timeline (200)": lambda: payloads.v1_timeline_payload(200),
+    "v2 tweets (100)": lambda: payloads.v2_tweets_payload(list(range(100))),
+    "response (1000)": lambda: payloads.response_payload(1000),
+}
+
+
+def available_codecs() -> List[codec.Codec]:
+    codecs = [codec.STDLIB]
+    for name in codec.NATIVE_CODECS:
+        try:
+            codecs.append(codec.load_codec(name))
+        except ImportError:
+            print(f"{name} is not installed, skipping it")
+    return codecs
+
+
+def best_time(function: Callable[[], Any], number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def run(number: int) -> List[Dict]:
+    # What aiohttp did before the codec layer: decode text, then stdlib parse
+    baseline: Tuple[str, Callable[[Any], bytes], Callable[[bytes], Any]] = (
+        "aiohttp",
+        lambda value: json.dumps(value).encode(),
+        lambda data: json.loads(data.decode("utf-8")),
+    )
+    results = []
+    for payload_name, make_payload in PAYLOADS.items():
+        payload = make_payload()
+        data = codec.STDLIB.dumps(payload)
+        for name, dumps, loads in [baseline] + [
+            (c.name, c.dumps, c.loads) for c in available_codecs()
+        ]:
+            results.append(
+                {
+                    "payload": payload_name,
+                    "bytes": len(data),
+                    "codec": name,
+                    "loads_us": best_time(lambda: loads(data), number) * 1e6,
+                    "dumps_us": best_time(lambda: dumps(payload), number)
+                    * 1e6,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print json")
+    args = parser.parse_args()
+
+    results = run(args.number)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f'{"payload":<22}{"bytes":>9}  {"codec":<9}{"loads µs":>11}{"dumps µs":>11}'
+    )
+    for result in results:
+        print(
+            f'{result["payload"]:<22}{result["bytes"]:>9}  {result["codec"]:<9}'
+            f'{result["loads_us"]:>11.1f}{result["dumps_us"]:>11.1f}'
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import math
+import random
+import time
+import zlib
+
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from aiohttp import web
+
+from api import codec
+from . import payloads
+
+# Local stand-in for the Twitter endpoints used by the api, with configurable
+# latency, errors and rate limits, so benchmarks run without network access:
+#
+#     python -m benchmarks.fake_twitter --port 8081 --latency 50 --errors 0.01
+
+ENDPOINTS = {
+    "search_recent": "/2/tweets/search/recent",
+    "v2_tweets": "/2/tweets",
+    "v1_timeline": "/1.1/statuses/user_timeline.json",
+    "v1_lookup": "/1.1/statuses/lookup.json",
+}
+
+# Tweets of each hashtag or user are numbered from a different offset
+KEY_SPACING = 100000
+
+# Twitter rejects calls looking up more tweets than that
+MAX_IDS = 100
+
+
+class InvalidRequest(Exception):
+    def __init__(self, body: Any):
+        super().__init__()
+        self.body = body
+
+
+class Latency:
+    def __init__(self, median: float, sigma: float = 0.5):
+        # Lognormal around a median in milliseconds, with a long tail like a
+        # real api behind a load balancer
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0
+        return rng.lognormvariate(math.log(self.median), self.sigma) / 1000
+
+
+class RateLimit:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.windows: Dict[Tuple[str, str], Tuple[float, int]] = {}
+
+    def take(self, endpoint: str, authorization: str) -> Tuple[bool, Dict]:
+        now = time.time()
+        reset_at, used = self.windows.get((endpoint, authorization), (0, 0))
+        if now >= reset_at:
+            reset_at, used = now + self.window, 0
+        allowed = used < self.limit
+        if allowed:
+            used += 1
+        self.windows[(endpoint, authorization)] = (reset_at, used)
+        return allowed, {
+            "x-rate-limit-limit": str(self.limit),
+            "x-rate-limit-remaining": str(self.limit - used),
+            "x-rate-limit-reset": str(int(math.ceil(reset_at))),
+        }
+
+
+class FakeTwitter:
+    def __init__(
+        self,
+        latency: Optional[Dict[str, Latency]] = None,
+        error_rate: float = 0,
+        rate_limit: Optional[RateLimit] = None,
+        seed: int = 0,
+    ):
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+
+    async def respond(self, req: web.Request, endpoint: str, build):
+        self.calls[endpoint] += 1
+        latency = self.latency.get(endpoint, self.latency.get("default"))
+        if latency is not None:
+            await asyncio.sleep(latency.sample(self.rng))
+
+        headers: Dict[str, str] = {}
+        if self.rate_limit is not None:
+            allowed, headers = self.rate_limit.take(
+                endpoint, req.headers.get("Authorization", "")
+            )
+            if not allowed:
+                self.errors[endpoint] += 1
+                return codec.json_response(
+                    {"title": "Too Many Requests"}, status=429, headers=headers
+                )
+
+        if self.rng.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            return codec.json_response(
+                {"title": "Service Unavailable"}, status=503, headers=headers
+            )
+
+        try:
+            body = build(req.query)
+        except InvalidRequest as error:
+            self.errors[endpoint] += 1
+            return codec.json_response(error.body, status=400, headers=headers)
+        return codec.json_response(body, headers=headers)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        for endpoint, path in ENDPOINTS.items():
+            app.router.add_get(path, self.handler(endpoint))
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset)
+        return app
+
+    def handler(self, endpoint: str):
+        build = getattr(self, endpoint)
+
+        async def handle(req: web.Request) -> web.Response:
+            return await self.respond(req, endpoint, build)
+
+        return handle
+
+    async def stats(self, req: web.Request) -> web.Response:
+        return codec.json_response(
+            {"calls": dict(self.calls), "errors": dict(self.errors)}
+        )
+
+    async def reset(self, req: web.Request) -> web.Response:
+        # Answers with the stats collected until now
+        res = await self.stats(req)
+        self.calls.clear()
+        self.errors.clear()
+        return res
+
+    @staticmethod
+    def first_index(key: str) -> int:
+        return zlib.crc32(key.lower().encode()) % 1000 * KEY_SPACING
+
+    @staticmethod
+    def index(id: str) -> int:
+        return payloads.FIRST_TWEET_ID - int(id)
+
+    def search_recent(self, query) -> Dict:
+        first = self.first_index(query.get("query", "").lstrip("#"))
+        offset = first
+        if "until_id" in query:
+            offset = max(offset, self.index(query["until_id"]) + 1)
+        if "next_token" in query:
+            offset = int(query["next_token"][len("token") :])
+        count = int(query.get("max_results", 10))
+        return payloads.search_recent_payload(count, offset)
+
+    @staticmethod
+    def ids(query, name: str) -> List[str]:
+        return [id for id in query.get(name, "").split(",") if id]
+
+    def v2_tweets(self, query) -> Dict:
+        ids = self.ids(query, "ids")
+        if len(ids) > MAX_IDS:
+            raise InvalidRequest(
+                {
+                    "errors": [
+                        {
+                            "parameters": {"ids": [query["ids"]]},
+                            "message": "The number of values in the `ids`"
+                            f" query parameter list [{len(ids)}] is not"
+                            f" between 1 and {MAX_IDS}",
+                        }
+                    ],
+                    "title": "Invalid Request",
+                    "detail": "One or more parameters to your request was"
+                    " invalid.",
+                    "type": "https://api.twitter.com/2/problems/"
+                    "invalid-request",
+                }
+            )
+        return payloads.v2_tweets_payload([self.index(id) for id in ids])
+
+    def v1_timeline(self, query) -> Any:
+        offset = self.first_index(query.get("screen_name", ""))
+        if "max_id" in query:
+            offset = max(offset, self.index(query["max_id"]))
+        return payloads.v1_timeline_payload(
+            int(query.get("count", 20)), offset
+        )
+
+    def v1_lookup(self, query) -> Any:
+        ids = self.ids(query, "id")
+        if len(ids) > MAX_IDS:
+            raise InvalidRequest(
+                {
+                    "errors": [
+                        {
+                            "code": 18,
+                            "message": "Too many terms specified in query.",
+                        }
+                    ]
+                }
+            )
+        return [payloads.v1_tweet(self.index(id)) for id in ids]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=50,
+        help="median upstream latency in milliseconds",
+    )
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=0.5,
+        help="lognormal sigma of the upstream latency",
+    )
+    parser.add_argument(
+        "--endpoint-latency",
+        action="append",
+        default=[],
+        metavar="ENDPOINT=MS",
+        help="median latency of one endpoint, e.g. v1_lookup=120",
+    )
+    parser.add_argument(
+        "--errors", type=float, default=0, help="fraction of 503 responses"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="calls per endpoint and token per window, 0 disables it",
+    )
+    parser.add_argument(
+        "--rate-limit-window",
+        type=float,
+        default=900,
+        help="rate limit window in seconds",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_arguments(args: argparse.Namespace) -> FakeTwitter:
+    latency = {"default": Latency(args.latency, args.latency_sigma)}
+    for endpoint_latency in args.endpoint_latency:
+        endpoint, median = endpoint_latency.split("=")
+        if endpoint not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {endpoint}")
+        latency[endpoint] = Latency(float(median), args.latency_sigma)
+
+    return FakeTwitter(
+        latency=latency,
+        error_rate=args.errors,
+        rate_limit=(
+            RateLimit(args.rate_limit, args.rate_limit_window)
+            if args.rate_limit
+            else None
+        ),
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(
+        from_arguments(args).make_app(),
+        host=args.host,
+        port=args.port,
+        access_log=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
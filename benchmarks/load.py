@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+
+from typing import Dict, List, Optional
+import aiohttp
+
+from . import fake_twitter
+
+# Load test of the api against the fake twitter server, both started here as
+# subprocesses, so it runs without network access:
+#
+#     python -m benchmarks.load --concurrency 1,16,64 --output results.json
+#
+# Every route and concurrency level reports req/s, latency percentiles and
+# upstream calls per request. Results of two versions are compared with:
+#
+#     python -m benchmarks.load --compare before.json after.json
+
+ROUTES = {"hashtags": "/hashtags/{key}", "users": "/users/{key}"}
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    if not latencies:
+        return 0
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str):
+    for _ in range(100):
+        try:
+            async with session.get(url) as res:
+                await res.read()
+                return
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.1)
+    raise SystemExit(f"{url} didn't start")
+
+
+async def upstream_calls(session: aiohttp.ClientSession, twitter: str):
+    async with session.post(f"{twitter}/_reset") as res:
+        return (await res.json())["calls"]
+
+
+async def run_level(
+    session: aiohttp.ClientSession,
+    args: argparse.Namespace,
+    route: str,
+    concurrency: int,
+) -> Dict:
+    rng = random.Random(f"{args.seed}-{route}-{concurrency}")
+    keys = [f"{route}{index}" for index in range(args.keys)]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            url = args.api + ROUTES[route].format(key=rng.choice(keys))
+            started = time.perf_counter()
+            try:
+                async with session.get(
+                    url,
+                    params={"limit": str(args.limit)},
+                    headers={
+                        "Authorization": "Bearer benchmark",
+                        **(
+                            {"Accept": "application/x-ndjson"}
+                            if args.stream
+                            else {}
+                        ),
+                    },
+                ) as res:
+                    await res.read()
+                    status = str(res.status)
+            except aiohttp.ClientError as error:
+                status = type(error).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    await upstream_calls(session, args.twitter)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    calls = await upstream_calls(session, args.twitter)
+
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(latencies) - statuses.get("200", 0),
+        "statuses": statuses,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "upstream_calls_per_request": sum(calls.values()) / len(latencies),
+        "upstream_calls": calls,
+    }
+
+
+async def run(args: argparse.Namespace) -> List[Dict]:
+    results = []
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0)
+    ) as session:
+        await wait_until_ready(session, f"{args.twitter}/_stats")
+        await wait_until_ready(session, args.api)
+        for route in args.routes:
+            for concurrency in args.concurrency:
+                result = await run_level(session, args, route, concurrency)
+                print_result(result)
+                results.append(result)
+    return results
+
+
+def print_result(result: Dict):
+    print(
+        f'{result["route"]:<9}{result["concurrency"]:>5}'
+        f'{result["rps"]:>10.1f}{result["p50_ms"]:>9.1f}'
+        f'{result["p95_ms"]:>9.1f}{result["p99_ms"]:>9.1f}'
+        f'{result["upstream_calls_per_request"]:>10.2f}'
+        f'{result["errors"]:>8}',
+        flush=True,
+    )
+
+
+def print_header():
+    print(
+        f'{"route":<9}{"conc":>5}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}'
+        f'{"p99 ms":>9}{"up/req":>10}{"errors":>8}'
+    )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    print(f'{before.get("label")} -> {after.get("label")}')
+    print(
+        f'{"route":<9}{"conc":>5}{"req/s":>10}{"p50":>10}{"p95":>10}'
+        f'{"p99":>10}{"up/req":>10}'
+    )
+    levels = {(r["route"], r["concurrency"]): r for r in before["results"]}
+    for result in after["results"]:
+        previous = levels.get((result["route"], result["concurrency"]))
+        if previous is None:
+            continue
+        changes = [
+            (
+                (result[field] - previous[field]) / previous[field] * 100
+                if previous[field]
+                else 0
+            )
+            for field in [
+                "rps",
+                "p50_ms",
+                "p95_ms",
+                "p99_ms",
+                "upstream_calls_per_request",
+            ]
+        ]
+        print(
+            f'{result["route"]:<9}{result["concurrency"]:>5}'
+            + "".join(f"{change:>+9.1f}%" for change in changes)
+        )
+
+
+def start(module: str, *arguments: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", f"benchmarks.{module}", *arguments],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="json results"
+    )
+    parser.add_argument(
+        "--routes",
+        type=lambda value: value.split(","),
+        default=list(ROUTES),
+        help="comma separated routes",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 16, 64],
+        help="comma separated concurrency levels",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=500, help="requests per level"
+    )
+    parser.add_argument(
+        "--keys",
+        type=int,
+        default=100,
+        help="distinct hashtags or users requested, fewer means more hits",
+    )
+    parser.add_argument("--limit", type=int, default=30)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--label", default=None, help="name of this run")
+    parser.add_argument("--output", default=None, help="json results file")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="api worker processes"
+    )
+    parser.add_argument("--api-port", type=int, default=18080)
+    parser.add_argument("--twitter-port", type=int, default=18081)
+    parser.add_argument(
+        "--api",
+        default=None,
+        help="url of an already running api, it must use the fake twitter",
+    )
+    fake_twitter.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.twitter = f"http://127.0.0.1:{args.twitter_port}"
+    fake_arguments = [
+        "--port",
+        str(args.twitter_port),
+        "--latency",
+        str(args.latency),
+        "--latency-sigma",
+        str(args.latency_sigma),
+        "--errors",
+        str(args.errors),
+        "--rate-limit",
+        str(args.rate_limit),
+        "--rate-limit-window",
+        str(args.rate_limit_window),
+        "--seed",
+        str(args.seed),
+    ]
+    for endpoint_latency in args.endpoint_latency:
+        fake_arguments += ["--endpoint-latency", endpoint_latency]
+    processes = [start("fake_twitter", *fake_arguments)]
+    if args.api is None:
+        args.api = f"http://127.0.0.1:{args.api_port}"
+        processes.append(
+            start(
+                "serve",
+                "--port",
+                str(args.api_port),
+                "--twitter",
+                args.twitter,
+                "--workers",
+                str(args.workers),
+            )
+        )
+
+    try:
+        print_header()
+        results = asyncio.get_event_loop().run_until_complete(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "label": args.label or git_commit(),
+                    "commit": git_commit(),
+                    "settings": {
+                        key: value
+                        for key, value in vars(args).items()
+                        if key != "compare"
+                    },
+                    "results": results,
+                },
+                output,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import json
+import timeit
+import tracemalloc
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from api import codec, config, models
+from . import payloads
+
+# Compares building and serializing 100 tweet pages with api.models against
+# the dict spreading transforms it replaced:
+#
+#     python -m benchmarks.models
+
+
+def legacy_v1_tweet(tweet: Dict) -> Dict:
+    return {
+        **{
+            "hashtags": [
+                f'#{hashtag.get("text")}'
+                for hashtag in tweet.get("retweeted_status", tweet)
+                .get("entities", {})
+                .get("hashtags", [])
+            ]
+        },
+        **{"text": tweet.get("retweeted_status", tweet).get("full_text")},
+    }
+
+
+def legacy_created_at(created_at: Optional[str]) -> Dict:
+    return {
+        "date": (
+            "{0:%I:%M %p - %d %b %Y}".format(
+                datetime.fromisoformat(created_at[:-1] + "+00:00").astimezone(
+                    timezone(
+                        timedelta(minutes=config.TIMEZONE_TIMEDELTA_MINUTES)
+                        * (-1 if config.TIMEZONE_TIMEDELTA_MINUTES < 0 else 1)
+                    )
+                )
+            )
+            if created_at
+            else None
+        )
+    }
+
+
+def legacy_v2_tweet(tweet: Dict, included_users: Dict) -> Dict:
+    user = included_users.get(tweet.get("author_id"), {})
+    public_metrics = tweet.get("public_metrics", {})
+    return {
+        **{
+            "account": {
+                "id": user.get("id"),
+                "fullname": user.get("name"),
+                "href": (
+                    f'/{user.get("username")}'
+                    if user.get("username")
+                    else None
+                ),
+            }
+        },
+        **legacy_created_at(tweet.get("created_at")),
+        **{
+            "likes": public_metrics.get("like_count"),
+            "replies": public_metrics.get("reply_count"),
+            "retweets": public_metrics.get("retweet_count"),
+        },
+    }
+
+
+def legacy_page(search: Dict, lookup: List[Dict]) -> List[Dict]:
+    users = {user["id"]: user for user in search["includes"]["users"]}
+    v2_tweets = {
+        tweet["id"]: legacy_v2_tweet(tweet, users) for tweet in search["data"]
+    }
+    v1_tweets = {tweet["id_str"]: legacy_v1_tweet(tweet) for tweet in lookup}
+    return [{**v2_tweets[id], **v1_tweets[id]} for id in v2_tweets]
+
+
+def models_page(search: Dict, lookup: List[Dict]) -> List[models.Tweet]:
+    # Starts with no formatted dates cached, like a page of new tweets
+    models.format_minute.cache_clear()
+    users = models.included_users(search["includes"])
+    v2_tweets = {
+        tweet["id"]: models.Tweet.from_v2(tweet, users)
+        for tweet in search["data"]
+    }
+    v1_tweets = {
+        tweet["id_str"]: models.Content.from_v1(tweet) for tweet in lookup
+    }
+    return [v2_tweets[id].with_content(v1_tweets[id]) for id in v2_tweets]
+
+
+def allocations(function: Callable[[], object]) -> Dict:
+    # Keeps the result alive so the allocations it retains are counted
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    result = function()
+    stats = tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+    tracemalloc.stop()
+    del result
+    return {
+        "blocks": sum(stat.count_diff for stat in stats),
+        "bytes": sum(stat.size_diff for stat in stats),
+    }
+
+
+def best_time(function: Callable[[], object], number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def run(number: int) -> List[Dict]:
+    search = payloads.search_recent_payload(100)
+    lookup = payloads.v1_timeline_payload(100)
+    assert codec.loads(codec.dumps(models_page(search, lookup))) == (
+        legacy_page(search, lookup)
+    )
+
+    results = []
+    for name, page in [("legacy", legacy_page), ("models", models_page)]:
+        tweets = page(search, lookup)
+        results.append(
+            {
+                "implementation": name,
+                "build_us": best_time(lambda: page(search, lookup), number)
+                * 1e6,
+                "serialize_us": best_time(lambda: codec.dumps(tweets), number)
+                * 1e6,
+                "pages_per_second": 1
+                / best_time(lambda: codec.dumps(page(search, lookup)), number),
+                **allocations(lambda: page(search, lookup)),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print json")
+    args = parser.parse_args()
+
+    results = run(args.number)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"100 tweet pages, {codec.current.name} codec")
+    print(
+        f'{"":<8}{"build µs":>10}{"dumps µs":>10}{"pages/s":>9}'
+        f'{"blocks":>8}{"bytes":>9}'
+    )
+    for result in results:
+        print(
+            f'{result["implementation"]:<8}{result["build_us"]:>10.1f}'
+            f'{result["serialize_us"]:>10.1f}'
+            f'{result["pages_per_second"]:>9.0f}'
+            f'{result["blocks"]:>8}{result["bytes"]:>9}'
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import random
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+# Realistic Twitter API payloads shared by the benchmarks
+
+FIRST_TWEET_ID = 1300000000000000000
+HASHTAGS = ["python", "aiohttp", "asyncio", "opensource", "100DaysOfCode"]
+WORDS = (
+    "just shipped a new release of our async api with faster json and "
+    "better caching thanks everyone who helped test it 🚀 café naïve"
+).split()
+
+
+# Tweets get older by a few seconds each, like results for a busy hashtag
+NEWEST_TWEET_AT = datetime(2020, 9, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def tweet_created_at(index: int) -> datetime:
+    return NEWEST_TWEET_AT - timedelta(seconds=7 * index)
+
+
+def tweet_id(index: int) -> str:
+    return str(FIRST_TWEET_ID - index)
+
+
+def user_id(index: int) -> str:
+    return str(100000 + index % 50)
+
+
+def tweet_text(index: int, hashtags: List[str]) -> str:
+    rng = random.Random(index)
+    words = rng.choices(WORDS, k=rng.randint(8, 30))
+    return " ".join(words + [f"#{hashtag}" for hashtag in hashtags])
+
+
+def tweet_hashtags(index: int) -> List[str]:
+    return random.Random(index).sample(HASHTAGS, k=1 + index % 3)
+
+
+def v2_tweet(index: int) -> Dict:
+    hashtags = tweet_hashtags(index)
+    return {
+        "id": tweet_id(index),
+        "text": tweet_text(index, hashtags)[:280],
+        "author_id": user_id(index),
+        "created_at": tweet_created_at(index).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z"
+        ),
+        "public_metrics": {
+            "retweet_count": index * 7 % 1000,
+            "reply_count": index * 3 % 100,
+            "like_count": index * 13 % 5000,
+            "quote_count": index % 10,
+        },
+        "entities": {
+            "hashtags": [
+                {"start": 0, "end": len(hashtag) + 1, "tag": hashtag}
+                for hashtag in hashtags
+            ],
+        },
+    }
+
+
+def v2_user(index: int) -> Dict:
+    return {
+        "id": user_id(index),
+        "name": f"User {index % 50}",
+        "username": f"user{index % 50}",
+    }
+
+
+def v2_tweets_payload(indexes: List[int]) -> Dict:
+    return {
+        "data": [v2_tweet(index) for index in indexes],
+        "includes": {
+            "users": list({user_id(i): v2_user(i) for i in indexes}.values()),
+        },
+    }
+
+
+def search_recent_payload(count: int = 100, offset: int = 0) -> Dict:
+    payload = v2_tweets_payload(list(range(offset, offset + count)))
+    payload["meta"] = {
+        "newest_id": tweet_id(offset),
+        "oldest_id": tweet_id(offset + count - 1),
+        "result_count": count,
+        "next_token": f"token{offset + count}",
+    }
+    return payload
+
+
+def v1_user(index: int) -> Dict:
+    return {"id": int(user_id(index)), "id_str": user_id(index)}
+
+
+def v1_tweet(index: int) -> Dict:
+    hashtags = tweet_hashtags(index)
+    text = tweet_text(index, hashtags)
+    return {
+        "created_at": tweet_created_at(index).strftime(
+            "%a %b %d %H:%M:%S +0000 %Y"
+        ),
+        "id": int(tweet_id(index)),
+        "id_str": tweet_id(index),
+        "full_text": text,
+        "truncated": False,
+        "display_text_range": [0, len(text)],
+        "entities": {
+            "hashtags": [
+                {"text": hashtag, "indices": [0, len(hashtag) + 1]}
+                for hashtag in hashtags
+            ],
+            "symbols": [],
+            "user_mentions": [],
+            "urls": [],
+        },
+        "source": '<a href="https://mobile.twitter.com">Twitter Web App</a>',
+        "in_reply_to_status_id": None,
+        "in_reply_to_status_id_str": None,
+        "in_reply_to_user_id": None,
+        "in_reply_to_user_id_str": None,
+        "in_reply_to_screen_name": None,
+        "user": v1_user(index),
+        "geo": None,
+        "coordinates": None,
+        "place": None,
+        "contributors": None,
+        "is_quote_status": False,
+        "retweet_count": index * 7 % 1000,
+        "favorite_count": index * 13 % 5000,
+        "favorited": False,
+        "retweeted": False,
+        "lang": "en",
+    }
+
+
+def v1_timeline_payload(count: int = 200, offset: int = 0) -> List[Dict]:
+    return [v1_tweet(index) for index in range(offset, offset + count)]
+
+
+def response_payload(count: int = 30) -> List[Dict]:
+    return [
+        {
+            "account": {
+                "id": user_id(index),
+                "fullname": f"User {index % 50}",
+                "href": f"/user{index % 50}",
+            },
+            "date": "12:00 PM - 01 Sep 2020",
+            "hashtags": [f"#{hashtag}" for hashtag in tweet_hashtags(index)],
+            "likes": index * 13 % 5000,
+            "replies": index * 3 % 100,
+            "retweets": index * 7 % 1000,
+            "text": tweet_text(index, tweet_hashtags(index)),
+        }
+        for index in range(count)
+    ]
@@ -0,0 +1,41 @@
+import argparse
+
+from api import config, server, workers
+from . import fake_twitter
+
+# Runs the api against a fake twitter base url, optionally without client
+# throttling so a single load driver can saturate it:
+#
+#     python -m benchmarks.serve --twitter http://127.0.0.1:8081 --workers 4
+
+
+def point_to(base_url: str):
+    base_url = base_url.rstrip("/")
+    endpoints = fake_twitter.ENDPOINTS
+    config.TWITTER_API_V2_SEARCH_RECENT = base_url + endpoints["search_recent"]
+    config.TWITTER_API_V2_TWEETS = base_url + endpoints["v2_tweets"]
+    config.TWITTER_API_V1_USER_TIMELINE = base_url + endpoints["v1_timeline"]
+    config.TWITTER_API_V1_TWEETS_LOOKUP = base_url + endpoints["v1_lookup"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--twitter", default="http://127.0.0.1:8081")
+    parser.add_argument(
+        "--throttle", action="store_true", help="keep client rate limits"
+    )
+    workers.add_arguments(parser)
+    args = parser.parse_args()
+
+    point_to(args.twitter)
+    app = server.make_app()
+    if not args.throttle:
+        app["bucket_stores"] = {}
+
+    workers.serve(app, "benchmarks.serve", args, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,21 @@
-from . import test_server, test_twitter_api
+from . import (
+    test_server,
+    test_twitter_api,
+    test_upstream,
+    test_cache,
+    test_singleflight,
+    test_throttle,
+    test_breaker,
+    test_budget,
+    test_limiter,
+    test_codec,
+    test_compression,
+    test_deadline,
+    test_hedging,
+    test_models,
+    test_metrics,
+    test_tracing,
+    test_workers,
+    test_store,
+    test_prefetch,
+)
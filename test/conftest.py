@@ -1,5 +1,5 @@
 import pytest
-from api import server, twitter_api
+from api import codec, server, twitter_api, upstream
 
 
 @pytest.fixture
@@ -7,6 +7,16 @@ def client(loop, aiohttp_client):
     return loop.run_until_complete(aiohttp_client(server.make_app()))
 
 
+@pytest.fixture
+def upstream_client(loop):
+    async def make_client():
+        return upstream.Client(upstream.make_session())
+
+    client = loop.run_until_complete(make_client())
+    yield client
+    loop.run_until_complete(client.close())
+
+
 @pytest.fixture
 def twitter_api_error_payload():
     async def get_twitter_api_error_payload(*args, **kwargs):
@@ -23,6 +33,14 @@ def json_payload():
     return get_json_payload
 
 
+@pytest.fixture
+def entries_payload():
+    async def get_entries_payload(*args, **kwargs):
+        return [("1", {"json": "payload"})]
+
+    return get_entries_payload
+
+
 @pytest.fixture
 def sentinel():
     class Sentinel(object):
@@ -35,16 +53,20 @@ def sentinel():
     return Sentinel()
 
 
-def make_async_json_response_mock(json_payload, status=200):
+def make_async_json_response_mock(json_payload, status=200, headers={}):
     class AsyncMock:
+        def __init__(self):
+            self.status = status
+            self.headers = headers
+
         async def __aenter__(self):
             return self
 
         async def __aexit__(self, *error_info):
             return self
 
-        async def json(self):
-            return json_payload
+        async def read(self):
+            return codec.dumps(json_payload)
 
         def get_status(self):
             return status
@@ -0,0 +1,59 @@
+from api import breaker, config
+
+
+def test_breaker(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(breaker, "monotonic", lambda: now[0])
+    monkeypatch.setattr(config, "BREAKER_WINDOW", 4)
+    monkeypatch.setattr(config, "BREAKER_MIN_CALLS", 3)
+    monkeypatch.setattr(config, "BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(config, "BREAKER_OPEN_TIME", 10)
+    monkeypatch.setattr(config, "BREAKER_HALF_OPEN_CALLS", 2)
+    circuit = breaker.Breaker()
+
+    # Too few calls, then failures fall out of the window
+    for failed in [True, False, None, False, False, True, False]:
+        assert circuit.allow() is True
+        circuit.record(failed)
+    assert circuit.current() == breaker.CLOSED
+    assert circuit.failures == 1
+
+    circuit.record(True)
+    assert circuit.current() == breaker.OPEN
+    assert circuit.opens == 1
+
+    now[0] = 4.0
+    assert circuit.allow() is False
+    assert circuit.rejections == 1
+    assert circuit.retry_after() == 6
+    # Calls sent before the breaker opened don't count
+    circuit.record(False)
+    assert circuit.current() == breaker.OPEN
+
+    # A few probes are let through once open time is over
+    now[0] = 10.0
+    assert circuit.current() == breaker.HALF_OPEN
+    assert [circuit.allow() for _ in range(3)] == [True, True, False]
+    circuit.record(None)
+    assert circuit.allow() is True
+    circuit.record(False)
+    assert circuit.current() == breaker.HALF_OPEN
+    # A failed probe opens it again
+    circuit.record(True)
+    assert circuit.current() == breaker.OPEN
+    assert circuit.opens == 2
+
+    now[0] = 20.0
+    assert circuit.allow() is True
+    assert circuit.allow() is True
+    circuit.record(False)
+    circuit.record(False)
+    assert circuit.current() == breaker.CLOSED
+    assert list(circuit.outcomes) == []
+
+
+def test_circuit_open():
+    error = breaker.CircuitOpen("v1_lookup", 2.5)
+    assert str(error) == "Twitter API error: v1_lookup is unavailable"
+    assert error.status == 503
+    assert error.headers == {"Retry-After": "3"}
@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+
+from api import budget, errors
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(budget, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return sleeps
+
+
+def test_budget_tracker_update(now):
+    tracker = budget.BudgetTracker()
+
+    tracker.update("family", "token", {})
+    tracker.update("family", "token", {"x-rate-limit-remaining": "abc"})
+    assert tracker.get("family", "token") is None
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "10", "x-rate-limit-reset": "1060"},
+    )
+    assert tracker.get("family", "token").remaining == 10
+    assert tracker.get("family", "other") is None
+    assert tracker.get("other", "token") is None
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "9", "x-rate-limit-reset": "1060"},
+    )
+    assert tracker.get("family", "token").remaining == 9
+    assert tracker.retry_after("family", "token") == 60
+    assert tracker.retry_after("family", "other") > 0
+
+    now[0] = 1060.0
+    assert tracker.get("family", "token") is None
+
+
+def test_budget_tracker_spare(now):
+    tracker = budget.BudgetTracker()
+    assert tracker.spare("family", "token") == 1
+
+    tracker.update(
+        "family",
+        "token",
+        {
+            "x-rate-limit-limit": "180",
+            "x-rate-limit-remaining": "45",
+            "x-rate-limit-reset": "1060",
+        },
+    )
+    assert tracker.spare("family", "token") == 0.25
+
+    tracker.get("family", "token").remaining = -1
+    assert tracker.spare("family", "token") == 0
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "0", "x-rate-limit-reset": "1060"},
+    )
+    assert tracker.spare("family", "token") == 0
+
+
+async def test_budget_tracker_acquire(now, sleeps):
+    tracker = budget.BudgetTracker(max_wait=10, pacing_threshold=3)
+
+    await tracker.acquire("family", "token")
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "5", "x-rate-limit-reset": "1060"},
+    )
+    await tracker.acquire("family", "token")
+    await tracker.acquire("family", "token")
+    assert tracker.get("family", "token").remaining == 3
+    assert sleeps == []
+
+    await tracker.acquire("family", "token")
+    await tracker.acquire("family", "token")
+    assert sleeps == []
+    assert tracker.get("family", "token").remaining == 1
+    assert tracker.get("family", "token").next_at == 1030
+
+    with pytest.raises(errors.ApiError) as error:
+        await tracker.acquire("family", "token")
+    assert error.value.status == 429
+    assert error.value.headers == {"Retry-After": "30"}
+
+    now[0] = 1025.0
+    await tracker.acquire("family", "token")
+    assert sleeps == [5]
+    assert tracker.get("family", "token").remaining == 0
+
+    with pytest.raises(errors.ApiError) as error:
+        await tracker.acquire("family", "token")
+    assert error.value.headers == {"Retry-After": "35"}
+
+    now[0] = 1052.0
+    await tracker.acquire("family", "token")
+    assert sleeps == [5, 8]
+    assert tracker.get("family", "token").prefetched == 0
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "0", "x-rate-limit-reset": "1900"},
+    )
+    with pytest.raises(errors.ApiError) as error:
+        await tracker.acquire("family", "token")
+    assert error.value.headers == {"Retry-After": "848"}
+
+
+async def test_budget_tracker_prefetched(now):
+    tracker = budget.BudgetTracker()
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "50", "x-rate-limit-reset": "1060"},
+    )
+
+    # Calls of prefetches are counted until the window resets
+    token = budget.prefetching.set(True)
+    try:
+        await tracker.acquire("family", "token")
+        await tracker.acquire("family", "token")
+    finally:
+        budget.prefetching.reset(token)
+    await tracker.acquire("family", "token")
+    assert tracker.get("family", "token").prefetched == 2
+
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "47", "x-rate-limit-reset": "1060"},
+    )
+    assert tracker.get("family", "token").prefetched == 2
+    tracker.update(
+        "family",
+        "token",
+        {"x-rate-limit-remaining": "50", "x-rate-limit-reset": "1120"},
+    )
+    assert tracker.get("family", "token").prefetched == 0
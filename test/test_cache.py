@@ -0,0 +1,313 @@
+import asyncio
+
+from aiohttp import web
+
+from api import cache, config, deadline, store, twitter_api
+
+
+def make_fetch(calls):
+    async def fetch(limit):
+        calls.append(limit)
+        return [{"tweet": index} for index in range(limit)]
+
+    return fetch
+
+
+def test_token_identity():
+    assert cache.token_identity("token") == cache.token_identity("token")
+    assert cache.token_identity("token") != cache.token_identity("other")
+    assert "token" not in cache.token_identity("token")
+
+
+def test_lru_cache(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    lru_cache = cache.LRUCache(max_entries=2)
+
+    lru_cache.put("one", 1)
+    lru_cache.put("two", 2)
+    assert lru_cache.get("one") == 1
+    lru_cache.put("three", 3)
+
+    assert lru_cache.get("two") is None
+    assert lru_cache.get("three") == 3
+    assert (lru_cache.hits, lru_cache.misses, lru_cache.evictions) == (2, 1, 1)
+
+    now[0] = 3600.0
+    assert lru_cache.get("one") == 1
+
+    lru_cache = cache.LRUCache(max_entries=2, ttl=10)
+    lru_cache.put("one", 1)
+    now[0] = 3605.0
+    assert lru_cache.get("one") == 1
+    now[0] = 3610.0
+    assert lru_cache.get("one") is None
+    assert lru_cache.entries == {}
+
+
+def test_cache_entry_covers():
+    entry = cache.CacheEntry(10, [{}] * 10, ttl=1, stale_ttl=1)
+    assert entry.covers(1) is True
+    assert entry.covers(10) is True
+    assert entry.covers(11) is False
+
+    entry = cache.CacheEntry(10, [{}] * 3, ttl=1, stale_ttl=1)
+    assert entry.covers(30) is True
+
+    # Short results left out tweets unless upstream had no more of them
+    value = twitter_api.Partial([{}] * 3)
+    assert cache.CacheEntry(10, value, ttl=1, stale_ttl=1).covers(30) is False
+    value.exhausted = True
+    assert cache.CacheEntry(10, value, ttl=1, stale_ttl=1).covers(30) is True
+
+
+async def test_response_cache_hit_and_miss():
+    calls = []
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+
+    assert await response_cache.get("key", 5, make_fetch(calls)) == [
+        {"tweet": index} for index in range(5)
+    ]
+    assert await response_cache.get("key", 2, make_fetch(calls)) == [
+        {"tweet": 0},
+        {"tweet": 1},
+    ]
+    assert await response_cache.get("key", 5, make_fetch(calls)) == [
+        {"tweet": index} for index in range(5)
+    ]
+    assert calls == [5]
+    assert (response_cache.hits, response_cache.misses) == (2, 1)
+
+    assert len(await response_cache.get("key", 6, make_fetch(calls))) == 6
+    assert await response_cache.get("other", 1, make_fetch(calls)) == [
+        {"tweet": 0}
+    ]
+    assert calls == [5, 6, 1]
+    assert (response_cache.hits, response_cache.misses) == (2, 3)
+
+    await response_cache.close()
+
+
+async def test_response_cache_stale_while_revalidate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    calls = []
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+
+    await response_cache.get("key", 2, make_fetch(calls))
+
+    now[0] = 15.0
+    assert len(await response_cache.get("key", 1, make_fetch(calls))) == 1
+    assert len(await response_cache.get("key", 1, make_fetch(calls))) == 1
+    assert response_cache.stale_hits == 2
+    assert len(response_cache.refreshes) == 1
+
+    await asyncio.sleep(0)
+    assert calls == [2, 2]
+    assert response_cache.refreshes == {}
+    assert len(await response_cache.get("key", 2, make_fetch(calls))) == 2
+    assert response_cache.hits == 1
+
+    now[0] = 50.0
+    await response_cache.get("key", 2, make_fetch(calls))
+    assert calls == [2, 2, 2]
+    assert response_cache.misses == 2
+
+
+async def test_response_cache_refresh_error(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+
+    async def fetch_error(limit):
+        raise Exception("Something went wrong")
+
+    await response_cache.get("key", 1, make_fetch([]))
+
+    now[0] = 15.0
+    assert len(await response_cache.get("key", 1, fetch_error)) == 1
+    await asyncio.sleep(0)
+    assert response_cache.refresh_errors == 1
+    assert response_cache.refreshes == {}
+    assert "key" in response_cache.entries
+
+
+async def test_response_cache_degraded(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+    deadlines = []
+
+    async def fetch_degraded(limit):
+        deadlines.append(deadline.request_deadline.get())
+        entries = twitter_api.Entries([("1", {})])
+        entries.degraded = True
+        return entries
+
+    # Partial results are served but not cached
+    entry = await response_cache.get_entry("key", 1, fetch_degraded)
+    assert cache.degraded(entry.value) is True
+    assert entry.max_age() == 0
+    assert response_cache.entries == {}
+
+    # Nor do they replace a stale entry, refreshed without a deadline
+    await response_cache.get("key", 1, make_fetch([]))
+    now[0] = 15.0
+    token = deadline.request_deadline.set(deadline.Deadline(100))
+    try:
+        await response_cache.get("key", 1, fetch_degraded)
+    finally:
+        deadline.request_deadline.reset(token)
+    await asyncio.sleep(0)
+    assert deadlines[0] is None
+    assert deadlines[1].expires_at is None
+    assert response_cache.entries["key"].fresh_until == 10
+
+
+async def test_response_cache_store(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(store, "time", lambda: now[0])
+    calls = []
+    short_calls = []
+
+    async def fetch(limit):
+        calls.append(limit)
+        return [(str(index), {"tweet": index}) for index in range(limit)]
+
+    async def fetch_short(limit):
+        short_calls.append(limit)
+        value = twitter_api.Partial([("0", {"tweet": 0})])
+        value.exhausted = limit == 5
+        return value
+
+    persistent = store.Store(str(tmp_path / "cache.sqlite"))
+    await persistent.open()
+    first = cache.ResponseCache(ttl=10, stale_ttl=10, store=persistent)
+    assert len(await first.get(("hashtags", "tag"), 2, fetch)) == 2
+    await first.get(("users", "short"), 5, fetch_short)
+    await first.get(("users", "filtered"), 6, fetch_short)
+    await persistent.flush()
+
+    # Whether results were exhausted is kept with them
+    restarted = cache.ResponseCache(ttl=10, stale_ttl=10, store=persistent)
+    await restarted.get(("users", "short"), 10, fetch_short)
+    await restarted.get(("users", "filtered"), 10, fetch_short)
+    assert short_calls == [5, 6, 10]
+
+    # Responses cached before a restart are served with their expiry
+    restarted = cache.ResponseCache(ttl=10, stale_ttl=10, store=persistent)
+    assert await restarted.get(("hashtags", "tag"), 2, fetch) == [
+        ("0", {"tweet": 0}),
+        ("1", {"tweet": 1}),
+    ]
+    assert await restarted.get(("users", "tag"), 1, fetch) == [
+        ("0", {"tweet": 0})
+    ]
+    assert calls == [2, 1]
+    assert (restarted.hits, restarted.misses) == (1, 1)
+
+    now[0] = 1015.0
+    restarted = cache.ResponseCache(ttl=10, stale_ttl=10, store=persistent)
+    assert len(await restarted.get(("hashtags", "tag"), 2, fetch)) == 2
+    assert restarted.stale_hits == 1
+    await asyncio.sleep(0)
+    assert calls == [2, 1, 2]
+
+    await restarted.close()
+    await persistent.close()
+
+
+async def test_response_cache_eviction(monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ITEM_BYTES", 20)
+    calls = []
+    response_cache = cache.ResponseCache(max_entries=2, max_bytes=100)
+
+    await response_cache.get("one", 1, make_fetch(calls))
+    await response_cache.get("two", 1, make_fetch(calls))
+    await response_cache.get("one", 1, make_fetch(calls))
+    await response_cache.get("three", 1, make_fetch(calls))
+
+    assert list(response_cache.entries) == ["one", "three"]
+    assert response_cache.evictions == 1
+
+    await response_cache.get("four", 4, make_fetch(calls))
+    assert list(response_cache.entries) == ["three", "four"]
+    assert response_cache.size == sum(
+        entry.size for entry in response_cache.entries.values()
+    )
+    assert response_cache.size <= 100
+    assert response_cache.evictions == 2
+
+    await response_cache.get("five", 10, make_fetch(calls))
+    assert "five" not in response_cache.entries
+
+
+async def test_response_cache_render(monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ITEM_BYTES", 20)
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10, max_bytes=200)
+    serialized = []
+
+    def serialize(value):
+        serialized.append(len(value))
+        return f"{len(value)}".encode() * 10
+
+    entry = await response_cache.get_entry("key", 3, make_fetch([]))
+    size = entry.size
+    assert size == 3 * config.RESPONSE_CACHE_ITEM_BYTES
+    rendered = response_cache.render("key", entry, 2, serialize)
+    assert rendered.body == b"2" * 10
+    assert response_cache.render("key", entry, 2, serialize) is rendered
+    assert response_cache.render("key", entry, 3, serialize) != rendered
+    assert serialized == [2, 3]
+    assert response_cache.size == entry.size == size + 20
+
+    # Same bytes, same validator
+    assert cache.Rendered(b"body").etag == cache.Rendered(b"body").etag
+    assert cache.Rendered(b"body").etag != cache.Rendered(b"other").etag
+
+    response_cache.add_variant("key", entry, rendered, "gzip", b"z" * 5)
+    assert rendered.variants == {"gzip": b"z" * 5}
+    assert response_cache.size == entry.size == size + 25
+
+    now[0] = 4.0
+    assert entry.max_age() == 6
+    now[0] = 12.0
+    assert entry.max_age() == 0
+
+    # Bodies of uncached entries are not counted, cached ones can evict
+    uncached = cache.CacheEntry(1, [{}], ttl=1, stale_ttl=1)
+    response_cache.render("other", uncached, 1, serialize)
+    assert response_cache.size == size + 25
+    response_cache.render("key", entry, 1, lambda value: b"x" * 200)
+    assert response_cache.entries == {}
+    assert (response_cache.size, response_cache.evictions) == (0, 1)
+
+
+async def test_response_cache_close(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+
+    async def fetch_forever(limit):
+        await asyncio.sleep(3600)
+
+    await response_cache.get("key", 1, make_fetch([]))
+    now[0] = 15.0
+    await response_cache.get("key", 1, fetch_forever)
+    refresh = response_cache.refreshes["key"]
+
+    await response_cache.close()
+    assert refresh.cancelled() is True
+
+
+async def test_response_cache_context():
+    app = web.Application()
+    context = cache.response_cache_context(app)
+
+    await context.__anext__()
+    assert isinstance(app["response_cache"], cache.ResponseCache)
+
+    async for _ in context:
+        pass
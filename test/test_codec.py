@@ -0,0 +1,103 @@
+import json
+import sys
+import types
+import pytest
+
+from api import codec
+
+PAYLOAD = {
+    "id": "1",
+    "text": "café \U0001f40d #python",
+    "hashtags": ["#python"],
+    "likes": 12,
+    "reply": None,
+    "retweeted": False,
+}
+
+
+class Serializable:
+    def as_dict(self):
+        return {"a": 1}
+
+
+def fake_module():
+    def dumps(value, default, option):
+        assert option == "passthrough"
+        return json.dumps(value, default=default).encode()
+
+    return types.SimpleNamespace(
+        dumps=dumps, loads=json.loads, OPT_PASSTHROUGH_DATACLASS="passthrough"
+    )
+
+
+def test_stdlib_codec():
+    data = codec.STDLIB.dumps(PAYLOAD)
+    assert isinstance(data, bytes)
+    assert data == json.dumps(PAYLOAD, separators=(",", ":")).encode()
+    assert codec.STDLIB.loads(data) == PAYLOAD
+    assert codec.STDLIB.loads(data.decode()) == PAYLOAD
+
+
+def test_stdlib_codec_objects():
+    assert codec.STDLIB.dumps([Serializable()]) == b'[{"a":1}]'
+    with pytest.raises(TypeError):
+        codec.STDLIB.dumps(object())
+
+
+def test_load_codec_auto(monkeypatch):
+    monkeypatch.setitem(sys.modules, "orjson", fake_module())
+    assert codec.load_codec("auto").name == "orjson"
+
+    # A missing native codec falls back to the standard library
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    assert codec.load_codec("auto") is codec.STDLIB
+
+
+def test_load_codec_by_name(monkeypatch):
+    assert codec.load_codec("json") is codec.STDLIB
+
+    module = fake_module()
+    monkeypatch.setitem(sys.modules, "orjson", module)
+    loaded = codec.load_codec("orjson")
+    assert loaded.name == "orjson"
+    assert loaded.dumps([Serializable()]) == b'[{"a": 1}]'
+    assert loaded.loads is module.loads
+
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    with pytest.raises(ImportError):
+        codec.load_codec("orjson")
+
+
+@pytest.mark.parametrize("name", codec.NATIVE_CODECS)
+def test_native_codec_matches_stdlib(name):
+    pytest.importorskip(name)
+    native = codec.load_codec(name)
+    data = native.dumps(PAYLOAD)
+    assert isinstance(data, bytes)
+    assert codec.STDLIB.loads(data) == PAYLOAD
+    assert native.loads(codec.STDLIB.dumps(PAYLOAD)) == PAYLOAD
+    assert native.dumps([Serializable()]) == b'[{"a":1}]'
+
+
+def test_current_codec(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        codec,
+        "current",
+        codec.Codec(
+            "fake",
+            lambda value: calls.append(value) or b"[]",
+            lambda data: calls.append(data) or [],
+        ),
+    )
+    assert codec.dumps({"a": 1}) == b"[]"
+    assert codec.loads(b"{}") == []
+    assert calls == [{"a": 1}, b"{}"]
+
+
+def test_json_response():
+    res = codec.json_response(PAYLOAD, status=201, headers={"X-A": "b"})
+    assert res.status == 201
+    assert res.headers["Content-Type"] == "application/json; charset=utf-8"
+    assert res.headers["X-A"] == "b"
+    assert res.body == codec.dumps(PAYLOAD)
@@ -0,0 +1,74 @@
+import gzip
+import sys
+import types
+
+from aiohttp import web
+
+from api import compression, config
+
+
+def fake_module(name):
+    def compress(data, **kwargs):
+        return f"{name}{sorted(kwargs.items())}".encode() + data
+
+    return types.SimpleNamespace(compress=compress)
+
+
+def test_load_encodings(monkeypatch):
+    monkeypatch.setitem(sys.modules, "brotli", fake_module("brotli"))
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+
+    encodings = compression.load_encodings(["br", "zstd", "gzip"])
+    assert list(encodings) == ["br", "gzip"]
+    assert encodings["br"].compress(b"body") == (
+        f"brotli[('quality', {config.COMPRESSION_LEVELS['br']})]body".encode()
+    )
+    assert gzip.decompress(encodings["gzip"].compress(b"body")) == b"body"
+    # Equal bodies compress to equal bytes
+    assert encodings["gzip"].compress(b"body") == gzip.compress(
+        b"body", compresslevel=config.COMPRESSION_LEVELS["gzip"], mtime=0
+    )
+
+    monkeypatch.setitem(sys.modules, "zstandard", fake_module("zstd"))
+    encodings = compression.load_encodings(["zstd"])
+    assert encodings["zstd"].compress(b"body") == (
+        f"zstd[('level', {config.COMPRESSION_LEVELS['zstd']})]body".encode()
+    )
+
+
+def test_negotiate():
+    names = ["br", "zstd", "gzip"]
+    assert compression.negotiate("", names) is None
+    assert compression.negotiate("identity", names) is None
+    assert compression.negotiate("gzip, deflate", names) == "gzip"
+    assert compression.negotiate("gzip, deflate, br", names) == "br"
+    assert compression.negotiate("GZIP;q=0.9, zstd;q=0.5", names) == "gzip"
+    assert compression.negotiate("br;q=0, gzip", names) == "gzip"
+    assert compression.negotiate("*", names) == "br"
+    assert compression.negotiate("*;q=0.5, br;q=0", names) == "zstd"
+    assert compression.negotiate("gzip;q=abc, br;level=1", names) == "br"
+    assert compression.negotiate("gzip", ["br"]) is None
+
+
+async def test_compressor(monkeypatch):
+    monkeypatch.setattr(config, "COMPRESSION_MIN_SIZE", 10)
+    compressor = compression.Compressor(compression.load_encodings(["gzip"]))
+
+    assert compressor.choose("gzip", 9) is None
+    assert compressor.choose("gzip", 10) == "gzip"
+    assert compressor.choose("br", 10) is None
+
+    body = b"tweet " * 100
+    assert gzip.decompress(await compressor.compress("gzip", body)) == body
+    assert compressor.compressions == {"gzip": 1}
+    compressor.close()
+
+
+async def test_compression_context():
+    app = web.Application()
+    context = compression.compression_context(app)
+    await context.__anext__()
+    assert "gzip" in app["compressor"].encodings
+    async for _ in context:
+        pass
+    assert app["compressor"].executor._shutdown
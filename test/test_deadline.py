@@ -0,0 +1,75 @@
+import asyncio
+import math
+import pytest
+
+from time import monotonic
+
+from api import config, deadline
+
+
+async def work(seconds, result="done"):
+    await asyncio.sleep(seconds)
+    return result
+
+
+async def test_within():
+    # Work is not bounded outside of requests, nor in background refreshes
+    assert await deadline.within(work(0)) == "done"
+    token = deadline.request_deadline.set(deadline.Deadline(None))
+    try:
+        assert deadline.request_deadline.get().remaining() == math.inf
+        assert await deadline.within(work(0)) == "done"
+    finally:
+        deadline.request_deadline.reset(token)
+
+    token = deadline.request_deadline.set(deadline.Deadline(monotonic() + 1))
+    try:
+        assert await deadline.within(work(0)) == "done"
+
+        async def timing_out():
+            raise asyncio.TimeoutError()
+
+        # Timeouts of the work itself are not deadline errors
+        with pytest.raises(asyncio.TimeoutError) as error:
+            await deadline.within(timing_out())
+        assert not isinstance(error.value, deadline.DeadlineExceeded)
+
+        deadline.request_deadline.get().expires_at = monotonic() + 0.01
+        with pytest.raises(deadline.DeadlineExceeded) as error:
+            await deadline.within(work(1))
+        assert error.value.status == 504
+
+        # Past the deadline work is not started
+        with pytest.raises(deadline.DeadlineExceeded):
+            await deadline.within(work(0))
+    finally:
+        deadline.request_deadline.reset(token)
+
+
+async def test_degrade():
+    deadline.degrade()
+    assert deadline.degraded() is False
+
+    token = deadline.request_deadline.set(deadline.Deadline(monotonic() + 1))
+    try:
+        assert deadline.degraded() is False
+        deadline.degrade()
+        assert deadline.degraded() is True
+    finally:
+        deadline.request_deadline.reset(token)
+
+
+@pytest.mark.parametrize("value", ["abc", "0", "-1", "nan", "31"])
+async def test_deadline_middleware_invalid(value, client):
+    res = await client.get("/health", headers={"X-Request-Timeout": value})
+    assert res.status == 400
+    assert await res.json() == {
+        "error": "Invalid X-Request-Timeout header: must be a number of"
+        + f" seconds up to {config.REQUEST_MAX_TIMEOUT}"
+    }
+
+
+async def test_deadline_middleware(client):
+    res = await client.get("/health", headers={"X-Request-Timeout": "0.5"})
+    assert res.status == 200
+    assert res.headers.get("X-Degraded") is None
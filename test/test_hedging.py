@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from api import config, hedging
+
+
+def test_latency_window(monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_DELAY", 0.01)
+    window = hedging.LatencyWindow(size=40, quantile=0.9)
+
+    for latency in [0.1, 0.2, 0.3, 0.4]:
+        window.observe(latency)
+    assert window.delay() is None
+
+    window.observe(0.5)
+    assert window.delay() == 0.4
+
+    # Sorted again every tenth of the window
+    for _ in range(2):
+        window.observe(1.0)
+        assert window.delay() == 0.4
+    window.observe(1.0)
+    assert window.delay() == 1.0
+
+    window = hedging.LatencyWindow(size=10, quantile=0.5)
+    for _ in range(10):
+        window.observe(0.001)
+    assert window.delay() == 0.01
+
+
+def make_call(calls, latencies, error=None):
+    async def call():
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(latencies[index])
+        if error is not None and index in error:
+            raise ValueError(f"call {index} failed")
+        return index
+
+    return call
+
+
+def make_hedger(budget=1.0, delay=0.01):
+    hedger = hedging.Hedger(budget)
+    window = hedger.windows["family"] = hedging.LatencyWindow()
+    window.samples.extend([delay] * config.UPSTREAM_HEDGE_MIN_SAMPLES)
+    return hedger
+
+
+async def test_hedger_run(monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_DELAY", 0)
+    hedger = make_hedger()
+
+    # Calls answering before the delay are not hedged
+    calls = []
+    assert await hedger.run("family", make_call(calls, [0]), lambda: True) == 0
+    assert (calls, hedger.hedges) == ([0], 0)
+
+    # Slow calls are hedged and the first answer wins
+    calls = []
+    call = make_call(calls, [1, 0])
+    assert await hedger.run("family", call, lambda: True) == 1
+    assert (calls, hedger.hedges, hedger.wins) == ([0, 1], 1, 1)
+
+    calls = []
+    call = make_call(calls, [0.05, 1])
+    assert await hedger.run("family", call, lambda: True) == 0
+    assert (hedger.hedges, hedger.wins) == (2, 1)
+
+    # Unknown endpoints and refused hedges wait for the only call
+    calls = []
+    call = make_call(calls, [0.05])
+    assert await hedger.run("other", call, lambda: True) == 0
+    calls = []
+    call = make_call(calls, [0.05])
+    assert await hedger.run("family", call, lambda: False) == 0
+    assert hedger.hedges == 2
+
+
+async def test_hedger_budget(monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_DELAY", 0)
+    hedger = make_hedger(budget=0.5)
+    calls = []
+    call = make_call(calls, [0.05] * 4)
+
+    # Every call earns half a hedge
+    await hedger.run("family", call, lambda: True)
+    assert hedger.hedges == 0
+    await hedger.run("family", call, lambda: True)
+    assert (len(calls), hedger.hedges, hedger.tokens) == (3, 1, 0)
+
+    hedger.tokens = config.UPSTREAM_HEDGE_MAX_TOKENS
+    await hedger.run("family", make_call([], [0]), lambda: True)
+    assert hedger.tokens == config.UPSTREAM_HEDGE_MAX_TOKENS
+
+    # No budget, no hedges
+    hedger = make_hedger(budget=0)
+    await hedger.run("family", make_call([], [0.05]), lambda: True)
+    assert hedger.hedges == 0
+
+
+async def test_hedger_errors(monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_DELAY", 0)
+    hedger = make_hedger()
+
+    # A failed call waits for the other one
+    calls = []
+    call = make_call(calls, [0.02, 0.05], error={0})
+    assert await hedger.run("family", call, lambda: True) == 1
+
+    calls = []
+    call = make_call(calls, [0.05, 0.02], error={0, 1})
+    with pytest.raises(ValueError) as error:
+        await hedger.run("family", call, lambda: True)
+    assert str(error.value) == "call 1 failed"
+
+    # Cancelled runs cancel their calls
+    cancelled = []
+
+    async def call_forever():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    run = asyncio.ensure_future(
+        hedger.run("family", call_forever, lambda: True)
+    )
+    await asyncio.sleep(0.05)
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    await asyncio.sleep(0)
+    assert cancelled == [True, True]
@@ -0,0 +1,73 @@
+import asyncio
+
+from api import limiter
+
+
+async def test_limiter():
+    concurrency_limiter = limiter.Limiter(2)
+    release = asyncio.Event()
+    active = []
+
+    async def work():
+        async with concurrency_limiter:
+            active.append(concurrency_limiter.active)
+            await release.wait()
+
+    workers = [asyncio.ensure_future(work()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    assert concurrency_limiter.active == 2
+    assert concurrency_limiter.waiting == 1
+
+    release.set()
+    await asyncio.gather(*workers)
+
+    assert active[:2] == [1, 2]
+    assert concurrency_limiter.active == 0
+    assert concurrency_limiter.waiting == 0
+    assert concurrency_limiter.waited == 1
+    assert concurrency_limiter.wait_time >= 0
+
+
+async def test_limiter_cancelled_waiter():
+    concurrency_limiter = limiter.Limiter(1)
+    release = asyncio.Event()
+
+    async def work():
+        async with concurrency_limiter:
+            await release.wait()
+
+    worker = asyncio.ensure_future(work())
+    waiter = asyncio.ensure_future(work())
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    await worker
+
+    assert waiter.cancelled() is True
+    assert concurrency_limiter.waiting == 0
+    assert concurrency_limiter.active == 0
+    assert concurrency_limiter.semaphore.locked() is False
+
+
+async def test_gather():
+    running = []
+    peak = []
+
+    async def work(value):
+        running.append(value)
+        peak.append(len(running))
+        await asyncio.sleep(0)
+        running.remove(value)
+        return value
+
+    assert await limiter.gather(2, (work(value) for value in range(5))) == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+    assert max(peak) == 2
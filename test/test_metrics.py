@@ -0,0 +1,205 @@
+import asyncio
+
+from aiohttp import web
+
+from api import config, metrics, server, twitter_api
+
+
+def test_histogram():
+    histogram = metrics.Histogram([1, 2, 4])
+    for value in [0, 1, 1.5, 2, 3, 5, 100]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 1, 2]
+    assert histogram.sum == 112.5
+
+
+def test_histogram_family():
+    family = metrics.HistogramFamily(["route", "status"], [1])
+    family.observe("/a", 200, 0.5)
+    family.observe("/a", 200, 2)
+    family.observe("/a", 500, 0.5)
+    family.observe("/b", 200, 0.5)
+    assert [
+        (labels, histogram.counts) for labels, histogram in family.items()
+    ] == [
+        ({"route": "/a", "status": 200}, [1, 1]),
+        ({"route": "/a", "status": 500}, [1, 0]),
+        ({"route": "/b", "status": 200}, [1, 0]),
+    ]
+
+
+async def test_count_upstream_call():
+    async def call():
+        metrics.count_upstream_call()
+
+    metrics.count_upstream_call()
+
+    fan_out = metrics.FanOut()
+    token = metrics.request_fan_out.set(fan_out)
+    metrics.count_upstream_call()
+    # Tasks started by the request count towards it as well
+    await asyncio.ensure_future(call())
+    metrics.request_fan_out.reset(token)
+    metrics.count_upstream_call()
+
+    assert fan_out.calls == 2
+
+
+def test_format_labels():
+    assert metrics.format_labels({}) == ""
+    assert (
+        metrics.format_labels({"a": 1, "b": 'q"\\\n'})
+        == '{a="1",b="q\\"\\\\\\n"}'
+    )
+
+
+def test_exposition():
+    histogram = metrics.Histogram([1, 2])
+    histogram.observe(0.5)
+    histogram.observe(3)
+    exposition = metrics.Exposition()
+    exposition.metric("gauge_name", "gauge", "A gauge", [({}, 3)])
+    exposition.histogram("latency", "A histogram", [({"a": "b"}, histogram)])
+    assert exposition.text() == (
+        "# HELP gauge_name A gauge\n"
+        "# TYPE gauge_name gauge\n"
+        "gauge_name 3\n"
+        "# HELP latency A histogram\n"
+        "# TYPE latency histogram\n"
+        'latency_bucket{a="b",le="1"} 1\n'
+        'latency_bucket{a="b",le="2"} 1\n'
+        'latency_bucket{a="b",le="+Inf"} 2\n'
+        'latency_sum{a="b"} 3.5\n'
+        'latency_count{a="b"} 2\n'
+    )
+
+
+def parse_samples(text):
+    return dict(
+        line.rsplit(" ", 1)
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    )
+
+
+async def test_metrics_view(client, monkeypatch):
+    async def search_hashtag_entries_mock(client, *args, **kwargs):
+        metrics.count_upstream_call()
+        metrics.count_upstream_call()
+        return []
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", search_hashtag_entries_mock
+    )
+    monkeypatch.setattr(
+        twitter_api,
+        "get_user_tweet_entries",
+        lambda *args, **kwargs: asyncio.sleep(0, []),
+    )
+
+    assert (await client.get("/hashtags/python")).status == 200
+    assert (await client.get("/hashtags/python?limit=0")).status == 400
+    assert (await client.get("/nowhere")).status == 404
+
+    res = await client.get("/metrics")
+    assert res.status == 200
+    assert res.headers["Content-Type"] == (
+        "text/plain; version=0.0.4; charset=utf-8"
+    )
+    samples = parse_samples(await res.text())
+
+    assert (
+        samples[
+            'api_request_duration_seconds_count{route="/hashtags/{tag}",'
+            'status="200"}'
+        ]
+        == "1"
+    )
+    assert (
+        samples[
+            'api_request_duration_seconds_count{route="/hashtags/{tag}",'
+            'status="400"}'
+        ]
+        == "1"
+    )
+    assert (
+        samples[
+            'api_request_duration_seconds_count{route="unmatched",'
+            'status="404"}'
+        ]
+        == "1"
+    )
+    assert samples["api_requests_in_flight"] == "1"
+    assert samples['api_request_upstream_calls_bucket{le="0"}'] == "2"
+    assert samples['api_request_upstream_calls_bucket{le="2"}'] == "3"
+    assert samples["api_request_upstream_calls_count"] == "3"
+    assert samples['api_response_cache_lookups_total{result="miss"}'] == "1"
+    assert samples["api_response_cache_entries"] == "1"
+    assert samples['api_tweet_cache_entries{cache="content"}'] == "0"
+    assert (
+        samples['api_tweet_cache_lookups_total{cache="metrics",result="hit"}']
+        == "0"
+    )
+    assert samples['api_throttle_clients{route="/hashtags/{tag}"}'] == "1"
+    assert samples["api_upstream_in_flight"] == "0"
+    assert samples["api_hot_keys"] == "1"
+    assert samples["api_upstream_hedges_total"] == "0"
+    assert (
+        samples[
+            'api_upstream_breaker_state{endpoint="v1_lookup",state="closed"}'
+        ]
+        == "1"
+    )
+    assert (
+        samples[
+            'api_upstream_breaker_state{endpoint="v1_lookup",state="open"}'
+        ]
+        == "0"
+    )
+    assert samples[
+        'api_upstream_breaker_opens_total{endpoint="v2_tweets"}'
+    ] == ("0")
+    assert samples['api_response_compressions_total{encoding="gzip"}'] == "0"
+    assert samples["api_prefetches_total"] == "0"
+
+
+async def test_metrics_view_store(aiohttp_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        config, "PERSISTENT_CACHE_PATH", str(tmp_path / "cache.sqlite")
+    )
+    client = await aiohttp_client(server.make_app())
+    await client.app["store"].get_many(["key"])
+
+    samples = parse_samples(await (await client.get("/metrics")).text())
+    assert samples['api_store_lookups_total{result="miss"}'] == "1"
+    assert samples["api_store_writes_total"] == "0"
+    assert samples["api_store_evictions_total"] == "0"
+
+
+async def test_metrics_middleware_errors(aiohttp_client):
+    async def fail(req):
+        raise RuntimeError("boom")
+
+    app = web.Application(middlewares=[metrics.metrics_middleware])
+    app["metrics"] = metrics.ServerMetrics()
+    app.router.add_get("/fail", fail)
+    client = await aiohttp_client(app)
+
+    assert (await client.get("/fail")).status == 500
+    assert list(app["metrics"].requests.series["/fail"]) == [500]
+    assert app["metrics"].in_flight == 0
+
+
+def test_merge():
+    assert metrics.merge(
+        {
+            "0": '# HELP a A\n# TYPE a gauge\na 1\n# TYPE b gauge\nb{x="y"} 2\n',
+            "1": '# HELP a A\n# TYPE a gauge\na 3\n# TYPE b gauge\nb{x="z"} 4\n',
+        },
+        "worker",
+    ) == (
+        "# HELP a A\n# TYPE a gauge\n"
+        'a{worker="0"} 1\na{worker="1"} 3\n'
+        "# TYPE b gauge\n"
+        'b{worker="0",x="y"} 2\nb{worker="1",x="z"} 4\n'
+    )
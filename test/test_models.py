@@ -0,0 +1,153 @@
+from api import codec, models
+
+EMPTY_TWEET = {
+    "account": {"id": None, "fullname": None, "href": None},
+    "date": None,
+    "likes": None,
+    "replies": None,
+    "retweets": None,
+    "hashtags": [],
+    "text": None,
+}
+
+
+def test_format_date():
+    assert models.format_date(None) is None
+    assert models.format_date("") is None
+    assert (
+        models.format_date("2011-10-05T14:48:00.000Z")
+        == "11:48 PM - 05 Oct 2011"
+    )
+
+
+def test_format_v1_date():
+    assert models.format_v1_date(None) is None
+    assert (
+        models.format_v1_date("Wed Oct 05 14:48:00 +0000 2011")
+        == "11:48 PM - 05 Oct 2011"
+    )
+
+
+def test_included_users():
+    assert models.included_users({}) == {}
+    assert models.included_users(
+        {"users": [{"id": "one"}, {"id": "two"}]}
+    ) == {"one": {"id": "one"}, "two": {"id": "two"}}
+
+
+def test_account_from_v2():
+    assert models.Account.from_v2({}).as_dict() == {
+        "id": None,
+        "fullname": None,
+        "href": None,
+    }
+    assert models.Account.from_v2(
+        {"id": "1234", "name": "Bob", "username": "bob"}
+    ).as_dict() == {"id": "1234", "fullname": "Bob", "href": "/bob"}
+
+
+def test_content_from_v1():
+    assert models.Content.from_v1({}).as_dict() == {
+        "hashtags": [],
+        "text": None,
+    }
+    assert models.Content.from_v1(
+        {"retweeted_status": {}, "entities": {}}
+    ) == models.Content([], None)
+    assert (
+        models.Content.from_v1(
+            {
+                "retweeted_status": {
+                    "entities": {
+                        "hashtags": [{"text": "one"}, {"text": "two"}]
+                    }
+                },
+                "entities": {"hashtags": []},
+            }
+        )
+        == models.Content(["#one", "#two"], None)
+    )
+    assert models.Content.from_v1(
+        {"entities": {"hashtags": [{"text": "one"}, {"text": "two"}]}}
+    ) == models.Content(["#one", "#two"], None)
+    assert models.Content.from_v1(
+        {"retweeted_status": {"full_text": "A tweet"}, "full_text": ""}
+    ) == models.Content([], "A tweet")
+    assert models.Content.from_v1({"full_text": ""}) == models.Content([], "")
+    assert models.Content.from_v1({"full_text": "A tweet"}) == models.Content(
+        [], "A tweet"
+    )
+
+
+def test_tweet_from_v2():
+    assert models.Tweet.from_v2({}, {}).as_dict() == EMPTY_TWEET
+    assert (
+        models.Tweet.from_v2({"author_id": "1234"}, {"1234": {}}).as_dict()
+        == EMPTY_TWEET
+    )
+    assert models.Tweet.from_v2(
+        {
+            "author_id": "1234",
+            "created_at": "2011-10-05T14:48:00.000Z",
+            "public_metrics": {
+                "like_count": 1,
+                "reply_count": 2,
+                "retweet_count": 3,
+            },
+        },
+        {"1234": {"id": "1234", "name": "Bob", "username": "bob"}},
+    ).as_dict() == {
+        "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
+        "date": "11:48 PM - 05 Oct 2011",
+        "likes": 1,
+        "replies": 2,
+        "retweets": 3,
+        "hashtags": [],
+        "text": None,
+    }
+
+
+def test_tweet_from_v1():
+    account = models.Account("1234", None, "/bob")
+    assert models.Tweet.from_v1({}, account).as_dict() == {
+        **EMPTY_TWEET,
+        "account": account.as_dict(),
+    }
+    assert (
+        models.Tweet.from_v1(
+            {"created_at": "Wed Oct 05 14:48:00 +0000 2011", "id": 1}, account
+        ).date
+        == "11:48 PM - 05 Oct 2011"
+    )
+
+
+def test_tweet_with_content():
+    tweet = models.Tweet.from_v2({"public_metrics": {"like_count": 1}}, {})
+    merged = tweet.with_content(models.Content(["#one"], "A tweet"))
+    assert merged is not tweet
+    assert tweet.text is None
+    assert merged.as_dict() == {
+        **EMPTY_TWEET,
+        "likes": 1,
+        "hashtags": ["#one"],
+        "text": "A tweet",
+    }
+
+
+def test_tweet_serialization():
+    tweet = models.Tweet(
+        models.Account("1", "Bob", "/bob"),
+        "11:48 PM - 05 Oct 2011",
+        1,
+        2,
+        3,
+        ["#one"],
+        "A tweet",
+    )
+    assert codec.loads(codec.dumps([tweet])) == [tweet.as_dict()]
+    assert codec.STDLIB.dumps(tweet) == codec.STDLIB.dumps(tweet.as_dict())
+    # Built once, later dumps reuse it
+    assert tweet.as_dict() is tweet.as_dict()
+    assert tweet == models.Tweet(
+        tweet.account, tweet.date, 1, 2, 3, ["#one"], "A tweet"
+    )
@@ -0,0 +1,151 @@
+import asyncio
+
+from aiohttp import web
+
+from api import cache, config, prefetch, upstream
+
+
+def test_count_min_sketch():
+    sketch = prefetch.CountMinSketch(width=64, depth=4)
+    for _ in range(10):
+        sketch.add("hot")
+    assert sketch.add("hot") == 11
+    # Estimates never fall below the real count
+    assert sketch.add("cold") >= 1
+
+    sketch.decay()
+    assert sketch.add("hot") == 6
+
+
+def test_hot_keys():
+    hot_keys = prefetch.HotKeys(size=2, width=1024, depth=4)
+
+    def record(key, times):
+        for _ in range(times):
+            hot_keys.record(key, None, f"token {key}", [])
+
+    record("a", 3)
+    record("b", 1)
+    record("c", 1)
+    assert hot_keys.hottest() == ["a", "b"]
+
+    # Keys more requested than the coldest one replace it
+    record("c", 2)
+    assert hot_keys.hottest() == ["a", "c"]
+    assert hot_keys.top["c"].count == 3
+    assert hot_keys.top["c"].authorization == "token c"
+    record("d", 1)
+    assert hot_keys.hottest() == ["a", "c"]
+
+    hot_keys.decay()
+    assert [hot_keys.top[key].count for key in ["a", "c"]] == [1, 1]
+    assert hot_keys.floor == 0
+
+
+async def test_prefetcher(upstream_client, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    monkeypatch.setattr(prefetch, "monotonic", lambda: now[0])
+    monkeypatch.setattr(config, "PREFETCH_MIN_REQUESTS", 2)
+    monkeypatch.setattr(config, "PREFETCH_AHEAD", 3)
+    monkeypatch.setattr(config, "UPSTREAM_MAX_CONCURRENCY", 10)
+    monkeypatch.setattr(config, "PREFETCH_UPSTREAM_FRACTION", 0.2)
+    monkeypatch.setattr(config, "HOT_KEYS_DECAY_INTERVAL", 60)
+
+    calls = []
+
+    def make_fetch(key):
+        async def fetch(limit):
+            calls.append((key, limit))
+            await upstream_client.budgets.acquire(
+                upstream.V1_LOOKUP, f"token {key}"
+            )
+            return [key] * limit
+
+        return fetch
+
+    response_cache = cache.ResponseCache(ttl=10, stale_ttl=10)
+    hot_keys = prefetch.HotKeys()
+    prefetcher = prefetch.Prefetcher(hot_keys, response_cache, upstream_client)
+    assert prefetcher.max_active == 2
+
+    families = prefetch.ROUTE_FAMILIES["hashtags"]
+    for key in ["a", "b", "c", "d", "cold"]:
+        await response_cache.get(key, 2, make_fetch(key))
+        hot_keys.record(key, make_fetch(key), f"token {key}", families)
+        if key != "cold":
+            hot_keys.record(key, make_fetch(key), f"token {key}", families)
+    calls.clear()
+
+    def set_budget(family, key, prefetched):
+        upstream_client.budgets.update(
+            family,
+            f"token {key}",
+            {
+                "x-rate-limit-limit": "100",
+                "x-rate-limit-remaining": "50",
+                "x-rate-limit-reset": "9999999999",
+            },
+        )
+        window = upstream_client.budgets.get(family, f"token {key}")
+        window.prefetched = prefetched
+
+    # Not close enough to going stale
+    now[0] = 6.0
+    prefetcher.prefetch()
+    assert prefetcher.active == {}
+
+    # Prefetches spend at most a fraction of the rate limit windows of the
+    # endpoints their route calls
+    set_budget(upstream.V1_LOOKUP, "a", 20)
+    set_budget(upstream.V1_TIMELINE, "b", 20)
+    set_budget(upstream.V1_LOOKUP, "b", 19)
+    now[0] = 7.0
+    prefetcher.prefetch()
+    assert sorted(prefetcher.active) == ["b", "c"]
+    assert (prefetcher.prefetches, prefetcher.skipped) == (2, 1)
+
+    await asyncio.gather(*prefetcher.active.values())
+    assert sorted(calls) == [("b", 2), ("c", 2)]
+    assert response_cache.entries["b"].fresh_until == 17
+    # Their calls are counted, unlike those of client requests
+    lookups = upstream_client.budgets.get(upstream.V1_LOOKUP, "token b")
+    assert lookups.prefetched == 20
+    await make_fetch("b")(1)
+    assert lookups.prefetched == 20
+    assert not prefetcher.has_budget(hot_keys.top["b"])
+
+    prefetcher.prefetch()
+    assert sorted(prefetcher.active) == ["d"]
+    await asyncio.gather(*prefetcher.active.values())
+
+    # Stale entries are refreshed by client requests
+    now[0] = 30.0
+    prefetcher.prefetch()
+    assert prefetcher.active == {}
+
+    now[0] = 61.0
+    prefetcher.prefetch()
+    assert hot_keys.top["a"].count == 1
+
+    await response_cache.close()
+
+
+async def test_prefetcher_run(monkeypatch):
+    monkeypatch.setattr(config, "PREFETCH_INTERVAL", 0)
+    app = web.Application()
+    app["response_cache"] = cache.ResponseCache()
+    app["upstream"] = None
+    context = prefetch.prefetch_context(app)
+    await context.__anext__()
+
+    prefetches = []
+    monkeypatch.setattr(
+        app["prefetcher"], "prefetch", lambda: prefetches.append(None)
+    )
+    while len(prefetches) < 2:
+        await asyncio.sleep(0)
+
+    async for _ in context:
+        pass
+    assert app["prefetcher"].task.cancelled()
@@ -1,8 +1,11 @@
+import asyncio
+
 import pytest
 
-from api import twitter_api, server, config
+from api import twitter_api, server, codec, config, deadline, tracing
 
 UJSON_CONTENT_TYPE = "application/json; charset=utf-8"
+NDJSON_CONTENT_TYPE = "application/x-ndjson; charset=utf-8"
 
 
 def test_int_parameter_in_range():
@@ -25,8 +28,8 @@ def test_int_parameter_in_range():
 @pytest.mark.parametrize(
     "api_method,url",
     [
-        ("search_hashtag", "/hashtags/twitter"),
-        ("get_user_tweets", "/users/twitter"),
+        ("search_hashtag_entries", "/hashtags/twitter"),
+        ("get_user_tweet_entries", "/users/twitter"),
     ],
 )
 async def test_error_middleware(
@@ -44,21 +47,27 @@ async def test_error_middleware(
     "api_method,url,max_param",
     [
         (
-            "search_hashtag",
+            "search_hashtag_entries",
             "/hashtags/twitter",
             config.MAX_HASHTAG_SEARCH_RESULTS,
         ),
         (
-            "get_user_tweets",
+            "get_user_tweet_entries",
             "/users/twitter",
-            config.MAX_HASHTAG_SEARCH_RESULTS,
+            config.MAX_USER_TWEET_RESULTS,
         ),
     ],
 )
 async def test_view_success(
-    api_method, url, max_param, client, json_payload, monkeypatch
+    api_method,
+    url,
+    max_param,
+    client,
+    entries_payload,
+    json_payload,
+    monkeypatch,
 ):
-    monkeypatch.setattr(twitter_api, api_method, json_payload)
+    monkeypatch.setattr(twitter_api, api_method, entries_payload)
     res = await client.get(url)
 
     assert res.status == 200
@@ -82,14 +91,14 @@ async def test_view_success(
     "api_method,url,max_param",
     [
         (
-            "search_hashtag",
+            "search_hashtag_entries",
             "/hashtags/twitter",
             config.MAX_HASHTAG_SEARCH_RESULTS,
         ),
         (
-            "get_user_tweets",
+            "get_user_tweet_entries",
             "/users/twitter",
-            config.MAX_HASHTAG_SEARCH_RESULTS,
+            config.MAX_USER_TWEET_RESULTS,
         ),
     ],
 )
@@ -127,3 +136,487 @@ async def test_view_error(
         "error": "Invalid limit parameter: must be a number between 1"
         + f" and {max_param}"
     }
+
+
+@pytest.mark.parametrize(
+    "api_method,url",
+    [
+        ("search_hashtag_entries", "/hashtags/twitter"),
+        ("get_user_tweet_entries", "/users/twitter"),
+    ],
+)
+async def test_view_cache(api_method, url, client, monkeypatch):
+    calls = []
+
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        assert isinstance(trace, tracing.Trace)
+        calls.append((authorization, name, limit, cursor))
+        return [("1", {"json": "payload"})] * limit
+
+    monkeypatch.setattr(twitter_api, api_method, get_entries_payload)
+
+    res = await client.get(f"{url}?limit=2")
+    assert await res.json() == [{"json": "payload"}] * 2
+    assert res.headers.get("X-Next-Cursor") == twitter_api.encode_cursor("1")
+
+    res = await client.get(f"{url}?limit=1")
+    assert await res.json() == [{"json": "payload"}]
+
+    res = await client.get(
+        f"{url}?limit=1", headers={"Authorization": "token"}
+    )
+    assert await res.json() == [{"json": "payload"}]
+
+    res = await client.get(f"{url}?limit=1&cursor=MQ")
+    assert await res.json() == [{"json": "payload"}]
+
+    res = await client.get(f"{url}?limit=3")
+    assert await res.json() == [{"json": "payload"}] * 3
+    assert res.headers.get("X-Next-Cursor") == twitter_api.encode_cursor("1")
+
+    assert calls == [
+        ("", "twitter", 2, None),
+        ("token", "twitter", 1, None),
+        ("", "twitter", 1, "MQ"),
+        ("", "twitter", 3, None),
+    ]
+
+
+def test_etag_matches():
+    assert server.etag_matches("", "abc") is False
+    assert server.etag_matches('"abc"', "abc") is True
+    assert server.etag_matches('W/"abc"', "abc") is True
+    assert server.etag_matches('"abc-gzip"', "abc") is True
+    assert server.etag_matches('"other" , W/"abc-br"', "abc") is True
+    assert server.etag_matches(" * ", "abc") is True
+    assert server.etag_matches('"abcd", "ab"', "abc") is False
+
+
+async def test_view_conditional(client, monkeypatch):
+    async def get_entries_payload(*args, **kwargs):
+        return [("1", {"json": "payload"}), ("2", {"json": "other"})]
+
+    dumps = []
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", get_entries_payload
+    )
+    monkeypatch.setattr(
+        codec,
+        "current",
+        codec.Codec(
+            "counted",
+            lambda value: dumps.append(value) or codec.STDLIB.dumps(value),
+            codec.STDLIB.loads,
+        ),
+    )
+
+    res = await client.get("/hashtags/twitter")
+    etag = res.headers["ETag"]
+    assert res.headers["Cache-Control"] == (
+        f"private, max-age={config.RESPONSE_CACHE_TTL}"
+    )
+    assert await res.json() == [{"json": "payload"}, {"json": "other"}]
+
+    # Cached responses are compared without serializing them again
+    dumps.clear()
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        res = await client.get(
+            "/hashtags/twitter", headers={"If-None-Match": if_none_match}
+        )
+        assert res.status == 304
+        assert res.headers["ETag"] == etag
+        assert await res.read() == b""
+    assert dumps == []
+
+    res = await client.get(
+        "/hashtags/twitter", headers={"If-None-Match": '"other"'}
+    )
+    assert res.status == 200
+    assert await res.read() == b'[{"json":"payload"},{"json":"other"}]'
+
+    res = await client.get(
+        "/hashtags/twitter?limit=1", headers={"If-None-Match": etag}
+    )
+    assert res.status == 200
+    assert res.headers["ETag"] != etag
+    assert dumps == [[{"json": "payload"}]]
+
+
+async def test_view_compression(client, monkeypatch):
+    tweets = [("1", {"text": "tweet " * 300})]
+
+    async def get_entries_payload(*args, **kwargs):
+        return tweets
+
+    monkeypatch.setattr(
+        twitter_api, "get_user_tweet_entries", get_entries_payload
+    )
+    compressor = client.server.app["compressor"]
+
+    res = await client.get(
+        "/users/twitter", headers={"Accept-Encoding": "gzip"}
+    )
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert res.headers["Vary"] == "Accept-Encoding"
+    assert res.headers["ETag"].endswith('-gzip"')
+    assert await res.json() == [{"text": "tweet " * 300}]
+    assert "compress;dur=" in res.headers["Server-Timing"]
+    etag = res.headers["ETag"]
+
+    # Compressed bodies are cached along with the raw body
+    res = await client.get(
+        "/users/twitter",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": '"other"'},
+    )
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert await res.json() == [{"text": "tweet " * 300}]
+    assert compressor.compressions["gzip"] == 1
+
+    res = await client.get(
+        "/users/twitter", headers={"Accept-Encoding": "identity"}
+    )
+    assert "Content-Encoding" not in res.headers
+    assert res.headers["ETag"] == etag.replace("-gzip", "")
+
+    # Validators of any encoding of the same body match
+    res = await client.get(
+        "/users/twitter",
+        headers={"Accept-Encoding": "identity", "If-None-Match": etag},
+    )
+    assert res.status == 304
+
+    # Small bodies are sent as they are
+    tweets[:] = [("1", {"text": "tweet"})]
+    res = await client.get(
+        "/users/twitter?cursor=MQ", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in res.headers
+    assert await res.json() == [{"text": "tweet"}]
+
+
+async def test_batch(client, monkeypatch):
+    calls = []
+
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        calls.append((name, limit, cursor))
+        if name == "missing":
+            raise twitter_api.ApiError("Not found", status=404)
+        return [(str(index), {"name": name}) for index in range(limit)]
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", get_entries_payload
+    )
+    monkeypatch.setattr(
+        twitter_api, "get_user_tweet_entries", get_entries_payload
+    )
+
+    queries = [
+        {"hashtag": "python", "limit": 2},
+        {"user": "twitter", "limit": 1, "cursor": "MQ"},
+        {"user": "missing"},
+        {"hashtag": "python", "limit": 1},
+        {"hashtag": "python", "limit": 0},
+        {"hashtag": "python", "limit": True},
+        {"hashtag": "python", "limit": 1.5},
+        {"user": "twitter", "limit": "1"},
+        {"user": 1},
+        {"user": "twitter", "cursor": 1},
+    ]
+    res = await client.post("/batch", json={"queries": queries})
+    assert res.status == 200
+    assert await res.json() == {
+        "results": [
+            {
+                "tweets": [{"name": "python"}] * 2,
+                "cursor": twitter_api.encode_cursor("1"),
+            },
+            {
+                "tweets": [{"name": "twitter"}],
+                "cursor": twitter_api.encode_cursor("0"),
+            },
+            {"error": "Not found", "status": 404},
+            {
+                "tweets": [{"name": "python"}],
+                "cursor": twitter_api.encode_cursor("0"),
+            },
+            *[
+                {
+                    "error": "Invalid limit parameter: must be a number"
+                    + f" between 1 and {config.MAX_HASHTAG_SEARCH_RESULTS}",
+                    "status": 400,
+                }
+            ]
+            * 3,
+            {
+                "error": "Invalid limit parameter: must be a number between 1"
+                + f" and {config.MAX_USER_TWEET_RESULTS}",
+                "status": 400,
+            },
+            {
+                "error": "Invalid query: expected a hashtag or user",
+                "status": 400,
+            },
+            {"error": "Invalid cursor", "status": 400},
+        ]
+    }
+    # Queries share the response cache with the single endpoints
+    assert sorted(calls) == [
+        ("missing", config.DEFAULT_USER_TWEET_RESULTS, None),
+        ("python", 2, None),
+        ("twitter", 1, "MQ"),
+    ]
+    res = await client.get("/hashtags/python?limit=2")
+    assert await res.json() == [{"name": "python"}] * 2
+    assert len(calls) == 3
+
+
+async def test_batch_stream(client, monkeypatch):
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        await asyncio.sleep(0.01 if name == "slow" else 0)
+        return [("1", {"name": name})]
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", get_entries_payload
+    )
+
+    res = await client.post(
+        "/batch?stream=1",
+        json={"queries": [{"hashtag": "slow"}, {"hashtag": "fast"}]},
+    )
+    assert res.headers.get("Content-Type") == NDJSON_CONTENT_TYPE
+    # Results are sent as they complete
+    assert await res.text() == (
+        '{"index":1,"tweets":[{"name":"fast"}]}\n'
+        '{"index":0,"tweets":[{"name":"slow"}]}\n'
+    )
+
+
+@pytest.mark.parametrize(
+    "body,error",
+    [
+        (b"{", "Invalid batch: malformed json"),
+        (b"[]", "Invalid batch: expected a list of queries"),
+        (b'{"queries": []}', "Invalid batch: expected a list of queries"),
+        (b'{"queries": [1]}', "Invalid batch: queries must be objects"),
+        (
+            b'{"queries": [' + b",".join([b"{}"] * 51) + b"]}",
+            "Invalid batch: at most 50 queries",
+        ),
+    ],
+)
+async def test_batch_error(body, error, client):
+    res = await client.post("/batch", data=body)
+    assert res.status == 400
+    assert await res.json() == {"error": error}
+
+
+async def test_error_middleware_headers(client, monkeypatch):
+    async def get_twitter_api_error_payload(*args, **kwargs):
+        raise twitter_api.ApiError(
+            "Rate limit exhausted", status=429, headers={"Retry-After": "10"}
+        )
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", get_twitter_api_error_payload
+    )
+    res = await client.get("/hashtags/twitter")
+
+    assert res.status == 429
+    assert res.headers.get("Retry-After") == "10"
+    assert await res.json() == {"error": "Rate limit exhausted"}
+
+
+@pytest.mark.parametrize(
+    "api_method,url",
+    [
+        ("search_hashtag_entries", "/hashtags/twitter"),
+        ("get_user_tweet_entries", "/users/twitter"),
+    ],
+)
+async def test_view_degraded(api_method, url, client, monkeypatch):
+    calls = []
+
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        calls.append(deadline.request_deadline.get().remaining())
+        entries = twitter_api.Entries([("1", {"json": "payload"})])
+        entries.degraded = len(calls) == 1
+        entries.exhausted = not entries.degraded
+        return entries
+
+    monkeypatch.setattr(twitter_api, api_method, get_entries_payload)
+
+    res = await client.get(
+        f"{url}?limit=2", headers={"X-Request-Timeout": "0.5"}
+    )
+    assert res.status == 200
+    assert await res.json() == [{"json": "payload"}]
+    assert res.headers.get("X-Degraded") == "true"
+    assert res.headers.get("Cache-Control") == "no-store"
+    # Partial results may have more pages
+    assert res.headers.get("X-Next-Cursor") == twitter_api.encode_cursor("1")
+    assert 0 < calls[0] <= 0.5
+
+    res = await client.get(f"{url}?limit=2")
+    assert res.headers.get("X-Degraded") is None
+    assert res.headers.get("X-Next-Cursor") is None
+    assert config.REQUEST_TIMEOUT - 0.5 < calls[1] <= config.REQUEST_TIMEOUT
+
+    # Only complete results are cached
+    res = await client.get(f"{url}?limit=2")
+    assert res.headers.get("X-Degraded") is None
+    assert len(calls) == 2
+
+    res = await client.get("/metrics")
+    assert "api_degraded_responses_total 1\n" in await res.text()
+
+
+async def test_view_stream_degraded(client, monkeypatch):
+    async def iter_payload(*args, **kwargs):
+        yield "1", {"tweet": 1}
+        deadline.degrade()
+        yield "2", {"tweet": 2}
+        raise deadline.DeadlineExceeded()
+
+    monkeypatch.setattr(twitter_api, "iter_hashtag", iter_payload)
+    res = await client.get("/hashtags/twitter?stream=1")
+    assert res.status == 200
+    # Streams end with a cursor to the rest, and a degraded line
+    assert await res.text() == (
+        '{"tweet":1}\n{"tweet":2}\n'
+        + f'{{"cursor":"{twitter_api.encode_cursor("2")}"}}\n'
+        + '{"degraded":true}\n'
+    )
+
+
+async def test_batch_degraded(client, monkeypatch):
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        entries = twitter_api.Entries([("1", {"name": name})])
+        entries.degraded = name == "slow"
+        entries.exhausted = not entries.degraded
+        return entries
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", get_entries_payload
+    )
+
+    res = await client.post(
+        "/batch",
+        json={"queries": [{"hashtag": "slow"}, {"hashtag": "fast"}]},
+    )
+    assert res.headers.get("X-Degraded") == "true"
+    # Queries are degraded on their own
+    assert await res.json() == {
+        "results": [
+            {
+                "tweets": [{"name": "slow"}],
+                "cursor": twitter_api.encode_cursor("1"),
+                "degraded": True,
+            },
+            {"tweets": [{"name": "fast"}]},
+        ]
+    }
+
+
+async def test_view_not_exhausted(client, monkeypatch):
+    async def get_entries_payload(
+        client, authorization, name, limit, cursor, trace
+    ):
+        # Tweets missing from v2 were left out of a full timeline page
+        entries = twitter_api.Entries([("1", {"tweet": 1})])
+        entries.exhausted = name == "done"
+        return entries
+
+    monkeypatch.setattr(
+        twitter_api, "get_user_tweet_entries", get_entries_payload
+    )
+
+    res = await client.get("/users/more?limit=2")
+    assert res.headers.get("X-Next-Cursor") == twitter_api.encode_cursor("1")
+    res = await client.get("/users/done?limit=2")
+    assert res.headers.get("X-Next-Cursor") is None
+
+
+def make_async_iter_payload(error=None, errors_at=None):
+    async def iter_payload(*args, **kwargs):
+        for index in range(3):
+            if index == errors_at:
+                raise error
+            yield str(index), {"tweet": index}
+
+    return iter_payload
+
+
+@pytest.mark.parametrize(
+    "api_method,url",
+    [
+        ("iter_hashtag", "/hashtags/twitter"),
+        ("iter_user_tweets", "/users/twitter"),
+    ],
+)
+async def test_view_stream(api_method, url, client, monkeypatch):
+    monkeypatch.setattr(twitter_api, api_method, make_async_iter_payload())
+
+    res = await client.get(f"{url}?stream=1")
+    assert res.status == 200
+    assert res.headers.get("Content-Type") == NDJSON_CONTENT_TYPE
+    assert res.headers.get("X-RateLimit-Limit") is not None
+    assert await res.text() == ('{"tweet":0}\n{"tweet":1}\n{"tweet":2}\n')
+
+    res = await client.get(
+        f"{url}?limit=3", headers={"Accept": "application/x-ndjson"}
+    )
+    assert res.status == 200
+    assert res.headers.get("Content-Type") == NDJSON_CONTENT_TYPE
+    assert await res.text() == (
+        '{"tweet":0}\n{"tweet":1}\n{"tweet":2}\n'
+        + f'{{"cursor":"{twitter_api.encode_cursor("2")}"}}\n'
+    )
+
+
+async def test_view_stream_errors(client, monkeypatch):
+    error = twitter_api.ApiError("Something went wrong", status=501)
+
+    monkeypatch.setattr(
+        twitter_api, "iter_hashtag", make_async_iter_payload(error, 0)
+    )
+    res = await client.get("/hashtags/twitter?stream=1")
+    assert res.status == 501
+    assert res.headers.get("Content-Type") == UJSON_CONTENT_TYPE
+    assert await res.json() == {"error": "Something went wrong"}
+
+    monkeypatch.setattr(
+        twitter_api, "iter_hashtag", make_async_iter_payload(error, 2)
+    )
+    res = await client.get("/hashtags/twitter?stream=1")
+    assert res.status == 200
+    assert await res.text() == (
+        '{"tweet":0}\n{"tweet":1}\n{"error":"Something went wrong"}\n'
+    )
+
+
+async def test_view_stream_empty(client, monkeypatch):
+    async def iter_empty_payload(*args, **kwargs):
+        return
+        yield
+
+    monkeypatch.setattr(twitter_api, "iter_hashtag", iter_empty_payload)
+    res = await client.get("/hashtags/twitter?stream=1")
+    assert res.status == 200
+    assert res.headers.get("Content-Type") == NDJSON_CONTENT_TYPE
+    assert await res.text() == ""
+
+
+async def test_health(client):
+    res = await client.get("/health")
+    assert res.status == 200
+    assert await res.json() == {"status": "ok"}
@@ -0,0 +1,148 @@
+import asyncio
+import pytest
+
+from api import singleflight
+
+
+async def test_single_flight_shares_result():
+    flights = singleflight.SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def work():
+        calls.append(True)
+        await release.wait()
+        return ["result"]
+
+    callers = [
+        asyncio.ensure_future(flights.do("key", work)) for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*callers) == [["result"]] * 3
+    assert calls == [True]
+    assert flights.coalesced == 2
+    assert flights.flights == {}
+
+    assert await flights.do("key", work) == ["result"]
+    assert calls == [True, True]
+
+
+async def test_single_flight_shares_error():
+    flights = singleflight.SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        raise ValueError("Something went wrong")
+
+    callers = [
+        asyncio.ensure_future(flights.do("key", work)) for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    for caller in callers:
+        with pytest.raises(ValueError):
+            await caller
+    assert flights.flights == {}
+
+
+async def test_single_flight_caller_cancellation():
+    flights = singleflight.SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        return "result"
+
+    cancelled = asyncio.ensure_future(flights.do("key", work))
+    waiting = asyncio.ensure_future(flights.do("key", work))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await waiting == "result"
+    assert cancelled.cancelled() is True
+
+
+async def test_single_flight_every_caller_cancelled():
+    flights = singleflight.SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        raise ValueError("Something went wrong")
+
+    caller = asyncio.ensure_future(flights.do("key", work))
+    await asyncio.sleep(0)
+    flight = flights.flights["key"]
+
+    caller.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert flight.done() is True
+    assert flights.flights == {}
+
+    flight = asyncio.ensure_future(flights.do("key", work))
+    await asyncio.sleep(0)
+    flights.flights["key"].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await flight
+    await asyncio.sleep(0)
+    assert flights.flights == {}
+
+
+async def test_single_flight_do_many():
+    flights = singleflight.SingleFlight()
+    calls = []
+    release = asyncio.Event()
+
+    async def work(keys):
+        calls.append(keys)
+        await release.wait()
+        # Missing keys are left out of the results
+        return {key: key.upper() for key in keys if key != "gone"}
+
+    first = asyncio.ensure_future(flights.do_many("ns", ["a", "b"], work))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(
+        flights.do_many("ns", ["b", "c", "gone"], work)
+    )
+    other = asyncio.ensure_future(flights.do_many("other", ["a"], work))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first == {"a": "A", "b": "B"}
+    assert await second == {"b": "B", "c": "C"}
+    assert await other == {"a": "A"}
+    assert calls == [["a", "b"], ["c", "gone"], ["a"]]
+    assert flights.coalesced == 1
+    assert flights.flights == {}
+
+
+async def test_single_flight_do_many_error():
+    flights = singleflight.SingleFlight()
+    release = asyncio.Event()
+
+    async def work(keys):
+        await release.wait()
+        raise ValueError("Something went wrong")
+
+    callers = [
+        asyncio.ensure_future(flights.do_many("ns", keys, work))
+        for keys in [["a", "b"], ["b"]]
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    for caller in callers:
+        with pytest.raises(ValueError):
+            await caller
+    assert flights.flights == {}
@@ -0,0 +1,146 @@
+import asyncio
+import sqlite3
+
+from aiohttp import web
+
+from api import config, models, store
+
+
+async def open_store(tmp_path, **kwargs):
+    persistent = store.Store(str(tmp_path / "cache.sqlite"), **kwargs)
+    await persistent.open()
+    return persistent
+
+
+async def test_contents(tmp_path):
+    first = await open_store(tmp_path)
+    first.put_content("1", models.Content(["#a"], "text"))
+
+    # Entries not written yet are read from memory
+    assert await first.get_contents(["1", "2"]) == {
+        "1": models.Content(["#a"], "text")
+    }
+    await first.flush()
+    assert first.pending == {}
+
+    # Other workers read the same file
+    second = await open_store(tmp_path)
+    assert await second.get_contents(["1", "2"]) == {
+        "1": models.Content(["#a"], "text")
+    }
+    assert (second.hits, second.misses, first.writes) == (1, 1, 1)
+
+    await first.close()
+    await second.close()
+
+
+async def test_responses(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(store, "time", lambda: now[0])
+    persistent = await open_store(tmp_path)
+
+    value = [
+        (
+            "1",
+            models.Tweet(
+                models.Account("1", "a", "/a"), None, 1, 2, 3, [], None
+            ),
+        )
+    ]
+    persistent.put_response(("hashtags", "tag", None), 10, value, 15, 60, True)
+    persistent.put_response(("hashtags", "old", None), 10, value, 0, 0)
+    await persistent.flush()
+
+    now[0] = 1010.0
+    assert await persistent.get_response(("hashtags", "tag", None)) == (
+        10,
+        [
+            (
+                "1",
+                {
+                    "account": {"id": "1", "fullname": "a", "href": "/a"},
+                    "date": None,
+                    "likes": 1,
+                    "replies": 2,
+                    "retweets": 3,
+                    "hashtags": [],
+                    "text": None,
+                },
+            )
+        ],
+        5,
+        65,
+        True,
+    )
+    assert await persistent.get_response(("hashtags", "old", None)) is None
+    assert await persistent.get_response(("users", "tag", None)) is None
+
+    await persistent.close()
+
+
+async def test_compact(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(store, "time", lambda: now[0])
+    persistent = await open_store(tmp_path, max_bytes=1000)
+
+    persistent.put("expired", b"x", expires_at=1001)
+    for index in range(20):
+        now[0] += 1
+        persistent.put(f"key{index:02}", b"x" * 95)
+    await persistent.flush()
+
+    # 20 entries of 100 bytes, the oldest go until 80% of the cap is left
+    assert await persistent.run(persistent.compact) == 13
+    assert sorted(
+        await persistent.get_many([f"key{i:02}" for i in range(20)])
+    ) == [f"key{index}" for index in range(12, 20)]
+    assert await persistent.run(persistent.compact) == 0
+
+    await persistent.close()
+
+
+async def test_maintain(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PERSISTENT_CACHE_FLUSH_INTERVAL", 0.01)
+    monkeypatch.setattr(config, "PERSISTENT_CACHE_COMPACT_INTERVAL", 0)
+    persistent = await open_store(tmp_path, max_bytes=0)
+
+    persistent.put("key", b"value")
+    while persistent.evictions == 0:
+        await asyncio.sleep(0.01)
+    assert persistent.writes == 1
+
+    # Failed writes and reads lose their entries
+    def fail(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(persistent, "write", fail)
+    monkeypatch.setattr(persistent, "read", fail)
+    persistent.put("key", b"value")
+    while persistent.pending:
+        await asyncio.sleep(0.01)
+    assert await persistent.get_many(["other"]) == {}
+
+    persistent.put("key", b"value")
+    await persistent.close()
+    assert persistent.connection is None
+
+
+async def test_store_context(tmp_path, monkeypatch):
+    app = web.Application()
+    context = store.store_context(app)
+    await context.__anext__()
+    assert app["store"] is None
+
+    monkeypatch.setattr(
+        config, "PERSISTENT_CACHE_PATH", str(tmp_path / "cache.sqlite")
+    )
+    context = store.store_context(app)
+    await context.__anext__()
+    assert app["store"].connection is not None
+    app["store"].put("key", b"value")
+    try:
+        await context.__anext__()
+    except StopAsyncIteration:
+        pass
+    assert app["store"].connection is None
+    assert app["store"].writes == 1
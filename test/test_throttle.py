@@ -0,0 +1,196 @@
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from api import config, throttle, server, twitter_api
+
+
+def test_bucket_store_take(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(throttle, "monotonic", lambda: now[0])
+    store = throttle.BucketStore(rate=1, burst=2)
+
+    assert store.take("client")[0] is True
+    assert store.take("client")[0] is True
+    allowed, bucket = store.take("client")
+    assert allowed is False
+    assert store.headers(bucket) == {
+        "X-RateLimit-Limit": "2",
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": "2",
+    }
+    assert store.take("other")[0] is True
+
+    now[0] = 1.5
+    allowed, bucket = store.take("client")
+    assert allowed is True
+    assert store.headers(bucket) == {
+        "X-RateLimit-Limit": "2",
+        "X-RateLimit-Remaining": "0",
+        "X-RateLimit-Reset": "2",
+    }
+
+    now[0] = 100.0
+    allowed, bucket = store.take("client")
+    assert allowed is True
+    assert bucket.tokens == 1
+
+
+def test_bucket_store_eviction(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(throttle, "monotonic", lambda: now[0])
+    store = throttle.BucketStore(rate=1, burst=2, max_clients=2, idle_ttl=10)
+
+    store.take("one")
+    store.take("two")
+    store.take("one")
+    store.take("three")
+    assert list(store.buckets) == ["one", "three"]
+
+    now[0] = 5.0
+    store.take("three")
+    now[0] = 12.0
+    store.take("four")
+    assert list(store.buckets) == ["three", "four"]
+
+    store = throttle.BucketStore(rate=1, burst=100, idle_ttl=10)
+    assert store.idle_ttl == 100
+
+
+def test_client_key():
+    assert throttle.client_key(
+        make_mocked_request("GET", "/", headers={"Authorization": "token"})
+    ).startswith("token:")
+    assert (
+        "token"
+        not in throttle.client_key(
+            make_mocked_request("GET", "/", headers={"Authorization": "token"})
+        )[len("token:") :]
+    )
+    assert throttle.client_key(make_mocked_request("GET", "/")) == ("ip:None")
+
+
+def test_make_bucket_stores():
+    stores = throttle.make_bucket_stores({"/route": (1, 2)})
+    assert list(stores) == ["/route"]
+    assert (stores["/route"].rate, stores["/route"].burst) == (1, 2)
+
+
+async def test_throttle_middleware(
+    aiohttp_client, entries_payload, monkeypatch
+):
+    monkeypatch.setattr(twitter_api, "search_hashtag_entries", entries_payload)
+    monkeypatch.setattr(twitter_api, "get_user_tweet_entries", entries_payload)
+    app = server.make_app()
+    app["bucket_stores"] = throttle.make_bucket_stores(
+        {"/hashtags/{tag}": (0.5, 2)}
+    )
+    client = await aiohttp_client(app)
+
+    res = await client.get("/hashtags/twitter")
+    assert res.status == 200
+    assert res.headers.get("X-RateLimit-Remaining") == "1"
+
+    res = await client.get("/hashtags/other")
+    assert res.status == 200
+    assert res.headers.get("X-RateLimit-Remaining") == "0"
+
+    res = await client.get("/hashtags/twitter")
+    assert res.status == 429
+    assert res.headers.get("Retry-After") == "2"
+    assert res.headers.get("X-RateLimit-Limit") == "2"
+    assert await res.json() == {"error": "Too many requests"}
+
+    res = await client.get(
+        "/hashtags/twitter", headers={"Authorization": "token"}
+    )
+    assert res.status == 200
+
+    res = await client.get("/users/twitter")
+    assert res.status == 200
+    assert "X-RateLimit-Limit" not in res.headers
+
+    res = await client.get("/unknown")
+    assert res.status == 404
+
+
+async def test_throttle_middleware_prepared_response(aiohttp_client):
+    async def handler(req):
+        res = web.StreamResponse()
+        await res.prepare(req)
+        await res.write(b"stream")
+        return res
+
+    app = web.Application(middlewares=[throttle.throttle_middleware])
+    app["bucket_stores"] = throttle.make_bucket_stores({"/stream": (1, 2)})
+    app.on_response_prepare.append(throttle.add_rate_limit_headers)
+    app.router.add_get("/stream", handler)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/stream")
+    assert res.status == 200
+    assert await res.read() == b"stream"
+    assert res.headers.get("X-RateLimit-Limit") == "2"
+
+
+async def test_throttle_batch(aiohttp_client, entries_payload, monkeypatch):
+    monkeypatch.setattr(twitter_api, "search_hashtag_entries", entries_payload)
+    monkeypatch.setattr(twitter_api, "get_user_tweet_entries", entries_payload)
+    client = await aiohttp_client(server.make_app())
+    headers = {"Authorization": "token"}
+
+    # Full batches fit in the default limits of a fresh client
+    queries = [
+        {"hashtag" if index % 2 else "user": str(index), "limit": 1}
+        for index in range(config.BATCH_MAX_QUERIES)
+    ]
+    for _ in range(2):
+        res = await client.post(
+            "/batch", json={"queries": queries}, headers=headers
+        )
+        assert res.status == 200
+        results = (await res.json())["results"]
+        assert all("tweets" in result for result in results)
+
+    res = await client.post(
+        "/batch", json={"queries": queries}, headers=headers
+    )
+    assert res.status == 429
+    assert await res.json() == {"error": "Too many requests"}
+    assert int(res.headers["Retry-After"]) > 0
+
+
+async def test_throttle_batch_routes(
+    aiohttp_client, entries_payload, monkeypatch
+):
+    monkeypatch.setattr(twitter_api, "search_hashtag_entries", entries_payload)
+    monkeypatch.setattr(twitter_api, "get_user_tweet_entries", entries_payload)
+    monkeypatch.setattr(config, "BATCH_MAX_ROUTE_TOKENS", 3)
+    app = server.make_app()
+    app["bucket_stores"] = throttle.make_bucket_stores(
+        {"/hashtags/{tag}": (0.01, 5), "/users/{username}": (0.01, 5)}
+    )
+    client = await aiohttp_client(app)
+
+    # Queries pay the route they query, up to a cap per batch
+    res = await client.post(
+        "/batch",
+        json={
+            "queries": [{"hashtag": "tag"}] * 4
+            + [{"user": "name"}] * 3
+            + [{"user": 1}]
+        },
+    )
+    assert res.status == 200
+
+    # Batches are paid all at once or not at all
+    res = await client.post(
+        "/batch",
+        json={"queries": [{"hashtag": "tag"}] + [{"user": "name"}] * 4},
+    )
+    assert res.status == 429
+    assert res.headers["Retry-After"] == "100"
+
+    res = await client.get("/hashtags/tag")
+    assert res.headers.get("X-RateLimit-Remaining") == "1"
+    res = await client.get("/users/name")
+    assert res.headers.get("X-RateLimit-Remaining") == "1"
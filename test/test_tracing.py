@@ -0,0 +1,102 @@
+import json
+import logging
+
+from aiohttp import web
+
+from api import config, tracing, twitter_api
+
+
+def test_trace(monkeypatch):
+    clock = iter([0, 1, 1.5, 2, 2.25, 3, 3.5, 4, 4])
+    monkeypatch.setattr(tracing, "perf_counter", lambda: next(clock))
+
+    trace = tracing.Trace()
+    with trace.phase("search"):
+        pass
+    with trace.phase("v1"):
+        pass
+    with trace.phase("v1"):
+        pass
+
+    assert trace.server_timing() == (
+        'search;dur=500.0, v1;dur=750.0;desc="2 calls", total;dur=4000.0'
+    )
+    assert trace.entry() == {
+        "duration_ms": 4000,
+        "phases": {
+            "search": {"ms": 500, "count": 1},
+            "v1": {"ms": 750, "count": 2},
+        },
+    }
+
+
+def test_no_trace():
+    with tracing.NO_TRACE.phase("search"):
+        pass
+    assert tracing.NO_TRACE.phases == {}
+
+
+async def test_server_timing(client, monkeypatch):
+    async def search_hashtag_entries_mock(*args, trace, **kwargs):
+        with trace.phase("search"):
+            pass
+        return [("1", {"json": "payload"})]
+
+    monkeypatch.setattr(
+        twitter_api, "search_hashtag_entries", search_hashtag_entries_mock
+    )
+
+    res = await client.get("/hashtags/python")
+    assert res.status == 200
+    assert [
+        timing.split(";")[0]
+        for timing in res.headers["Server-Timing"].split(", ")
+    ] == ["search", "serialize", "total"]
+
+    monkeypatch.setattr(config, "TRACING_ENABLED", False)
+    res = await client.get("/hashtags/python")
+    assert res.status == 200
+    assert "Server-Timing" not in res.headers
+
+
+async def test_tracing_middleware_logs(aiohttp_client, monkeypatch, caplog):
+    async def ok(req):
+        return web.Response()
+
+    async def missing(req):
+        raise web.HTTPNotFound()
+
+    async def fail(req):
+        raise RuntimeError("boom")
+
+    app = web.Application(middlewares=[tracing.tracing_middleware])
+    app.router.add_get("/ok", ok)
+    app.router.add_get("/missing", missing)
+    app.router.add_get("/fail", fail)
+    client = await aiohttp_client(app)
+    caplog.set_level(logging.INFO, logger=tracing.logger.name)
+
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 0)
+    assert (await client.get("/ok")).status == 200
+    assert caplog.records == []
+
+    monkeypatch.setattr(config, "TRACE_SLOW_REQUEST_THRESHOLD", 0)
+    assert (await client.get("/ok")).status == 200
+    assert (await client.get("/missing")).status == 404
+    monkeypatch.setattr(config, "TRACE_SLOW_REQUEST_THRESHOLD", 60)
+    monkeypatch.setattr(config, "TRACE_SAMPLE_RATE", 1)
+    assert (await client.get("/fail")).status == 500
+
+    entries = [
+        json.loads(record.getMessage())
+        for record in caplog.records
+        if record.name == tracing.logger.name
+    ]
+    assert [
+        (entry["path"], entry["status"], entry["slow"], entry["phases"])
+        for entry in entries
+    ] == [
+        ("/ok", 200, True, {}),
+        ("/missing", 404, True, {}),
+        ("/fail", 500, False, {}),
+    ]
@@ -1,140 +1,21 @@
+import asyncio
+import types
 import pytest
 import aiohttp
 
-from api import twitter_api
+from time import monotonic
 
-
-def test_transform_v1_hashtags():
-    assert twitter_api.transform_v1_hashtags({}) == {"hashtags": []}
-    assert twitter_api.transform_v1_hashtags({"hashtags": []}) == {
-        "hashtags": []
-    }
-    assert twitter_api.transform_v1_hashtags(
-        {"hashtags": [{"text": "one"}, {"text": "two"}]}
-    ) == {"hashtags": ["#one", "#two"]}
-
-
-def test_transform_v1_text():
-    assert twitter_api.transform_v1_text({}) == {"text": None}
-    assert twitter_api.transform_v1_text({"full_text": ""}) == {"text": ""}
-    assert twitter_api.transform_v1_text({"full_text": "A tweet"}) == {
-        "text": "A tweet"
-    }
-
-
-def test_transform_v1_tweet():
-    assert twitter_api.transform_v1_tweet({}) == {"hashtags": [], "text": None}
-    assert twitter_api.transform_v1_tweet(
-        {"retweeted_status": {}, "entities": {}}
-    ) == {
-        "hashtags": [],
-        "text": None,
-    }
-    assert (
-        twitter_api.transform_v1_tweet(
-            {
-                "retweeted_status": {
-                    "entities": {
-                        "hashtags": [{"text": "one"}, {"text": "two"}]
-                    }
-                },
-                "entities": {"hashtags": []},
-            }
-        )
-        == {"hashtags": ["#one", "#two"], "text": None}
-    )
-    assert twitter_api.transform_v1_tweet(
-        {"entities": {"hashtags": [{"text": "one"}, {"text": "two"}]}}
-    ) == {"hashtags": ["#one", "#two"], "text": None}
-    assert twitter_api.transform_v1_tweet(
-        {"retweeted_status": {"full_text": "A tweet"}, "full_text": ""}
-    ) == {"hashtags": [], "text": "A tweet"}
-    assert twitter_api.transform_v1_tweet({"full_text": "A tweet"}) == {
-        "hashtags": [],
-        "text": "A tweet",
-    }
-
-
-def test_transform_v2_public_metrics():
-    assert twitter_api.transform_v2_public_metrics({}) == {
-        "likes": None,
-        "replies": None,
-        "retweets": None,
-    }
-    assert twitter_api.transform_v2_public_metrics(
-        {"like_count": 1, "reply_count": 2, "retweet_count": 3}
-    ) == {
-        "likes": 1,
-        "replies": 2,
-        "retweets": 3,
-    }
-
-
-def test_transform_v2_created_at():
-    assert twitter_api.transform_v2_created_at(None) == {"date": None}
-    assert twitter_api.transform_v2_created_at("2011-10-05T14:48:00.000Z") == {
-        "date": "11:48 PM - 05 Oct 2011"
-    }
-
-
-def test_transform_v2_included_users():
-    assert twitter_api.transform_v2_included_users({}) == {}
-    assert twitter_api.transform_v2_included_users(
-        {"users": [{"id": "one"}, {"id": "two"}]}
-    ) == {"one": {"id": "one"}, "two": {"id": "two"}}
-
-
-def test_transform_v2_user():
-    assert twitter_api.transform_v2_user({}) == {
-        "account": {"id": None, "fullname": None, "href": None}
-    }
-    assert (
-        twitter_api.transform_v2_user(
-            {
-                "id": "1234",
-                "name": "Bob",
-                "username": "bob",
-            }
-        )
-        == {"account": {"id": "1234", "fullname": "Bob", "href": "/bob"}}
-    )
-
-
-def test_transform_v2_tweet():
-    assert twitter_api.transform_v2_tweet({}, {}) == {
-        "account": {"fullname": None, "href": None, "id": None},
-        "date": None,
-        "likes": None,
-        "replies": None,
-        "retweets": None,
-    }
-    assert twitter_api.transform_v2_tweet(
-        {"author_id": "1234"}, {"1234": {}}
-    ) == {
-        "account": {"fullname": None, "href": None, "id": None},
-        "date": None,
-        "likes": None,
-        "replies": None,
-        "retweets": None,
-    }
-    assert twitter_api.transform_v2_tweet(
-        {
-            "author_id": "1234",
-            "created_at": "2011-10-05T14:48:00.000Z",
-            "public_metrics": {
-                "like_count": 1,
-                "reply_count": 2,
-                "retweet_count": 3,
-            },
-        },
-        {"1234": {"id": "1234", "name": "Bob", "username": "bob"}},
-    ) == {
-        "account": {"fullname": "Bob", "href": "/bob", "id": "1234"},
-        "date": "11:48 PM - 05 Oct 2011",
-        "likes": 1,
-        "replies": 2,
-        "retweets": 3,
-    }
+from api import (
+    twitter_api,
+    breaker,
+    codec,
+    config,
+    deadline,
+    models,
+    store,
+    upstream,
+)
+from .conftest import make_async_json_response_mock
 
 
 def test_check_v1_error():
@@ -189,45 +70,332 @@ def test_check_v2_error():
         twitter_api.check_v1_error({"errors": []})
 
 
-async def test_get_v1_tweet(client, client_response, monkeypatch):
-    success_v1_tweet_response = {
-        "retweeted_status": {
-            "full_text": "A tweet",
-            "entities": {"hashtags": [{"text": "one"}, {"text": "two"}]},
-        },
-        "entities": {"hashtags": []},
-        "full_text": "",
+async def test_get_v1_tweets(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        calls.append(params["id"])
+        return make_async_json_response_mock(
+            [
+                {
+                    "id_str": id,
+                    "full_text": f"Tweet {id}",
+                    "entities": {"hashtags": [{"text": "one"}]},
+                }
+                for id in params["id"].split(",")
+                if id != "2"
+            ]
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    assert await twitter_api.get_v1_tweets(upstream_client, "token", []) == {}
+    assert calls == []
+
+    assert await twitter_api.get_v1_tweets(
+        upstream_client, "token", ["1", "2", "3"]
+    ) == {
+        "1": models.Content(["#one"], "Tweet 1"),
+        "3": models.Content(["#one"], "Tweet 3"),
     }
+    assert calls == ["1,2,3"]
+
+    ids = [str(id) for id in range(3, 4 + config.TWITTER_MAX_LOOKUP_IDS)]
+    assert len(
+        await twitter_api.get_v1_tweets(upstream_client, "token", ids)
+    ) == len(ids)
+    assert len(calls) == 3
+    assert calls[2] == str(3 + config.TWITTER_MAX_LOOKUP_IDS)
+
     monkeypatch.setattr(
         aiohttp.ClientSession,
         "get",
-        client_response(success_v1_tweet_response),
+        lambda *args, **kwargs: make_async_json_response_mock({"errors": []}),
     )
-    assert await twitter_api.get_v1_tweet("token", "1234") == {
-        "hashtags": ["#one", "#two"],
-        "text": "A tweet",
+    with pytest.raises(twitter_api.ApiError):
+        await twitter_api.get_v1_tweets(upstream_client, "token", ["1"])
+
+
+def test_cache_v2_tweets(upstream_client):
+    bob = models.Tweet(
+        models.Account("1234", None, "/bob"), None, None, None, None, [], None
+    )
+    assert twitter_api.cache_v2_tweets(
+        upstream_client,
+        [{"id": "1", "author_id": "1234"}, {"id": "2"}],
+        {"includes": {"users": [{"id": "1234", "username": "bob"}]}},
+    ) == {
+        "1": bob,
+        "2": models.Tweet(
+            models.Account(None, None, None), None, None, None, None, [], None
+        ),
     }
+    assert upstream_client.tweet_metrics.get("1") == bob
 
-    error_response = {"errors": []}
-    monkeypatch.setattr(
-        aiohttp.ClientSession, "get", client_response(error_response)
+
+async def test_fetch_v2_tweets(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        ids = params["ids"].split(",")
+        calls.append(ids)
+        return make_async_json_response_mock(
+            {
+                "data": [{"id": id, "author_id": ids[0]} for id in ids],
+                "includes": {"users": [{"id": ids[0], "username": ids[0]}]},
+            }
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    # Timeline pages of more tweets than a call allows are split
+    ids = [str(id) for id in range(1, 2 + 2 * config.TWITTER_MAX_TWEETS_IDS)]
+    v2_tweets = await twitter_api.fetch_v2_tweets(
+        upstream_client, "token", ids
     )
-    with pytest.raises(twitter_api.ApiError):
-        await twitter_api.get_v1_tweet("token", "1234")
+    assert list(v2_tweets) == ids
+    assert [len(call) for call in calls] == [
+        config.TWITTER_MAX_TWEETS_IDS,
+        config.TWITTER_MAX_TWEETS_IDS,
+        1,
+    ]
+    # Each call has its own included authors
+    assert v2_tweets[ids[-1]].account.href == f"/{ids[-1]}"
+    assert upstream_client.tweet_metrics.get(ids[0]) == v2_tweets[ids[0]]
 
 
-async def test_get_v2_tweets(client, client_response, monkeypatch):
-    async def get_v1_tweet_mock(*args, **kwargs):
-        return {
-            "hashtags": ["#one", "#two"],
-            "text": "A tweet",
+async def test_merge_v1_tweets(upstream_client, monkeypatch):
+    calls = []
+
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        calls.append(ids)
+        return {"1": models.Content(["#one"], "A tweet")}
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+
+    bob = models.Account("1234", None, "/bob")
+    nobody = models.Account(None, None, None)
+    v2_tweets = {
+        "1": models.Tweet(bob, None, 1, 2, 3, [], None),
+        "2": models.Tweet(nobody, None, None, None, None, [], None),
+    }
+    merged_tweets = [
+        models.Tweet(bob, None, 1, 2, 3, ["#one"], "A tweet"),
+        models.Tweet(nobody, None, None, None, None, [], None),
+    ]
+
+    assert (
+        await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1", "2"], v2_tweets
+        )
+        == merged_tweets
+    )
+    assert (
+        await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1", "2"], v2_tweets
+        )
+        == merged_tweets
+    )
+    assert (
+        await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1"], v2_tweets
+        )
+        == merged_tweets[:1]
+    )
+    assert calls == [["1", "2"], ["2"]]
+
+
+async def test_merge_v1_tweets_shared(upstream_client, monkeypatch):
+    calls = []
+
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        calls.append(ids)
+        await asyncio.sleep(0)
+        return {id: models.Content([], id) for id in ids}
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+    nobody = models.Account(None, None, None)
+    v2_tweets = {
+        id: models.Tweet(nobody, None, None, None, None, [], None)
+        for id in ["1", "2", "3"]
+    }
+
+    # Tweets being hydrated for a concurrent request are looked up once
+    first, second = await asyncio.gather(
+        twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1", "2"], v2_tweets
+        ),
+        twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["2", "3"], v2_tweets
+        ),
+    )
+    assert [tweet.text for tweet in first + second] == ["1", "2", "2", "3"]
+    assert calls == [["1", "2"], ["3"]]
+
+
+async def test_merge_v1_tweets_deadline(upstream_client, monkeypatch):
+    calls = []
+
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        calls.append(ids)
+        await asyncio.sleep(0 if ids == ["3"] else 0.05)
+        return {id: models.Content(["#tag"], id) for id in ids}
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+    nobody = models.Account(None, None, None)
+    v2_tweets = {
+        id: models.Tweet(nobody, None, 1, 2, 3, [], None)
+        for id in ["1", "2", "3"]
+    }
+    upstream_client.tweet_contents.put("1", models.Content([], "cached"))
+
+    other_request = asyncio.ensure_future(
+        twitter_api.merge_v1_tweets(upstream_client, "token", ["3"], v2_tweets)
+    )
+    await asyncio.sleep(0)
+    token = deadline.request_deadline.set(
+        deadline.Deadline(monotonic() + 0.01)
+    )
+    try:
+        # Tweets not looked up by the deadline only get their v2 data
+        merged = await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1", "2", "3"], v2_tweets
+        )
+        assert merged == [
+            models.Tweet(nobody, None, 1, 2, 3, [], "cached"),
+            models.Tweet(nobody, None, 1, 2, 3, [], None),
+            models.Tweet(nobody, None, 1, 2, 3, ["#tag"], "3"),
+        ]
+        assert merged.degraded is True
+        assert deadline.degraded() is True
+    finally:
+        deadline.request_deadline.reset(token)
+    await other_request
+
+    # The lookup goes on and is cached for later requests
+    await asyncio.sleep(0.06)
+    assert (
+        await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["2"], v2_tweets
+        )
+    )[0].text == "2"
+    assert calls == [["3"], ["2"]]
+
+
+async def test_merge_v1_tweets_breaker(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, *args, **kwargs):
+        calls.append(args)
+        return make_async_json_response_mock([])
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+    circuit = upstream_client.breakers[upstream.V1_LOOKUP]
+    circuit.open()
+    nobody = models.Account(None, None, None)
+    v2_tweets = {"1": models.Tweet(nobody, None, 1, 2, 3, [], None)}
+
+    # While v1 lookups fail, tweets get their v2 data without calling it
+    token = deadline.request_deadline.set(deadline.Deadline(None))
+    try:
+        assert await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1"], v2_tweets
+        ) == [models.Tweet(nobody, None, 1, 2, 3, [], None)]
+        assert deadline.degraded() is True
+    finally:
+        deadline.request_deadline.reset(token)
+    assert calls == []
+    assert circuit.rejections == 1
+    assert circuit.current() == breaker.OPEN
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        twitter_api.ApiError("Twitter API error: Unavailable", status=503),
+        aiohttp.ClientConnectionError(),
+        asyncio.TimeoutError(),
+    ],
+)
+async def test_merge_v1_tweets_failure(error, upstream_client, monkeypatch):
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        raise error
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+    nobody = models.Account(None, None, None)
+    v2_tweets = {"1": models.Tweet(nobody, None, 1, 2, 3, [], None)}
+
+    # Failed lookups leave tweets with their v2 data
+    token = deadline.request_deadline.set(deadline.Deadline(None))
+    try:
+        merged = await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1"], v2_tweets
+        )
+        assert merged == [models.Tweet(nobody, None, 1, 2, 3, [], None)]
+        assert merged.degraded is True
+        assert deadline.degraded() is True
+    finally:
+        deadline.request_deadline.reset(token)
+
+
+async def test_merge_v1_tweets_client_error(upstream_client, monkeypatch):
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        raise twitter_api.ApiError("Twitter API error: Forbidden", status=403)
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+    nobody = models.Account(None, None, None)
+    v2_tweets = {"1": models.Tweet(nobody, None, 1, 2, 3, [], None)}
+
+    # Errors of the request itself are not hidden
+    with pytest.raises(twitter_api.ApiError) as error:
+        await twitter_api.merge_v1_tweets(
+            upstream_client, "token", ["1"], v2_tweets
+        )
+    assert error.value.status == 403
+
+
+async def test_merge_v1_tweets_store(upstream_client, tmp_path, monkeypatch):
+    calls = []
+
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        calls.append(ids)
+        return {id: models.Content([], id) for id in ids}
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
+
+    # Contents hydrated before a restart are read from the store
+    upstream_client.store = store.Store(str(tmp_path / "cache.sqlite"))
+    await upstream_client.store.open()
+    upstream_client.store.put_content("1", models.Content(["#one"], "stored"))
+
+    account = models.Account(None, None, None)
+    v2_tweets = {
+        id: models.Tweet(account, None, None, None, None, [], None)
+        for id in ["1", "2"]
+    }
+    try:
+        assert [
+            tweet.text
+            for tweet in await twitter_api.merge_v1_tweets(
+                upstream_client, "token", ["1", "2"], v2_tweets
+            )
+        ] == ["stored", "2"]
+        assert calls == [["2"]]
+        assert upstream_client.tweet_contents.get("1").text == "stored"
+        assert await upstream_client.store.get_contents(["2"]) == {
+            "2": models.Content([], "2")
         }
+    finally:
+        await upstream_client.store.close()
 
-    monkeypatch.setattr(twitter_api, "get_v1_tweet", get_v1_tweet_mock)
 
+async def test_get_v2_tweets_by_id(
+    upstream_client, client_response, monkeypatch
+):
     success_v2_tweets_response = {
         "data": [
             {
+                "id": "1",
                 "author_id": "1234",
                 "created_at": "2011-10-05T14:48:00.000Z",
                 "public_metrics": {
@@ -246,38 +414,49 @@ async def test_get_v2_tweets(client, client_response, monkeypatch):
         "get",
         client_response(success_v2_tweets_response),
     )
-    assert await twitter_api.get_v2_tweets("token", ["1234"]) == [
-        {
-            "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
-            "date": "11:48 PM - 05 Oct 2011",
-            "likes": 1,
-            "replies": 2,
-            "retweets": 3,
-            "hashtags": ["#one", "#two"],
-            "text": "A tweet",
-        }
-    ]
+    assert await twitter_api.get_v2_tweets_by_id(
+        upstream_client, "token", ["1", "2"]
+    ) == {
+        "1": models.Tweet(
+            models.Account("1234", "Bob", "/bob"),
+            "11:48 PM - 05 Oct 2011",
+            1,
+            2,
+            3,
+            [],
+            None,
+        )
+    }
 
     error_response = {"errors": []}
     monkeypatch.setattr(
         aiohttp.ClientSession, "get", client_response(error_response)
     )
+    # Cached tweets are not fetched again
+    assert list(
+        await twitter_api.get_v2_tweets_by_id(upstream_client, "token", ["1"])
+    ) == ["1"]
+
     with pytest.raises(twitter_api.ApiError):
-        await twitter_api.get_v2_tweets("token", ["1234"])
+        await twitter_api.get_v2_tweets_by_id(upstream_client, "token", ["2"])
 
 
-async def test_search_hashtag(client, client_response, monkeypatch):
-    async def get_v1_tweet_mock(*args, **kwargs):
-        return {
-            "hashtags": ["#one", "#two"],
-            "text": "A tweet",
-        }
+def as_dicts(entries):
+    return [tweet.as_dict() for _, tweet in entries]
 
-    monkeypatch.setattr(twitter_api, "get_v1_tweet", get_v1_tweet_mock)
+
+async def test_search_hashtag_entries(
+    upstream_client, client_response, monkeypatch
+):
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        return {id: models.Content(["#one", "#two"], "A tweet") for id in ids}
+
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
 
     success_v2_search_response = {
         "data": [
             {
+                "id": "1",
                 "author_id": "1234",
                 "created_at": "2011-10-05T14:48:00.000Z",
                 "public_metrics": {
@@ -287,6 +466,7 @@ async def test_search_hashtag(client, client_response, monkeypatch):
                 },
             },
             {
+                "id": "2",
                 "author_id": "5678",
                 "created_at": "2011-10-05T14:48:00.000Z",
                 "public_metrics": {
@@ -309,7 +489,11 @@ async def test_search_hashtag(client, client_response, monkeypatch):
         client_response(success_v2_search_response),
     )
 
-    assert await twitter_api.search_hashtag("token", "tag", 1) == [
+    assert as_dicts(
+        await twitter_api.search_hashtag_entries(
+            upstream_client, "token", "tag", 1
+        )
+    ) == [
         {
             "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
             "date": "11:48 PM - 05 Oct 2011",
@@ -321,7 +505,11 @@ async def test_search_hashtag(client, client_response, monkeypatch):
         }
     ]
 
-    assert await twitter_api.search_hashtag("token", "tag", 2) == [
+    assert as_dicts(
+        await twitter_api.search_hashtag_entries(
+            upstream_client, "token", "tag", 2
+        )
+    ) == [
         {
             "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
             "date": "11:48 PM - 05 Oct 2011",
@@ -342,47 +530,72 @@ async def test_search_hashtag(client, client_response, monkeypatch):
         },
     ]
 
+    # Searches with fewer tweets than asked for have no more of them
+    for limit, exhausted in [(2, False), (3, True)]:
+        entries = await twitter_api.search_hashtag_entries(
+            upstream_client, "token", "tag", limit
+        )
+        assert len(entries) == 2
+        assert entries.exhausted is exhausted
+
     error_response = {"errors": []}
     monkeypatch.setattr(
         aiohttp.ClientSession, "get", client_response(error_response)
     )
     with pytest.raises(twitter_api.ApiError):
-        await twitter_api.search_hashtag("token", "tag")
+        await twitter_api.search_hashtag_entries(
+            upstream_client, "token", "tag"
+        )
 
 
-async def test_get_user_tweets(client, client_response, monkeypatch):
-    async def get_v2_tweets_mock(*arg, **kwargs):
-        return [
-            {
-                "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
-                "date": "11:48 PM - 05 Oct 2011",
-                "likes": 1,
-                "replies": 2,
-                "retweets": 3,
-                "hashtags": ["#one", "#two"],
-                "text": "A tweet",
-            },
-            {
-                "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
-                "date": "11:48 PM - 05 Oct 2011",
-                "likes": 1,
-                "replies": 2,
-                "retweets": 3,
-                "hashtags": ["#one", "#two"],
-                "text": "Another tweet",
-            },
-        ]
+async def test_get_user_tweet_entries(
+    upstream_client, client_response, monkeypatch
+):
+    async def get_v2_tweets_by_id_mock(client, authorization, ids, trace=None):
+        return {
+            id: models.Tweet(
+                models.Account("1234", "Bob", "/bob"),
+                "11:48 PM - 05 Oct 2011",
+                1,
+                2,
+                3,
+                [],
+                None,
+            )
+            for id in ids
+        }
 
-    monkeypatch.setattr(twitter_api, "get_v2_tweets", get_v2_tweets_mock)
+    async def get_v1_tweets_mock(client, authorization, ids, trace=None):
+        raise AssertionError("the timeline has the text of its tweets")
+
+    monkeypatch.setattr(
+        twitter_api, "get_v2_tweets_by_id", get_v2_tweets_by_id_mock
+    )
+    monkeypatch.setattr(twitter_api, "get_v1_tweets", get_v1_tweets_mock)
 
-    success_get_user_tweets_response = [{"id": "1234"}]
+    success_get_user_tweets_response = [
+        {
+            "id": 1,
+            "full_text": "A tweet",
+            "entities": {"hashtags": [{"text": "one"}, {"text": "two"}]},
+        },
+        {
+            "id": 2,
+            "full_text": "Another tweet",
+            "entities": {"hashtags": [{"text": "one"}, {"text": "two"}]},
+        },
+    ]
     monkeypatch.setattr(
         aiohttp.ClientSession,
         "get",
         client_response(success_get_user_tweets_response),
     )
 
-    assert await twitter_api.get_user_tweets("token", "user", 1) == [
+    assert as_dicts(
+        await twitter_api.get_user_tweet_entries(
+            upstream_client, "token", "user", 1
+        )
+    ) == [
         {
             "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
             "date": "11:48 PM - 05 Oct 2011",
@@ -394,7 +607,11 @@ async def test_get_user_tweets(client, client_response, monkeypatch):
         },
     ]
 
-    assert await twitter_api.get_user_tweets("token", "user", 2) == [
+    assert as_dicts(
+        await twitter_api.get_user_tweet_entries(
+            upstream_client, "token", "user", 2
+        )
+    ) == [
         {
             "account": {"id": "1234", "fullname": "Bob", "href": "/bob"},
             "date": "11:48 PM - 05 Oct 2011",
@@ -420,4 +637,613 @@ async def test_get_user_tweets(client, client_response, monkeypatch):
         aiohttp.ClientSession, "get", client_response(error_response)
     )
     with pytest.raises(twitter_api.ApiError):
-        await twitter_api.get_user_tweets("token", "user")
+        await twitter_api.get_user_tweet_entries(
+            upstream_client, "token", "user"
+        )
+
+
+async def test_coalesced(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        if "screen_name" not in params:
+            return make_async_json_response_mock({})
+        calls.append(params["screen_name"])
+        return make_async_json_response_mock([])
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    get_user_tweet_entries = twitter_api.get_user_tweet_entries
+    assert (
+        await asyncio.gather(
+            get_user_tweet_entries(upstream_client, "token", "user", 1),
+            get_user_tweet_entries(upstream_client, "token", "user", 1),
+            get_user_tweet_entries(upstream_client, "token", "other", 1),
+            get_user_tweet_entries(upstream_client, "other", "user", 1),
+            get_user_tweet_entries(upstream_client, "token", "user", limit=1),
+        )
+        == [[]] * 5
+    )
+    assert sorted(calls) == ["other", "user", "user"]
+    assert upstream_client.singleflight.flights == {}
+
+
+async def test_get_v2_tweets_by_id_shared(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        calls.append(params["ids"])
+        return make_async_json_response_mock(
+            {
+                "data": [
+                    {"id": id, "author_id": "1"}
+                    for id in params["ids"].split(",")
+                ]
+            }
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    first, second = await asyncio.gather(
+        twitter_api.get_v2_tweets_by_id(upstream_client, "token", ["1", "2"]),
+        twitter_api.get_v2_tweets_by_id(upstream_client, "token", ["2", "3"]),
+    )
+    assert (sorted(first), sorted(second)) == (["1", "2"], ["2", "3"])
+    assert calls == ["1,2", "3"]
+
+
+async def test_iter_merged_tweets(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_BATCH_SIZE", 2)
+    monkeypatch.setattr(config, "UPSTREAM_MAX_CONCURRENCY_PER_REQUEST", 2)
+    releases = {}
+    batches = []
+    cancelled = []
+
+    async def merge_v1_tweets_mock(
+        client, authorization, ids, v2_tweets, trace=None
+    ):
+        batches.append(ids)
+        releases[ids[0]] = asyncio.Event()
+        try:
+            await releases[ids[0]].wait()
+        except asyncio.CancelledError:
+            cancelled.append(ids)
+            raise
+        return [{**v2_tweets[id], "text": id} for id in ids]
+
+    monkeypatch.setattr(twitter_api, "merge_v1_tweets", merge_v1_tweets_mock)
+
+    ids = [str(id) for id in range(5)]
+    tweets = twitter_api.iter_merged_tweets(
+        upstream_client, "token", ids, {id: {"id": id} for id in ids}
+    )
+    first_tweet = asyncio.ensure_future(tweets.__anext__())
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert batches == [["0", "1"], ["2", "3"]]
+
+    releases["2"].set()
+    await asyncio.sleep(0)
+    assert first_tweet.done() is False
+
+    releases["0"].set()
+    assert await first_tweet == ("0", {"id": "0", "text": "0"})
+    assert await tweets.__anext__() == ("1", {"id": "1", "text": "1"})
+    assert batches == [["0", "1"], ["2", "3"]]
+
+    next_tweet = asyncio.ensure_future(tweets.__anext__())
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert batches == [["0", "1"], ["2", "3"], ["4"]]
+    assert await next_tweet == ("2", {"id": "2", "text": "2"})
+
+    await tweets.aclose()
+    await asyncio.sleep(0)
+    assert cancelled == [["4"]]
+
+
+async def test_iter_hashtag(upstream_client, monkeypatch):
+    calls = []
+
+    async def iter_search_pages_mock(
+        client, authorization, hashtag, limit, until_id, trace
+    ):
+        calls.append((hashtag, limit, until_id))
+        yield {"data": [{"id": "1"}], "includes": {"users": []}}
+        yield {"data": [{"id": "2"}], "includes": {"users": []}}
+
+    async def merge_v1_tweets_mock(
+        client, authorization, ids, v2_tweets, trace=None
+    ):
+        return twitter_api.Partial(
+            v2_tweets[id].with_content(models.Content([], id)) for id in ids
+        )
+
+    monkeypatch.setattr(
+        twitter_api, "iter_search_pages", iter_search_pages_mock
+    )
+    monkeypatch.setattr(twitter_api, "merge_v1_tweets", merge_v1_tweets_mock)
+
+    entries = [
+        entry
+        async for entry in twitter_api.iter_hashtag(
+            upstream_client, "token", "tag", 2, twitter_api.encode_cursor("9")
+        )
+    ]
+    assert [(id, tweet.text) for id, tweet in entries] == [
+        ("1", "1"),
+        ("2", "2"),
+    ]
+    assert calls == [("tag", 2, "9")]
+
+    assert [
+        id
+        for id, _ in await twitter_api.search_hashtag_entries(
+            upstream_client, "token", "tag", 2
+        )
+    ] == ["1", "2"]
+    assert calls == [("tag", 2, "9"), ("tag", 2, None)]
+
+
+async def test_iter_user_tweets(upstream_client, monkeypatch):
+    calls = []
+
+    async def iter_timeline_pages_mock(
+        client, authorization, username, limit, until_id, trace
+    ):
+        calls.append((username, limit, until_id))
+        yield [{"id": 1, "full_text": "1"}, {"id": 2, "full_text": "2"}]
+        yield [{"id": 3, "full_text": "3"}]
+
+    async def get_v2_tweets_by_id_mock(client, authorization, ids, trace=None):
+        return {
+            id: models.Tweet(
+                models.Account(id, None, None), None, 1, 2, 3, [], None
+            )
+            for id in ids
+            if id != "2"
+        }
+
+    monkeypatch.setattr(
+        twitter_api, "iter_timeline_pages", iter_timeline_pages_mock
+    )
+    monkeypatch.setattr(
+        twitter_api, "get_v2_tweets_by_id", get_v2_tweets_by_id_mock
+    )
+
+    assert [
+        (id, tweet.account.id, tweet.text)
+        async for id, tweet in twitter_api.iter_user_tweets(
+            upstream_client, "token", "user", 3
+        )
+    ] == [("1", "1", "1"), ("3", "3", "3")]
+    assert calls == [("user", 3, None)]
+    # Contents of the timeline are cached for other requests
+    assert upstream_client.tweet_contents.get("2").text == "2"
+
+    # Tweets left out of the timeline pages don't make them exhausted
+    for limit, exhausted in [(3, False), (4, True)]:
+        entries = await twitter_api.get_user_tweet_entries(
+            upstream_client, "token", "user", limit
+        )
+        assert [id for id, _ in entries] == ["1", "3"]
+        assert entries.exhausted is exhausted
+
+
+async def test_user_tweets_v2_deadline(upstream_client, monkeypatch):
+    async def iter_timeline_pages_mock(
+        client, authorization, username, limit, until_id, trace
+    ):
+        yield [
+            {
+                "id": 1,
+                "created_at": "Wed Oct 05 14:48:00 +0000 2011",
+                "user": {"id_str": "1234"},
+                "full_text": "1",
+            },
+            {"id": 2, "full_text": "2"},
+        ]
+
+    async def get_v2_tweets_by_id_mock(client, authorization, ids, trace=None):
+        raise deadline.DeadlineExceeded()
+
+    monkeypatch.setattr(
+        twitter_api, "iter_timeline_pages", iter_timeline_pages_mock
+    )
+    monkeypatch.setattr(
+        twitter_api, "get_v2_tweets_by_id", get_v2_tweets_by_id_mock
+    )
+    upstream_client.tweet_metrics.put(
+        "2",
+        models.Tweet(
+            models.Account("1234", "Bob", "/bob"), None, 1, 2, 3, [], None
+        ),
+    )
+
+    token = deadline.request_deadline.set(deadline.Deadline(None))
+    try:
+        entries = await twitter_api.get_user_tweet_entries(
+            upstream_client, "token", "bob", 2
+        )
+        # The timeline rows are kept, with the v2 data cached so far
+        assert entries == [
+            (
+                "1",
+                models.Tweet(
+                    models.Account("1234", None, "/bob"),
+                    "11:48 PM - 05 Oct 2011",
+                    None,
+                    None,
+                    None,
+                    [],
+                    "1",
+                ),
+            ),
+            (
+                "2",
+                models.Tweet(
+                    models.Account("1234", "Bob", "/bob"),
+                    None,
+                    1,
+                    2,
+                    3,
+                    [],
+                    "2",
+                ),
+            ),
+        ]
+        assert entries.degraded is True
+        assert deadline.degraded()
+    finally:
+        deadline.request_deadline.reset(token)
+
+
+async def test_entries_deadline(upstream_client, monkeypatch):
+    pages = []
+
+    async def iter_pages_mock(
+        client, authorization, name, limit, until_id, trace
+    ):
+        for page in pages:
+            if page is None:
+                raise deadline.DeadlineExceeded()
+            yield page
+
+    async def merge_v1_tweets_mock(
+        client, authorization, ids, v2_tweets, trace=None
+    ):
+        merged = twitter_api.Partial(v2_tweets[id] for id in ids)
+        merged.degraded = "3" in ids
+        return merged
+
+    async def merge_timeline_tweets_mock(
+        client, authorization, username, user_results, trace=None
+    ):
+        merged = twitter_api.Partial(
+            (tweet["id"], tweet) for tweet in user_results
+        )
+        merged.degraded = {"id": "3"} in user_results
+        return merged
+
+    monkeypatch.setattr(twitter_api, "iter_search_pages", iter_pages_mock)
+    monkeypatch.setattr(twitter_api, "iter_timeline_pages", iter_pages_mock)
+    monkeypatch.setattr(twitter_api, "merge_v1_tweets", merge_v1_tweets_mock)
+    monkeypatch.setattr(
+        twitter_api, "merge_timeline_tweets", merge_timeline_tweets_mock
+    )
+
+    async def get_entries(function, name):
+        return await function(upstream_client, "token", name, 2)
+
+    pages[:] = [{"data": [{"id": "1"}]}, None]
+    search_entries = await get_entries(
+        twitter_api.search_hashtag_entries, "tag"
+    )
+    pages[:] = [[{"id": "1"}], None]
+    user_entries = await get_entries(
+        twitter_api.get_user_tweet_entries, "user"
+    )
+    # Pages found before the deadline are returned as degraded entries
+    for entries in [search_entries, user_entries]:
+        assert [id for id, _ in entries] == ["1"]
+        assert entries.degraded is True
+
+    pages[:] = [[{"id": "1"}], [{"id": "2"}]]
+    entries = await get_entries(twitter_api.get_user_tweet_entries, "other")
+    assert [id for id, _ in entries] == ["1", "2"]
+    assert entries.degraded is False
+
+    # Entries are degraded by any page missing tweet contents or metrics
+    pages[:] = [{"data": [{"id": "3"}]}, {"data": [{"id": "4"}]}]
+    entries = await get_entries(twitter_api.search_hashtag_entries, "other")
+    assert [id for id, _ in entries] == ["3", "4"]
+    assert entries.degraded is True
+    pages[:] = [[{"id": "3"}], [{"id": "4"}]]
+    entries = await get_entries(twitter_api.get_user_tweet_entries, "other")
+    assert [id for id, _ in entries] == ["3", "4"]
+    assert entries.degraded is True
+
+    pages[:] = [None]
+    with pytest.raises(deadline.DeadlineExceeded):
+        await get_entries(twitter_api.search_hashtag_entries, "none")
+    with pytest.raises(deadline.DeadlineExceeded):
+        await get_entries(twitter_api.get_user_tweet_entries, "none")
+
+
+async def test_entries_caller_deadlines(upstream_client, monkeypatch):
+    calls = []
+    delays = {upstream.SEARCH_RECENT: 0.1, upstream.V1_LOOKUP: 0}
+
+    async def get_json_mock(family, url, authorization, params=None):
+        calls.append(family)
+        await asyncio.sleep(delays[family])
+        if family == upstream.SEARCH_RECENT:
+            return {"data": [{"id": params["query"]}]}
+        return [
+            {"id_str": id, "full_text": "text", "entities": {"hashtags": []}}
+            for id in params["id"].split(",")
+        ]
+
+    monkeypatch.setattr(upstream_client, "get_json", get_json_mock)
+
+    async def search(hashtag, timeout):
+        # Each caller is a request with its own deadline
+        expires_at = None if timeout is None else monotonic() + timeout
+        deadline.request_deadline.set(deadline.Deadline(expires_at))
+        return await twitter_api.search_hashtag_entries(
+            upstream_client, "token", hashtag, 1
+        )
+
+    # A caller with a short deadline doesn't cut the shared search short
+    short, long = await asyncio.gather(
+        search("one", 0.05), search("one", 1), return_exceptions=True
+    )
+    assert isinstance(short, deadline.DeadlineExceeded)
+    assert [tweet.text for _, tweet in long] == ["text"]
+    assert long.degraded is False
+    assert calls == [upstream.SEARCH_RECENT, upstream.V1_LOOKUP]
+
+    # Callers joining work without a deadline are still bounded
+    unbounded, short = await asyncio.gather(
+        search("two", None), search("two", 0.05), return_exceptions=True
+    )
+    assert isinstance(short, deadline.DeadlineExceeded)
+    assert [tweet.text for _, tweet in unbounded] == ["text"]
+
+    # Shared hydrations degrade only the callers past their deadline
+    delays.update({upstream.SEARCH_RECENT: 0, upstream.V1_LOOKUP: 0.1})
+    calls.clear()
+    short, long = await asyncio.gather(
+        search("three", 0.05), search("three", 1)
+    )
+    assert [tweet.text for _, tweet in short] == [None]
+    assert short.degraded is True
+    assert [tweet.text for _, tweet in long] == ["text"]
+    assert long.degraded is False
+    assert calls == [upstream.SEARCH_RECENT, upstream.V1_LOOKUP]
+
+
+async def test_user_tweets_match_v1_lookup(upstream_client, monkeypatch):
+    v1_tweet = {
+        "id": 5,
+        "id_str": "5",
+        "full_text": "RT @bob: A retweet…",
+        "entities": {"hashtags": []},
+        "retweeted_status": {
+            "full_text": "A retweet with the full text #one",
+            "entities": {"hashtags": [{"text": "one"}]},
+        },
+    }
+    v2_tweet = {
+        "id": "5",
+        "author_id": "1",
+        "created_at": "2011-10-05T14:48:00.000Z",
+        "public_metrics": {
+            "like_count": 1,
+            "reply_count": 2,
+            "retweet_count": 3,
+        },
+    }
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        calls.append(url)
+        if url == config.TWITTER_API_V1_USER_TIMELINE:
+            return make_async_json_response_mock([v1_tweet])
+        if url == config.TWITTER_API_V1_TWEETS_LOOKUP:
+            return make_async_json_response_mock([v1_tweet])
+        return make_async_json_response_mock(
+            {
+                "data": [v2_tweet],
+                "includes": {
+                    "users": [{"id": "1", "name": "Bob", "username": "bob"}]
+                },
+            }
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+    stored = []
+    upstream_client.store = types.SimpleNamespace(
+        put_content=lambda id, content: stored.append(id)
+    )
+
+    entries = await twitter_api.get_user_tweet_entries(
+        upstream_client, "token", "bob", 1
+    )
+    # Only the timeline and the v2 metrics are fetched
+    assert calls == [
+        config.TWITTER_API_V1_USER_TIMELINE,
+        config.TWITTER_API_V2_TWEETS,
+    ]
+    assert stored == ["5"]
+
+    # Same bytes as hydrating the tweet with a v1 lookup
+    upstream_client.tweet_contents.entries.clear()
+    upstream_client.store = None
+    looked_up = await twitter_api.merge_v1_tweets(
+        upstream_client,
+        "token",
+        ["5"],
+        await twitter_api.get_v2_tweets_by_id(upstream_client, "token", ["5"]),
+    )
+    assert calls[-1] == config.TWITTER_API_V1_TWEETS_LOOKUP
+    assert codec.dumps([tweet for _, tweet in entries]) == codec.dumps(
+        looked_up
+    )
+
+
+def test_cursor():
+    assert twitter_api.decode_cursor(None) is None
+    assert (
+        twitter_api.decode_cursor(twitter_api.encode_cursor("1234")) == "1234"
+    )
+    assert "=" not in twitter_api.encode_cursor("1")
+
+    for cursor in ["", "!", "A", "YWJj", "é"]:
+        with pytest.raises(twitter_api.ApiError) as error:
+            twitter_api.decode_cursor(cursor)
+        assert error.value.status == 400
+
+
+async def test_get_search_recent(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        calls.append(params)
+        return make_async_json_response_mock({"data": []})
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    await twitter_api.get_search_recent(upstream_client, "token", "tag", 1)
+    await twitter_api.get_search_recent(
+        upstream_client, "token", "tag", 500, "9", "next"
+    )
+    assert calls == [
+        {
+            "query": "#tag",
+            "tweet.fields": "created_at,public_metrics,entities",
+            "expansions": "author_id",
+            "max_results": config.TWITTER_MIN_SEARCH_RESULTS,
+        },
+        {
+            "query": "#tag",
+            "tweet.fields": "created_at,public_metrics,entities",
+            "expansions": "author_id",
+            "max_results": config.TWITTER_MAX_SEARCH_RESULTS,
+            "until_id": "9",
+            "next_token": "next",
+        },
+    ]
+
+
+async def test_iter_search_pages(upstream_client, monkeypatch):
+    calls = []
+
+    async def get_search_recent_mock(
+        client, authorization, hashtag, limit, until_id, next_token=None
+    ):
+        calls.append((limit, until_id, next_token))
+        page = int(next_token or 0)
+        return {
+            "data": [{"id": f"{page}-{index}"} for index in range(10)],
+            "meta": {"next_token": str(page + 1)} if page < 2 else {},
+        }
+
+    monkeypatch.setattr(
+        twitter_api, "get_search_recent", get_search_recent_mock
+    )
+
+    pages = twitter_api.iter_search_pages(
+        upstream_client, "token", "tag", 25, "9"
+    )
+    page = await pages.__anext__()
+    assert len(page["data"]) == 10
+    await asyncio.sleep(0)
+    assert calls == [(25, "9", None), (15, "9", "1")]
+
+    assert [len(page["data"]) async for page in pages] == [10, 5]
+    assert calls == [(25, "9", None), (15, "9", "1"), (5, "9", "2")]
+
+    calls.clear()
+    assert [
+        len(page["data"])
+        async for page in twitter_api.iter_search_pages(
+            upstream_client, "token", "tag", 100, None
+        )
+    ] == [10, 10, 10]
+    assert len(calls) == 3
+
+    pages = twitter_api.iter_search_pages(
+        upstream_client, "token", "tag", 100, None
+    )
+    await pages.__anext__()
+    await pages.aclose()
+
+
+async def test_get_user_timeline(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, url, params, headers):
+        calls.append(params)
+        return make_async_json_response_mock([])
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    await twitter_api.get_user_timeline(upstream_client, "token", "user", 1)
+    await twitter_api.get_user_timeline(
+        upstream_client, "token", "user", 500, "9"
+    )
+    assert calls == [
+        {
+            "screen_name": "user",
+            "trim_user": "true",
+            "tweet_mode": "extended",
+            "count": 1,
+        },
+        {
+            "screen_name": "user",
+            "trim_user": "true",
+            "tweet_mode": "extended",
+            "count": config.TWITTER_MAX_TIMELINE_RESULTS,
+            "max_id": "9",
+        },
+    ]
+
+
+async def test_iter_timeline_pages(upstream_client, monkeypatch):
+    calls = []
+
+    async def get_user_timeline_mock(
+        client, authorization, username, limit, max_id
+    ):
+        calls.append((limit, max_id))
+        start = int(max_id) if max_id is not None else 100
+        return [{"id": id} for id in range(start, max(start - 10, 30), -1)]
+
+    monkeypatch.setattr(
+        twitter_api, "get_user_timeline", get_user_timeline_mock
+    )
+
+    pages = twitter_api.iter_timeline_pages(
+        upstream_client, "token", "user", 15, "51"
+    )
+    assert len(await pages.__anext__()) == 10
+    await asyncio.sleep(0)
+    assert calls == [(15, "50"), (5, "40")]
+    assert [len(page) async for page in pages] == [5]
+
+    calls.clear()
+    assert [
+        len(page)
+        async for page in twitter_api.iter_timeline_pages(
+            upstream_client, "token", "user", 100, None
+        )
+    ] == [10] * 7 + [0]
+    assert calls[:3] == [(100, None), (90, "90"), (80, "80")]
+
+    pages = twitter_api.iter_timeline_pages(
+        upstream_client, "token", "user", 100, None
+    )
+    await pages.__anext__()
+    await pages.aclose()
@@ -0,0 +1,381 @@
+import aiohttp
+import asyncio
+import pytest
+import time
+
+from aiohttp import web
+
+from api import upstream, breaker, config, deadline, errors, metrics
+from .conftest import make_async_json_response_mock
+
+
+async def test_get_json(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, *args, **kwargs):
+        calls.append((args, kwargs))
+        return make_async_json_response_mock({"json": "payload"})
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    assert (
+        await upstream_client.get_json(
+            upstream.SEARCH_RECENT,
+            "https://example.com",
+            "token",
+            params={"param": "value"},
+        )
+        == {"json": "payload"}
+    )
+    assert await upstream_client.get_json(
+        upstream.SEARCH_RECENT, "https://example.com", "another token"
+    ) == {"json": "payload"}
+    assert calls == [
+        (
+            ("https://example.com",),
+            {
+                "params": {"param": "value"},
+                "headers": {"Authorization": "token"},
+            },
+        ),
+        (
+            ("https://example.com",),
+            {"params": None, "headers": {"Authorization": "another token"}},
+        ),
+    ]
+
+
+def make_responses_mock(calls, responses):
+    def get_mock(self, *args, **kwargs):
+        calls.append(args)
+        return make_async_json_response_mock(*responses.pop(0))
+
+    return get_mock
+
+
+async def test_get_json_retries(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_BACKOFF_BASE", 0)
+    calls = []
+
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(
+            calls, [({}, 503), ({}, 429), ({"json": "payload"}, 200)]
+        ),
+    )
+    assert await upstream_client.get_json(
+        upstream.V1_TIMELINE, "https://example.com", "token"
+    ) == {"json": "payload"}
+    assert len(calls) == 3
+
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(calls, [({}, 500), ({}, 502), ({}, 503)]),
+    )
+    with pytest.raises(errors.ApiError) as error:
+        await upstream_client.get_json(
+            upstream.V1_TIMELINE, "https://example.com", "token"
+        )
+    assert error.value.status == 503
+    assert len(calls) == 6
+
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(calls, [({}, 429), ({}, 429), ({}, 429)]),
+    )
+    with pytest.raises(errors.ApiError) as error:
+        await upstream_client.get_json(
+            upstream.V1_TIMELINE, "https://example.com", "token"
+        )
+    assert error.value.status == 429
+    assert error.value.headers == {
+        "Retry-After": str(config.UPSTREAM_BACKOFF_MAX)
+    }
+    assert len(calls) == 9
+
+
+async def test_get_json_transport_errors(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_BACKOFF_BASE", 0)
+    errors_raised = [
+        aiohttp.ClientConnectionError(),
+        asyncio.TimeoutError(),
+    ]
+
+    def get_mock(self, *args, **kwargs):
+        if errors_raised:
+            raise errors_raised.pop(0)
+        return make_async_json_response_mock({"json": "payload"})
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+
+    # Failed connections and timeouts are retried like 5xx answers
+    assert await upstream_client.get_json(
+        upstream.V2_TWEETS, "https://example.com", "token"
+    ) == {"json": "payload"}
+
+    errors_raised[:] = [asyncio.TimeoutError()] * 3
+    with pytest.raises(errors.ApiError) as error:
+        await upstream_client.get_json(
+            upstream.V2_TWEETS, "https://example.com", "token"
+        )
+    assert error.value.status == 503
+    assert str(error.value) == (
+        "Twitter API error: Service unavailable (status: TimeoutError)"
+    )
+
+
+async def test_get_json_rate_limit(upstream_client, monkeypatch):
+    calls = []
+    reset = str(time.time() + 3600)
+
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(
+            calls,
+            [
+                (
+                    {},
+                    429,
+                    {
+                        "x-rate-limit-remaining": "0",
+                        "x-rate-limit-reset": reset,
+                    },
+                )
+            ],
+        ),
+    )
+    with pytest.raises(errors.ApiError) as error:
+        await upstream_client.get_json(
+            upstream.V1_TIMELINE, "https://example.com", "token"
+        )
+    assert error.value.status == 429
+    assert error.value.headers == {"Retry-After": "3600"}
+    assert len(calls) == 1
+
+
+async def test_get_json_metrics(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_BACKOFF_BASE", 0)
+    calls = []
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(calls, [({}, 503), ({"json": "payload"}, 200)]),
+    )
+
+    fan_out = metrics.FanOut()
+    token = metrics.request_fan_out.set(fan_out)
+    try:
+        await upstream_client.get_json(
+            upstream.V2_TWEETS, "https://example.com", "token"
+        )
+    finally:
+        metrics.request_fan_out.reset(token)
+    assert fan_out.calls == 2
+
+    def get_error_mock(self, *args, **kwargs):
+        raise aiohttp.ClientConnectionError()
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_error_mock)
+    with pytest.raises(errors.ApiError):
+        await upstream_client.get_json(
+            upstream.V2_TWEETS, "https://example.com", "token"
+        )
+
+    series = upstream_client.metrics.requests.series[upstream.V2_TWEETS]
+    assert {status: sum(h.counts) for status, h in series.items()} == {
+        503: 1,
+        200: 1,
+        "error": config.UPSTREAM_MAX_ATTEMPTS,
+    }
+
+
+async def test_get_json_breaker(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_BACKOFF_BASE", 0)
+    monkeypatch.setattr(config, "BREAKER_MIN_CALLS", 3)
+    monkeypatch.setattr(config, "BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(config, "BREAKER_SLOW_CALL", 3600)
+    calls = []
+    monkeypatch.setattr(
+        aiohttp.ClientSession,
+        "get",
+        make_responses_mock(
+            calls,
+            [({}, 429), ({}, 200), ({}, 503), ({}, 503), ({"slow": 1}, 200)],
+        ),
+    )
+
+    # Rate limited calls are not failures of the endpoint
+    assert (
+        await upstream_client.get_json(
+            upstream.V1_LOOKUP, "https://example.com", "token"
+        )
+        == {}
+    )
+    circuit = upstream_client.breakers[upstream.V1_LOOKUP]
+    assert list(circuit.outcomes) == [False, False]
+
+    # Failing endpoints are not called again while their breaker is open
+    with pytest.raises(breaker.CircuitOpen):
+        await upstream_client.get_json(
+            upstream.V1_LOOKUP, "https://example.com", "token"
+        )
+    assert len(calls) == 4
+    assert circuit.current() == breaker.OPEN
+    assert circuit.rejections == 1
+
+    with pytest.raises(breaker.CircuitOpen) as error:
+        await upstream_client.get_json(
+            upstream.V1_LOOKUP, "https://example.com", "token"
+        )
+    assert error.value.headers == {
+        "Retry-After": str(config.BREAKER_OPEN_TIME)
+    }
+    assert len(calls) == 4
+    assert upstream_client.breakers[upstream.V2_TWEETS].current() == (
+        breaker.CLOSED
+    )
+
+    # Slow calls are failures too
+    monkeypatch.setattr(config, "BREAKER_SLOW_CALL", 0)
+    assert await upstream_client.get_json(
+        upstream.V2_TWEETS, "https://example.com", "token"
+    ) == {"slow": 1}
+    assert list(upstream_client.breakers[upstream.V2_TWEETS].outcomes) == [
+        True
+    ]
+
+
+async def test_get_json_hedged(upstream_client, monkeypatch):
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(config, "UPSTREAM_HEDGE_MIN_DELAY", 0.01)
+    upstream_client.hedger.tokens = 1
+    calls = []
+
+    class SlowResponse:
+        def __init__(self, response, delay):
+            self.response = response
+            self.delay = delay
+
+        async def __aenter__(self):
+            await asyncio.sleep(self.delay)
+            return self.response
+
+        async def __aexit__(self, *error_info):
+            pass
+
+    def get_mock(self, *args, **kwargs):
+        calls.append(args)
+        # The first call hangs until cancelled
+        return SlowResponse(
+            make_async_json_response_mock({"call": len(calls)}),
+            3600 if len(calls) == 1 else 0,
+        )
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+    upstream_client.hedger.observe(upstream.V1_LOOKUP, 0.01)
+
+    assert await upstream_client.get_json(
+        upstream.V1_LOOKUP, "https://example.com", "token"
+    ) == {"call": 2}
+    assert upstream_client.hedger.wins == 1
+    await asyncio.sleep(0)
+    series = upstream_client.metrics.requests.series[upstream.V1_LOOKUP]
+    assert {status: sum(h.counts) for status, h in series.items()} == {
+        200: 1,
+        "cancelled": 1,
+    }
+
+
+async def test_get_json_deadline(upstream_client, monkeypatch):
+    calls = []
+
+    def get_mock(self, *args, **kwargs):
+        calls.append(args)
+        return make_async_json_response_mock({}, status=503)
+
+    monkeypatch.setattr(aiohttp.ClientSession, "get", get_mock)
+    monkeypatch.setattr(config, "UPSTREAM_BACKOFF_BASE", 1)
+
+    # Retries wait for their backoff only until the deadline
+    token = deadline.request_deadline.set(
+        deadline.Deadline(time.monotonic() + 0.05)
+    )
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            await upstream_client.get_json(
+                upstream.V1_LOOKUP, "https://example.com", "token"
+            )
+        assert len(calls) == 1
+
+        with pytest.raises(deadline.DeadlineExceeded):
+            await upstream_client.get_json(
+                upstream.V1_LOOKUP, "https://example.com", "token"
+            )
+        assert len(calls) == 1
+    finally:
+        deadline.request_deadline.reset(token)
+
+
+def test_can_hedge(upstream_client):
+    assert upstream_client.can_hedge(upstream.V1_LOOKUP, "token") is True
+
+    upstream_client.budgets.update(
+        upstream.V1_LOOKUP,
+        "token",
+        {
+            "x-rate-limit-limit": "100",
+            "x-rate-limit-remaining": "40",
+            "x-rate-limit-reset": str(time.time() + 60),
+        },
+    )
+    assert upstream_client.can_hedge(upstream.V1_LOOKUP, "token") is False
+    assert upstream_client.can_hedge(upstream.V1_LOOKUP, "other") is True
+
+    upstream_client.limiter.waiting = 1
+    assert upstream_client.can_hedge(upstream.V1_LOOKUP, "other") is False
+
+
+def test_backoff(monkeypatch):
+    assert 0 < upstream.backoff(1) <= config.UPSTREAM_BACKOFF_BASE
+    assert upstream.backoff(100) <= config.UPSTREAM_BACKOFF_MAX
+
+    monkeypatch.setattr(upstream.random, "uniform", lambda low, high: high)
+    assert upstream.backoff(2) == config.UPSTREAM_BACKOFF_BASE * 2
+
+
+async def test_make_session(monkeypatch):
+    sessions = []
+    monkeypatch.setattr(
+        aiohttp, "ClientSession", lambda **kwargs: sessions.append(kwargs)
+    )
+    upstream.make_session()
+
+    [session] = sessions
+    connector = session["connector"]
+    try:
+        assert connector.limit == config.UPSTREAM_POOL_SIZE
+        assert connector.limit_per_host == config.UPSTREAM_POOL_SIZE_PER_HOST
+        assert session["timeout"] == aiohttp.ClientTimeout(
+            total=config.UPSTREAM_TIMEOUT,
+            connect=config.UPSTREAM_CONNECT_TIMEOUT,
+        )
+    finally:
+        await connector.close()
+
+
+async def test_client_context():
+    app = web.Application()
+    context = upstream.client_context(app)
+
+    await context.__anext__()
+    client = app["upstream"]
+    assert isinstance(client, upstream.Client)
+    assert client.session.closed is False
+
+    async for _ in context:
+        pass
+    assert client.session.closed is True
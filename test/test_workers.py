@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import os
+import sys
+
+import pytest
+from aiohttp import web
+
+from api import config, server, workers
+
+API_WORKER = [
+    sys.executable,
+    "-m",
+    "api",
+    "--host",
+    "127.0.0.1",
+    "--port",
+    "0",
+]
+
+# Answers health checks on the socket given as last argument
+FAKE_WORKER = [
+    sys.executable,
+    "-c",
+    "import sys\n"
+    "from aiohttp import web\n"
+    "async def health(req):\n"
+    "    return web.Response()\n"
+    "app = web.Application()\n"
+    "app.router.add_get('/health', health)\n"
+    "web.run_app(app, path=sys.argv[-1], print=None)\n",
+]
+
+
+# Longest seconds a test waits on a worker process
+PROCESS_TIMEOUT = 30
+
+
+async def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("condition not met")
+
+
+@pytest.fixture
+def spawned(loop, monkeypatch):
+    # The test loop comes with a child watcher bound to it, left broken once
+    # an earlier test closed its own loop. A threaded watcher works with any
+    # loop
+    watcher = asyncio.ThreadedChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.get_event_loop_policy().set_child_watcher(watcher)
+
+    spawned = []
+    spawn = workers.Supervisor.spawn
+
+    async def record(self, index):
+        worker = await spawn(self, index)
+        spawned.append(worker)
+        return worker
+
+    monkeypatch.setattr(workers.Supervisor, "spawn", record)
+    yield spawned
+
+    # Workers left by a failed test don't outlive it
+    async def kill():
+        for worker in spawned:
+            if worker.process.returncode is None:
+                worker.process.kill()
+                await asyncio.wait_for(worker.process.wait(), PROCESS_TIMEOUT)
+
+    loop.run_until_complete(kill())
+    watcher.close()
+
+
+def test_latest_sockets(tmp_path):
+    for name in ["0.1.sock", "1.2.sock", "0.3.sock"]:
+        (tmp_path / name).touch()
+    assert workers.latest_sockets(str(tmp_path)) == {
+        0: str(tmp_path / "0.3.sock"),
+        1: str(tmp_path / "1.2.sock"),
+    }
+
+
+async def test_collect_metrics(tmp_path):
+    async def metrics_view(req):
+        assert req.query["scope"] == "worker"
+        return web.Response(text="sibling")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.UnixSite(runner, str(tmp_path / "1.2.sock")).start()
+
+    own_socket = str(tmp_path / "0.1.sock")
+    (tmp_path / "0.1.sock").touch()
+    # A worker that already stopped listening
+    (tmp_path / "2.3.sock").touch()
+
+    try:
+        assert await workers.collect_metrics(own_socket, "own") == {
+            "0": "own",
+            "1": "sibling",
+        }
+    finally:
+        await runner.cleanup()
+
+
+async def test_metrics_view_workers(aiohttp_client, monkeypatch):
+    async def collect_metrics(own_socket, own_text):
+        assert own_socket == "/tmp/0.1.sock"
+        return {"0": "# TYPE a gauge\na 1\n", "1": "# TYPE a gauge\na 2\n"}
+
+    monkeypatch.setattr(workers, "collect_metrics", collect_metrics)
+    app = server.make_app()
+    app["worker_socket"] = "/tmp/0.1.sock"
+    client = await aiohttp_client(app)
+
+    res = await client.get("/metrics")
+    assert await res.text() == (
+        '# TYPE a gauge\na{worker="0"} 1\na{worker="1"} 2\n'
+    )
+
+    res = await client.get("/metrics?scope=worker")
+    assert "api_requests_in_flight 1" in await res.text()
+
+
+async def test_supervisor(tmp_path, spawned, monkeypatch):
+    monkeypatch.setattr(config, "WORKER_HEALTH_CHECK_INTERVAL", 0.05)
+    supervisor = workers.Supervisor(API_WORKER, 2, str(tmp_path))
+    run = asyncio.ensure_future(supervisor.run())
+    try:
+        await wait_for(lambda: supervisor.wake is not None or run.done())
+        assert not run.done()
+
+        started = dict(supervisor.workers)
+        assert sorted(os.listdir(tmp_path)) == ["0.1.sock", "1.2.sock"]
+        assert all([await supervisor.check(w) for w in started.values()])
+
+        # Workers that exit are replaced
+        started[0].process.kill()
+        await wait_for(lambda: supervisor.workers[0] is not started[0])
+        assert supervisor.workers[1] is started[1]
+        assert await supervisor.check(supervisor.workers[0])
+
+        # Old workers and their sockets go away once replaced
+        supervisor.request_restart()
+        await wait_for(
+            lambda: sorted(os.listdir(tmp_path)) == ["0.4.sock", "1.5.sock"]
+        )
+    finally:
+        supervisor.request_stop()
+        status = await asyncio.wait_for(run, PROCESS_TIMEOUT)
+    assert status == 0
+    assert os.listdir(tmp_path) == []
+    assert all(worker.process.returncode is not None for worker in spawned)
+
+
+async def test_supervisor_start_error(tmp_path, spawned):
+    supervisor = workers.Supervisor(
+        [sys.executable, "-c", "pass"], 2, str(tmp_path)
+    )
+    assert await asyncio.wait_for(supervisor.run(), PROCESS_TIMEOUT) == 1
+    assert os.listdir(tmp_path) == []
+
+
+async def test_supervisor_unhealthy(tmp_path, spawned, monkeypatch):
+    monkeypatch.setattr(config, "WORKER_HEALTH_CHECK_FAILURES", 2)
+    supervisor = workers.Supervisor(FAKE_WORKER, 1, str(tmp_path))
+    supervisor.workers = {0: await supervisor.start(0)}
+    monkeypatch.setattr(config, "WORKER_START_TIMEOUT", 0.2)
+    worker = supervisor.workers[0]
+    check = supervisor.check
+
+    async def unhealthy(worker):
+        return False
+
+    try:
+        monkeypatch.setattr(supervisor, "check", unhealthy)
+        await supervisor.check_workers()
+        assert worker.failures == 1
+        # Replacements that don't start leave the worker in place
+        await supervisor.check_workers()
+        await supervisor.rolling_restart()
+        assert supervisor.workers[0] is worker
+        assert worker.failures == 2
+
+        monkeypatch.setattr(supervisor, "check", check)
+        await supervisor.check_workers()
+        assert worker.failures == 0
+
+        # Workers replaced after failing their checks in a row
+        async def old_unhealthy(checked):
+            return checked is not worker and await check(checked)
+
+        monkeypatch.setattr(config, "WORKER_START_TIMEOUT", 30)
+        monkeypatch.setattr(supervisor, "check", old_unhealthy)
+        await supervisor.check_workers()
+        assert supervisor.workers[0] is worker
+        await supervisor.check_workers()
+        assert supervisor.workers[0] is not worker
+        assert worker.process.returncode is not None
+    finally:
+        await asyncio.wait_for(
+            supervisor.stop(supervisor.workers[0]), PROCESS_TIMEOUT
+        )
+
+
+async def test_supervisor_stop_timeout(tmp_path, spawned, monkeypatch):
+    monkeypatch.setattr(config, "WORKER_STOP_TIMEOUT", 0.1)
+    supervisor = workers.Supervisor(
+        [
+            sys.executable,
+            "-c",
+            "import signal, time\n"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "print('ready', flush=True)\n"
+            "time.sleep(60)\n",
+        ],
+        1,
+        str(tmp_path),
+    )
+    worker = await supervisor.spawn(0)
+    await asyncio.sleep(0.5)
+    await asyncio.wait_for(supervisor.stop(worker), PROCESS_TIMEOUT)
+    assert worker.process.returncode == -9
+
+
+@pytest.mark.parametrize(
+    "worker_socket,count,expected",
+    [
+        ("/tmp/0.1.sock", 4, "worker"),
+        (None, 1, "single"),
+        (None, 4, "supervisor"),
+    ],
+)
+def test_serve(worker_socket, count, expected, monkeypatch):
+    calls = []
+
+    async def run(supervisor):
+        calls.append(("supervisor", supervisor.command, supervisor.count))
+        return 0
+
+    def run_app(app, **kwargs):
+        calls.append(
+            ("worker" if "path" in kwargs else "single", kwargs.get("path"))
+        )
+
+    monkeypatch.setattr(workers.Supervisor, "run", run)
+    monkeypatch.setattr(web, "run_app", run_app)
+    monkeypatch.setattr(sys, "argv", ["api", "--workers", str(count)])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=8080)
+    workers.add_arguments(parser)
+    args = parser.parse_args(
+        ["--workers", str(count)]
+        + (["--worker-socket", worker_socket] if worker_socket else [])
+    )
+
+    app = web.Application()
+    if expected == "supervisor":
+        with pytest.raises(SystemExit) as exit:
+            workers.serve(app, "api", args)
+        assert exit.value.code == 0
+        assert calls == [
+            ("supervisor", [sys.executable, "-m", "api", "--workers", "4"], 4)
+        ]
+    else:
+        workers.serve(app, "api", args)
+        assert calls == [(expected, worker_socket)]
+        assert app.get("worker_socket") == worker_socket
+
+
+def test_serve_without_reuse_port(monkeypatch):
+    monkeypatch.delattr(workers.socket, "SO_REUSEPORT")
+    args = argparse.Namespace(workers=2, worker_socket=None)
+    with pytest.raises(SystemExit):
+        workers.serve(web.Application(), "api", args)